@@ -0,0 +1,73 @@
+"""
+    Gorilla blocks encode/decode benchmark.
+    Synthetic readouts of regular sensors (small timing jitter, values from
+    sensors.signal.Signal) are stored as JSON lines, binary records and
+    Gorilla blocks; the sizes and the encode/decode throughputs are printed.
+
+    (env)> python -m benchmarks.gorilla [n_sensors] [n_points]
+"""
+
+import random
+import sys
+import time
+
+from sensors.signal import Signal
+from service.model.codec import encode_readout, message_to_text, RECORD, \
+    register_sensor
+from service.model.messages import DeviceMessage, DeviceMessageEnum
+from service.repository.gorilla import GorillaEncoder, decode_blocks
+
+N_SENSORS = 20
+N_POINTS = 5000
+JITTER = 0.0005                     # 0.5 ms
+
+
+def make_messages(n_sensors: int, n_points: int) -> list:
+    """
+    :return: Binary readouts of every sensor, interleaved by time
+    """
+    rng = random.Random(0)
+    msg_type = str(DeviceMessageEnum['DEVICE_READOUT'].value)
+    sensors = [(register_sensor(f'Bench Sensor {i:03d}', 'Thermal'),
+                Signal(f'Bench Sensor {i:03d}'), 0.5 + 0.25 * (i % 4))
+               for i in range(n_sensors)]
+    start = time.time()
+    messages = []
+    for k in range(n_points):
+        for device_id, signal, interval in sensors:
+            timestamp = start + k * interval + rng.uniform(0, JITTER)
+            messages.append(DeviceMessage(msg_type, encode_readout(
+                device_id, msg_type, round(timestamp, 6), float(signal.value),
+                interval)))
+    return messages
+
+
+def main(n_sensors: int = N_SENSORS, n_points: int = N_POINTS) -> None:
+    messages = make_messages(n_sensors, n_points)
+    n = len(messages)
+    json_size = sum(len(message_to_text(message)) + 1 for message in messages)
+    binary_size = n * RECORD.size
+
+    start = time.perf_counter()
+    encoder = GorillaEncoder()
+    blocks = encoder.add(messages) + encoder.flush()
+    encode_time = time.perf_counter() - start
+    data = b''.join(blocks)
+
+    start = time.perf_counter()
+    decoded = sum(1 for _ in decode_blocks(data))
+    decode_time = time.perf_counter() - start
+    assert decoded == n
+
+    print(f'{n} readouts, {n_sensors} sensors, {len(blocks)} blocks')
+    print(f'JSON lines:     {json_size:>12} bytes  {json_size / n:6.1f} B/readout')
+    print(f'Binary records: {binary_size:>12} bytes  {binary_size / n:6.1f} B/readout')
+    print(f'Gorilla blocks: {len(data):>12} bytes  {len(data) / n:6.1f} B/readout')
+    print(f'Reduction: {json_size / len(data):.1f}x vs JSON, '
+          f'{binary_size / len(data):.1f}x vs binary')
+    print(f'Encode: {n / encode_time:,.0f} readouts/s')
+    print(f'Decode: {n / decode_time:,.0f} readouts/s')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
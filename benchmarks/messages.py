@@ -0,0 +1,96 @@
+"""
+    Readout message microbenchmark.
+    Builds readouts the way the sensors used to (a __dict__ message holding
+    the JSON text, formatted on every tick) and the way they do now (slotted
+    messages holding the raw fields), then prints the build time and the
+    memory held per in-flight message, and the RSS of 1M in-flight readouts.
+
+    (env)> python -m benchmarks.messages [n_messages]
+"""
+
+import json
+import resource
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+from service.model.codec import encode_readout, message_to_text, \
+    register_sensor
+from service.model.messages import DeviceMessage, ReadoutMessage, \
+    DeviceMessageEnum
+
+N_MESSAGES = 200_000
+N_IN_FLIGHT = 1_000_000
+READOUT = str(DeviceMessageEnum['DEVICE_READOUT'].value)
+DEVICE_ID = register_sensor('Bench Sensor 01', 'Thermal')
+
+
+class DictMessage:
+    """ The former DeviceMessage """
+    def __init__(self, message_type: str, message: str):
+        self.msg_type = message_type
+        self.msg_content = message
+
+
+def legacy_readout(k: int) -> DictMessage:
+    """ Readout as built by the former BaseSensor._build_sensor_message """
+    out = {'sensor_type': 'Thermal', 'device_name': 'Bench Sensor 01',
+           'value': f'{k % 200 - 100 + 0.1234:.4f}',
+           'interval': f'{1000 * 0.5} ms',
+           'posix_timestamp': f'{datetime.now().timestamp():.6f}'}
+    return DictMessage(READOUT, json.dumps({'readout': out}))
+
+
+def binary_readout(k: int) -> DeviceMessage:
+    return DeviceMessage(READOUT, encode_readout(
+        DEVICE_ID, READOUT, time.time(), k % 200 - 100 + 0.1234, 0.5))
+
+
+def lazy_readout(k: int) -> ReadoutMessage:
+    return ReadoutMessage(READOUT, DEVICE_ID, time.time(),
+                          k % 200 - 100 + 0.1234, 0.5)
+
+
+def measure(build, n: int) -> tuple:
+    """
+    :return: Build time and memory held per message
+    """
+    start = time.perf_counter()
+    messages = [build(k) for k in range(n)]
+    elapsed = time.perf_counter() - start
+    del messages
+    tracemalloc.start()
+    messages = [build(k) for k in range(n)]
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del messages
+    return elapsed / n, held / n
+
+
+def rss_mib() -> float:
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / (1 << 20)
+
+
+def main(n: int = N_MESSAGES) -> None:
+    before = rss_mib()
+    in_flight = [lazy_readout(k) for k in range(N_IN_FLIGHT)]
+    print(f'{len(in_flight):,} in-flight ReadoutMessages: '
+          f'{rss_mib() - before:.0f} MiB RSS')
+    del in_flight
+    print(f'{"":24}{"build us":>10}{"bytes/msg":>11}')
+    for name, build in (('dict + JSON text', legacy_readout),
+                        ('slots + binary record', binary_readout),
+                        ('slots + raw fields', lazy_readout)):
+        per_message, held = measure(build, n)
+        print(f'{name:24}{1e6 * per_message:>10.2f}{held:>11.0f}')
+    start = time.perf_counter()
+    for k in range(n // 10):
+        message_to_text(lazy_readout(k))
+    elapsed = time.perf_counter() - start
+    print(f'Serialization on demand: {1e6 * elapsed / (n // 10):.2f} us/msg')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
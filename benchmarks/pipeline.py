@@ -0,0 +1,221 @@
+"""
+    Load generation benchmark of the sensor -> network -> repository pipeline.
+
+    A fleet of sensors fired by a SensorScheduler feeds a Network and a
+    repository for a fixed time. Every combination of the given wire formats
+    and sinks is run in turn and reported: throughput, CPU time per message,
+    drops and the readout -> enqueue and readout -> write latency
+    percentiles. The results are written as JSON, together with the commit
+    and the configuration, so they can be compared across commits.
+
+    (env)> python -m benchmarks.pipeline --sensors 200 --interval 0.05 \
+               --duration 10 --format json binary --sink file db memory hot \
+               --output results.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import List, Optional
+
+from sensors.scheduler import SensorScheduler, DEFAULT_WORKERS
+from sensors.sensor import get_sensor, SensorType
+from service.model.codec import WireFormat, message_timestamp
+from service.repository.repository import Repository, FileRepository, \
+    DBRepository
+from service.repository.hot import HotRepository
+from utils.metrics import REGISTRY
+from utils.network import Network, FlushPolicy, FLUSH_LATENCY
+
+N_SENSORS = 100
+INTERVAL = 0.1                      # 100 ms, 1000 readouts/s for 100 sensors
+DURATION = 10.0
+CAPACITY = 100_000
+MAX_BATCH = 1000
+SINKS = ('file', 'db', 'memory', 'hot')
+
+
+class MemoryRepository(Repository):
+    """
+    Sink keeping the messages in a list, to measure the pipeline alone
+    """
+
+    def __init__(self, *, network: Network) -> None:
+        super().__init__(name='MemoryRepository', thread_name='MemoryArchive',
+                         network=network)
+        self.stored = []
+
+    def run(self):
+        self.started_at = time.monotonic()
+        stop = False
+        while not stop:
+            batches, stop = self._next_batches(None)
+            now = self.clock.time()
+            for batch in batches:
+                self.stored.extend(batch)
+                self.write_latency.record_many(
+                    now - message_timestamp(message) for message in batch)
+                self.messages_written.inc(len(batch))
+        self.stopped_at = time.monotonic()
+
+
+def make_sink(sink: str, network: Network, wire_format: WireFormat,
+              directory: str) -> Repository:
+    if sink == 'file':
+        return FileRepository(location=os.path.join(directory, 'bench.txt'),
+                              network=network, wire_format=wire_format)
+    if sink == 'db':
+        return DBRepository(network=network, db='sqlite:///' + os.path.join(
+            directory, 'bench.sqlite'))
+    if sink == 'memory':
+        return MemoryRepository(network=network)
+    if sink == 'hot':
+        return HotRepository(network=network)
+    raise ValueError(f'Unknown sink: {sink}')
+
+
+def cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def latency_ms(histogram) -> dict:
+    """ Latency percentiles of a histogram, in ms """
+    return {key: 1000 * value for key, value in histogram.snapshot().items()
+            if key not in ('count', 'sum')}
+
+
+def run_benchmark(*, n_sensors: int, interval: float, duration: float,
+                  wire_format: WireFormat, sink: str, n_workers: int,
+                  capacity: int, max_batch: int, send_batch: int = 0) -> dict:
+    """
+    Run the pipeline under load once
+    :return: Results of the run
+    """
+    REGISTRY.reset()
+    with tempfile.TemporaryDirectory() as directory, \
+            open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull):
+        network = Network(capacity=capacity,
+                          flush_policy=FlushPolicy(max_batch, FLUSH_LATENCY))
+        repository = make_sink(sink, network, wire_format, directory)
+        scheduler = SensorScheduler(n_workers=n_workers)
+        # With batching the sensors send through a BatchSender
+        sender = network.connect_device_batch(max_batch=send_batch) \
+            if send_batch > 1 else None
+        sensor_types = list(SensorType)
+        sensors = [get_sensor(sensor_type=sensor_types[i % len(sensor_types)],
+                              sensor_name=f'Bench Sensor {i:05d}',
+                              net=sender or network, exec_interval=interval,
+                              scheduler=scheduler, wire_format=wire_format)
+                   for i in range(n_sensors)]
+        repository.start_repository()
+        network.start_network()
+        if sender is not None:
+            sender.start_sender()
+        scheduler.start_scheduler()
+        cpu_start, start = cpu_seconds(), time.monotonic()
+        for sensor in sensors:
+            sensor.start_sensor()
+        time.sleep(duration)
+        for sensor in sensors:
+            sensor.stop_sensor()
+        if sender is not None:
+            sender.stop_sender()
+        network.stop_network()
+        repository.stop_repository()
+        elapsed = time.monotonic() - start
+        cpu = cpu_seconds() - cpu_start
+        jitter = scheduler.jitter_report().values()
+        scheduler.stop_scheduler()
+    stats = network.queue_stats()
+    written = repository.messages_written.value
+    return {'format': wire_format.value,
+            'sink': sink,
+            'send_batch': send_batch,
+            'mean_send_batch': sender.stats()['mean_batch'] if sender else 1.0,
+            'offered_per_s': n_sensors / interval,
+            'enqueued': stats['enqueued'],
+            'dropped': stats['dropped'],
+            'written': written,
+            'elapsed_s': elapsed,
+            'throughput_per_s': written / elapsed,
+            'cpu_s': cpu,
+            'cpu_us_per_message': 1e6 * cpu / written if written else None,
+            'scheduler_overruns': sum(j['overruns'] for j in jitter),
+            'enqueue_latency_ms': latency_ms(network.enqueue_latency),
+            'write_latency_ms': latency_ms(repository.write_latency)}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv: Optional[List[str]] = None) -> dict:
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.pipeline',
+        description='Sensor -> network -> repository load benchmark')
+    parser.add_argument('--sensors', type=int, default=N_SENSORS,
+                        help='Fleet size')
+    parser.add_argument('--interval', type=float, default=INTERVAL,
+                        help='Reporting interval of every sensor, in seconds')
+    parser.add_argument('--duration', type=float, default=DURATION,
+                        help='Load time of every run, in seconds')
+    parser.add_argument('--format', nargs='+', default=['binary'],
+                        choices=[f.value for f in WireFormat])
+    parser.add_argument('--sink', nargs='+', default=['memory'],
+                        choices=SINKS)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help='Scheduler worker threads')
+    parser.add_argument('--capacity', type=int, default=CAPACITY,
+                        help='Network queue capacity')
+    parser.add_argument('--batch', type=int, default=MAX_BATCH,
+                        help='Network flush batch size')
+    parser.add_argument('--send-batch', type=int, default=0,
+                        help='Readouts the sensors submit at once through a '
+                             'BatchSender, 0 sends them one by one')
+    parser.add_argument('--output', help='JSON results file')
+    args = parser.parse_args(argv)
+
+    runs = []
+    for wire_format in args.format:
+        for sink in args.sink:
+            result = run_benchmark(
+                n_sensors=args.sensors, interval=args.interval,
+                duration=args.duration, wire_format=WireFormat(wire_format),
+                sink=sink, n_workers=args.workers, capacity=args.capacity,
+                max_batch=args.batch, send_batch=args.send_batch)
+            print(f'{wire_format:>6} {sink:>6}: '
+                  f'{result["throughput_per_s"]:10.0f} msg/s '
+                  f'{result["cpu_us_per_message"] or 0:8.1f} us CPU/msg '
+                  f'write p99 {result["write_latency_ms"].get("p99", 0):8.2f} ms '
+                  f'dropped {result["dropped"]}')
+            runs.append(result)
+    report = {'commit': git_commit(),
+              'date': datetime.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'cpus': os.cpu_count(),
+              'config': vars(args),
+              'runs': runs}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Results written to {args.output}')
+    return report
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -3,11 +3,11 @@
   Demonstration main file
 """
 
-import time
 from logger.logger import MyLogger
 from sensors.sensor import get_sensor, SensorType
 from service.repository.repository import FileRepository
 from utils.network import Network
+from utils.lifecycle import Lifecycle
 
 if __name__ == '__main__':
 
@@ -34,8 +34,6 @@ if __name__ == '__main__':
                                  sensor_name='Humidity Sensor AZ01',
                                  net=network,
                                  exec_interval=2.8)
-    network.start_network()
-    repository.start_repository()
     logging.add_sensors([
         thermal_sensor_05,
         pressure_sensor_99,
@@ -43,8 +41,6 @@ if __name__ == '__main__':
         magnetic_sensor_11,
         vibration_sensor_02
     ])
-    logging.start_bank()
-    time.sleep(40)
-    logging.stop_bank()
-    repository.stop_repository()
-    network.stop_network()
+    # 40 s, or until Ctrl-C
+    Lifecycle(network=network, repositories=[repository],
+              banks=[logging]).run(40)
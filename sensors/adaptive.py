@@ -0,0 +1,210 @@
+"""
+    Adaptive sampling rate.
+
+    An AdaptiveRate follows the volatility of a sensor's signal with an
+    exponentially weighted variance of its recent values and picks the
+    sensor's interval from it: max_interval while the signal is quiet,
+    min_interval when it is volatile, log-interpolated in between. The
+    interval changes by at most a factor of MAX_STEP per sample, so a single
+    outlier doesn't swing the rate.
+    A SamplingBudget shared by many sensors keeps the sum of their rates
+    under a target: when the sensors ask for more, the intervals are
+    stretched by the same factor, up to each sensor's max_interval.
+    Rates are stateful: every sensor needs its own AdaptiveRate.
+"""
+
+import math
+import threading
+from typing import Dict, Optional, Set, Tuple
+
+ALPHA = 0.1                 # Weight of the last sample, ~10 samples window
+QUIET_STD = 0.5             # Signal std at and below which max_interval is used
+VOLATILE_STD = 5.0          # Signal std at and above which min_interval is used
+MAX_STEP = 2.0              # Largest interval change per sample
+
+
+class SamplingBudget:
+    """
+    Global message rate shared by adaptive sensors.
+    The sensors stretched up to their max_interval can't give more, so the
+    stretch factor spreads what is left of the budget over the others.
+    """
+
+    def __init__(self, *, max_rate: float) -> None:
+        """
+        :param max_rate: Readouts per second the network can absorb
+        """
+        if max_rate <= 0:
+            raise ValueError(f'Invalid budget: {max_rate} readouts/s')
+        self.max_rate = max_rate
+        # key -> (rate asked for, rate granted if held at max_interval)
+        self._demands: Dict[int, Tuple[float, Optional[float]]] = {}
+        self._free = 0.0            # Rate asked for by the stretchable sensors
+        self._held = 0.0            # Rate of the sensors at their max_interval
+        # Stopped sensors: a tick still in flight must not count them again
+        self._released: Set[int] = set()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._demands)
+
+    def _factor(self) -> float:
+        """ Caller holds the lock """
+        room = self.max_rate - self._held
+        if room <= 0:
+            return math.inf
+        return max(1.0, self._free / room)
+
+    @property
+    def factor(self) -> float:
+        """ :return: Stretch applied to the intervals, 1 within budget """
+        with self._lock:
+            return self._factor()
+
+    def _forget(self, key: int) -> None:
+        """ Caller holds the lock """
+        rate, held = self._demands.pop(key, (0.0, None))
+        if held is None:
+            self._free -= rate
+        else:
+            self._held -= held
+        if not self._demands:
+            self._free = self._held = 0.0
+
+    def grant(self, key: int, interval: float, max_interval: float) -> float:
+        """
+        Record a sensor's wish and return the interval it gets
+        :param key: Sensor's key
+        :param interval: Interval the sensor asks for, in seconds
+        :param max_interval: Longest interval of the sensor
+        :return: Granted interval
+        """
+        rate = 1.0 / interval
+        with self._lock:
+            if key in self._released:
+                return interval
+            self._forget(key)
+            self._free += rate
+            granted = min(interval * self._factor(), max_interval)
+            if granted >= max_interval:
+                # Held at its max_interval: counts with what it gets
+                self._free -= rate
+                self._held += 1.0 / max_interval
+                self._demands[key] = (rate, 1.0 / max_interval)
+            else:
+                self._demands[key] = (rate, None)
+        return granted
+
+    def release(self, key: int) -> None:
+        """ Forget a sensor that stopped, until it resumes """
+        with self._lock:
+            self._forget(key)
+            self._released.add(key)
+
+    def resume(self, key: int) -> None:
+        """ Count a sensor again, when it (re)starts """
+        with self._lock:
+            self._released.discard(key)
+
+    def stats(self) -> dict:
+        """
+        :return: Rate asked for, the budget and the stretch factor
+        """
+        with self._lock:
+            requested = sum(rate for rate, _ in self._demands.values())
+            return {'sensors': len(self),
+                    'requested_per_s': requested,
+                    'max_rate': self.max_rate,
+                    'factor': self._factor()}
+
+
+class AdaptiveRate:
+    """
+    Interval of a sensor following the volatility of its signal
+    """
+
+    def __init__(self, *, min_interval: float, max_interval: float,
+                 quiet_std: float = QUIET_STD,
+                 volatile_std: float = VOLATILE_STD,
+                 alpha: float = ALPHA,
+                 budget: Optional[SamplingBudget] = None) -> None:
+        """
+        :param min_interval: Shortest interval, in seconds, for a volatile
+                             signal
+        :param max_interval: Longest interval, in seconds, for a quiet signal
+        :param quiet_std: Standard deviation of the recent values at and below
+                          which max_interval is used
+        :param volatile_std: Standard deviation at and above which
+                             min_interval is used
+        :param alpha: Weight of the last value in the running estimates
+        :param budget: Optional budget shared with other sensors
+        """
+        if not 0 < min_interval <= max_interval:
+            raise ValueError(f'Invalid intervals: {min_interval}, '
+                             f'{max_interval}')
+        if not 0 < quiet_std < volatile_std:
+            raise ValueError(f'Invalid std bounds: {quiet_std}, '
+                             f'{volatile_std}')
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.quiet_std = quiet_std
+        self.volatile_std = volatile_std
+        self.alpha = alpha
+        self.budget = budget
+        self.mean: Optional[float] = None
+        self.variance = 0.0
+        self.interval = max_interval
+        self.n_samples = 0
+
+    def target(self, std: float) -> float:
+        """
+        :param std: Standard deviation of the recent values
+        :return: Interval for that volatility, before the budget
+        """
+        if std <= self.quiet_std:
+            return self.max_interval
+        if std >= self.volatile_std:
+            return self.min_interval
+        position = (math.log(std / self.quiet_std) /
+                    math.log(self.volatile_std / self.quiet_std))
+        return self.max_interval * (self.min_interval /
+                                    self.max_interval) ** position
+
+    def update(self, value: float) -> float:
+        """
+        Take a new sample into account
+        :param value: Sample of the signal
+        :return: Interval until the next sample
+        """
+        self.n_samples += 1
+        if self.mean is None:
+            self.mean = value
+        else:
+            # Exponentially weighted mean and variance
+            delta = value - self.mean
+            self.mean += self.alpha * delta
+            self.variance = (1 - self.alpha) * (self.variance +
+                                                self.alpha * delta * delta)
+        wanted = self.target(math.sqrt(self.variance))
+        wanted = min(max(wanted, self.interval / MAX_STEP),
+                     self.interval * MAX_STEP)
+        wanted = min(max(wanted, self.min_interval), self.max_interval)
+        if self.budget is not None:
+            wanted = self.budget.grant(id(self), wanted, self.max_interval)
+        self.interval = wanted
+        return wanted
+
+    def release(self) -> None:
+        """ Give the sensor's share of the budget back """
+        if self.budget is not None:
+            self.budget.release(id(self))
+
+    def resume(self) -> None:
+        """ Take a share of the budget again """
+        if self.budget is not None:
+            self.budget.resume(id(self))
+
+    def stats(self) -> dict:
+        return {'samples': self.n_samples,
+                'std': math.sqrt(self.variance),
+                'interval': self.interval}
@@ -0,0 +1,144 @@
+"""
+    AsyncSensor: the asyncio counterpart of BaseSensor.
+    Every sensor is a coroutine on one event loop instead of a thread.
+"""
+
+import asyncio
+from typing import List, Union, Optional
+
+from sensors.basesensor import SensorDevice, BASE_INTERVAL
+from sensors.sensor import SensorType
+from service.model.messages import DeviceMessage
+from service.model.codec import WireFormat
+from utils.asyncnetwork import AsyncNetwork
+
+
+class AsyncSensor(SensorDevice):
+    """
+    Sensor whose readouts are produced by a coroutine
+    """
+
+    def __init__(self, *, sensor_type: SensorType, name: str,
+                 net: AsyncNetwork,
+                 interval: Union[int | float] = BASE_INTERVAL,
+                 wire_format: WireFormat = WireFormat.JSON) -> None:
+        self.sensor_type = SensorType[sensor_type.name].value
+        super().__init__(name=name, net=net, interval=interval,
+                         wire_format=wire_format)
+        self._task: Optional[asyncio.Task] = None
+
+    async def send_readout(self, readout: DeviceMessage) -> None:
+        """
+        Sends sensor readout to the network, waiting for room in its queue
+        """
+        await self.connection_point(readout)
+
+    async def tick(self) -> DeviceMessage:
+        """
+        Take a single readout and send it
+        :return: The readout sent
+        """
+        readout = self.get_readout()
+        await self.send_readout(readout)
+        return readout
+
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start_sensor(self) -> None:
+        if self.is_running():
+            print(f'The task for {self.device_name} is already running!')
+            return
+        self._task = asyncio.create_task(self.run(), name=self.device_name)
+
+    async def stop_sensor(self) -> None:
+        """
+        Cancel the sensor's coroutine and wait until it is done
+        :return: None
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def run(self) -> None:
+        """
+        Sensor's coroutine. Readouts are due at a fixed rate.
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while True:
+            deadline += self.interval
+            await asyncio.sleep(deadline - loop.time())
+            await self.tick()
+
+
+class AsyncSensorBank:
+    """
+    Start and stop many asyncio sensors together
+    """
+    def __init__(self) -> None:
+        self.sensors: List[AsyncSensor] = []
+
+    def __iter__(self):
+        return iter(self.sensors)
+
+    def __len__(self) -> int:
+        return len(self.sensors)
+
+    def add_sensors(self, sensors: List[AsyncSensor]) -> None:
+        self.sensors.extend(sensors)
+
+    async def start_bank(self) -> None:
+        await asyncio.gather(*(sensor.start_sensor() for sensor in self))
+
+    async def stop_bank(self) -> None:
+        await asyncio.gather(*(sensor.stop_sensor() for sensor in self))
+
+
+def get_async_sensor(*, sensor_type: SensorType, sensor_name: str,
+                     net: AsyncNetwork, exec_interval: float,
+                     wire_format: WireFormat = WireFormat.JSON) -> AsyncSensor:
+    """
+    AsyncSensor factory function
+    :param sensor_type: SensorType
+    :param sensor_name: str
+    :param net: AsyncNetwork
+    :param exec_interval: float
+    :param wire_format: JSON or BINARY readouts
+    :return:
+    """
+    return AsyncSensor(name=sensor_name, sensor_type=sensor_type,
+                       net=net, interval=exec_interval,
+                       wire_format=wire_format)
+
+
+if __name__ == '__main__':
+
+    from service.repository.asyncrepository import AsyncFileRepository
+
+    async def main() -> None:
+        network = AsyncNetwork()
+        repository = AsyncFileRepository(location='./async_file_repo.txt',
+                                         network=network)
+        bank = AsyncSensorBank()
+        bank.add_sensors([
+            get_async_sensor(sensor_type=SensorType.THERMAL,
+                             sensor_name=f'Thermal Sensor {i:05d}',
+                             net=network, exec_interval=1.0 + i % 5)
+            for i in range(1000)
+        ])
+        await repository.start_repository()
+        await network.start_network()
+        await bank.start_bank()
+        await asyncio.sleep(10)
+        await bank.stop_bank()
+        await network.stop_network()
+        await repository.stop_repository()
+
+    asyncio.run(main())
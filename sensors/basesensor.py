@@ -2,15 +2,21 @@
     BaseSensor subclassed from threading.Thread
 """
 
-import json
 import time
 import threading
-from datetime import datetime
-from typing import Union, Callable, Tuple, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, Callable, Tuple, Iterator, Optional, List, Dict, \
+    Iterable
 from utils.network import Network
-from service.model.messages import DeviceMessage, DeviceMessageEnum
+from service.model.messages import DeviceMessage, DeviceMessageEnum, \
+    ReadoutMessage
+from service.model.codec import WireFormat, register_sensor, encode_readout
 from service.repository.repository import FileRepository
 from sensors.signal import Signal
+from sensors.compression import ReportFilter
+from sensors.adaptive import AdaptiveRate
+from sensors.scheduler import SensorScheduler
+from utils.clock import Clock, SYSTEM_CLOCK
 
 
 BASE_INTERVAL = 5.0
@@ -18,57 +24,97 @@ START_STOP_WAIT = 2.0
 TS_FORMAT = 6
 DEVICE = 1
 INDEX = 0
-N_MAX_SENSORS = 5
+BANK_WORKERS = 8                    # Threads starting or stopping a bank
+BANK_CHUNK = 64
+READOUT = str(DeviceMessageEnum['DEVICE_READOUT'].value)
 
 
 # class Network:
 #      ...
 
 
-class BaseSensor(threading.Thread):
-    """ Base class for any sensor type"""
+class SensorDevice:
+    """
+    Readout logic shared by the threaded and the asyncio sensors
+    """
 
-    def __init__(self, *, name: str, net: Network,
-                 interval: float = BASE_INTERVAL):
-        """ Initialize with required named parameters """
-        super().__init__(name=name, daemon=True, target=self.run)
+    def __init__(self, *, name: str, net, interval: float = BASE_INTERVAL,
+                 wire_format: WireFormat = WireFormat.JSON,
+                 report_filter: Optional[ReportFilter] = None,
+                 adaptive_rate: Optional[AdaptiveRate] = None,
+                 clock: Clock = SYSTEM_CLOCK):
         self.device_name = name
-        self.interval = interval
+        self.clock = clock
+        self.adaptive_rate = adaptive_rate
+        # An adaptive sensor ignores the given interval: it starts at its
+        # max_interval, then follows the volatility of its signal
+        self.interval = interval if adaptive_rate is None \
+            else adaptive_rate.interval
+        self.wire_format = wire_format
+        self.report_filter = report_filter
+        self.sensor_id = register_sensor(name, getattr(self, 'sensor_type',
+                                                       None))
         self.signal = Signal(name)
         self.value = None
         self.connection_point = net.connect_device()
-        self.lock = threading.Lock()
-        self.start_running = threading.Event()
 
-    def _build_sensor_message(self) -> dict:
+    def make_readout(self, timestamp: float, value: float) -> DeviceMessage:
         """
-        This property provides the sensor message's main body
-        :return: Updated json readout for the sensor.
+        Build the readout message for a given sample. JSON readouts keep the
+        raw fields and are only serialized when a sink needs the text.
+        :param timestamp: posix timestamp
+        :param value: float
+        :return: DeviceMessage
         """
-        printable_keys = {'device_name', 'value'}
-        out = {k: v for k, v in self.__dict__.items() if k in printable_keys}
-        out.update({'interval': f'{1000 * self.interval} ms'})
-        out.update({'posix_timestamp':
-                        f'{datetime.now().timestamp():.{TS_FORMAT}f}'})
-        return out
+        self.value = value
+        if self.wire_format is WireFormat.BINARY:
+            return DeviceMessage(READOUT, encode_readout(
+                self.sensor_id, READOUT, timestamp, value, self.interval))
+        return ReadoutMessage(READOUT, self.sensor_id, timestamp, value,
+                              self.interval)
 
     @property
     def readout(self) -> DeviceMessage:
         """
         This property updates the sensor value and provides the sensor message's
         main body.
-        :return: Updated json readout for the sensor.
+        :return: Updated readout for the sensor.
         """
-        self.value = self.signal.value
-        out = self._build_sensor_message()
-        out = {'readout': out}
-        msg_content = json.dumps(out)
-        return DeviceMessage(str(DeviceMessageEnum['DEVICE_READOUT'].value),
-                             msg_content)
+        return self.make_readout(self.clock.time(), self.signal.sample())
 
     def get_readout(self) -> DeviceMessage:
         return self.readout
 
+    def get_readouts(self) -> List[DeviceMessage]:
+        """
+        Take a sample and pass it through the report filter, if any. An
+        adaptive sensor then sets its next interval from the sample.
+        :return: Readouts to send, none while the signal stays within the
+                 filter's bounds
+        """
+        if self.report_filter is None and self.adaptive_rate is None:
+            return [self.readout]
+        timestamp = self.clock.time()
+        value = self.signal.sample()
+        if self.report_filter is None:
+            readouts = [self.make_readout(timestamp, value)]
+        else:
+            points = self.report_filter.offer(timestamp, value)
+            readouts = [self.make_readout(*point) for point in points]
+            self.value = value
+        if self.adaptive_rate is not None:
+            self.interval = self.adaptive_rate.update(value)
+        return readouts
+
+    def flush_readouts(self) -> List[DeviceMessage]:
+        """
+        :return: Readouts held back by the report filter
+        """
+        if self.report_filter is None:
+            return []
+        return [self.make_readout(*point)
+                for point in self.report_filter.flush()]
+
     @property
     def connection_point(self) -> callable:
         """ Returns the stored logger callback function """
@@ -87,21 +133,111 @@ class BaseSensor(threading.Thread):
         # The read property readout
         self.connection_point(readout)
 
-    def start_sensor(self) -> None:
+
+class BaseSensor(SensorDevice, threading.Thread):
+    """ Base class for any sensor type"""
+
+    def __init__(self, *, name: str, net: Network,
+                 interval: float = BASE_INTERVAL,
+                 scheduler: Optional[SensorScheduler] = None,
+                 wire_format: WireFormat = WireFormat.JSON,
+                 report_filter: Optional[ReportFilter] = None,
+                 adaptive_rate: Optional[AdaptiveRate] = None,
+                 clock: Clock = SYSTEM_CLOCK):
+        """
+        Initialize with required named parameters.
+        When a scheduler is given the sensor doesn't start its own thread, its
+        readouts are fired by the scheduler's worker pool instead.
+        With a report filter only the samples leaving the filter's bounds are
+        sent.
+        With an adaptive rate the interval follows the signal's volatility.
+        """
+        threading.Thread.__init__(self, name=name, daemon=True,
+                                  target=self.run)
+        SensorDevice.__init__(self, name=name, net=net, interval=interval,
+                              wire_format=wire_format,
+                              report_filter=report_filter,
+                              adaptive_rate=adaptive_rate, clock=clock)
+        self.scheduler = scheduler
+        self.lock = threading.Lock()
+        self.start_running = threading.Event()
+        self.stop_requested = threading.Event()
+
+    def tick(self) -> List[DeviceMessage]:
+        """
+        Take a single sample and send the readouts it produces
+        :return: The readouts sent
+        """
+        with self.lock:
+            readouts = self.get_readouts()
+            for readout in readouts:
+                self.send_readout(readout)
+        return readouts
+
+    def flush(self) -> List[DeviceMessage]:
+        """
+        Send the readouts held back by the report filter
+        :return: The readouts sent
+        """
+        with self.lock:
+            readouts = self.flush_readouts()
+            for readout in readouts:
+                self.send_readout(readout)
+        return readouts
+
+    def is_running(self) -> bool:
+        if self.scheduler is not None:
+            return self.scheduler.is_scheduled(self)
+        return self.is_alive()
+
+    def start_sensor(self, wait: bool = True) -> None:
+        """
+        :param wait: Give the thread START_STOP_WAIT seconds to get going,
+                     a bank starting many sensors doesn't wait for each one
+        """
+        if self.adaptive_rate is not None:
+            self.adaptive_rate.resume()
+        if self.scheduler is not None:
+            self.scheduler.add_sensor(self)
+            return
         if not self.is_alive():
             # Activate the thread
             print(f'Starting the thread: {self.name} for {self.device_name}')
             self.start()
             self.start_running.set()
-            time.sleep(START_STOP_WAIT)
+            if wait:
+                self.clock.sleep(START_STOP_WAIT)
             return
         print(f'The thread {self.name} is already running!')
 
-    def stop_sensor(self) -> None:
+    def stop_sensor(self, wait: bool = True) -> None:
+        """
+        :param wait: Wait for the thread to finish. Without waiting the
+                     thread is only told to stop, wait_stopped() completes it.
+        """
+        if self.adaptive_rate is not None:
+            self.adaptive_rate.release()
+        if self.scheduler is not None:
+            self.scheduler.remove_sensor(self)
+            self.flush()
+            return
         if not self.is_alive():
             return
         self.start_running.clear()
-        self.join(1.5 * self.interval)
+        self.stop_requested.set()
+        if wait:
+            self.wait_stopped()
+
+    def wait_stopped(self) -> None:
+        """
+        Wait for the thread told to stop, then send what the report filter
+        still holds
+        :return: None
+        """
+        if self.scheduler is not None:
+            return
+        self.join(START_STOP_WAIT)
+        self.flush()
         if self.is_alive():
             print(f'Thread {self.name} is still running!')
         else:
@@ -112,53 +248,114 @@ class BaseSensor(threading.Thread):
         Thread's worker function
         :return: None
         """
-        timer = self.interval
         self.start_running.wait()
         while self.start_running.is_set():
-            time.sleep(timer)
-            with self.lock:
-                readout = self.get_readout()
-                self.send_readout(readout)
-                print(readout)
+            # Woken up right away by stop_sensor()
+            if self.clock.wait(self.stop_requested, self.interval):
+                break
+            self.tick()
 
 
 class SensorBank:
     """
-    Hold up to five sensors
+    Registry of sensors. The sensors are kept in an array, with dicts from
+    name to array index, from sensor id and from sensor type to the sensors,
+    so every lookup and removal is O(1). Sensors can be added and removed
+    while the bank is running; the whole bank is started and stopped by a
+    pool of threads.
     """
-    def __init__(self) -> None:
-        self.sensors = []
+    def __init__(self, *, name: str = 'SensorBank',
+                 max_sensors: Optional[int] = None,
+                 n_workers: int = BANK_WORKERS) -> None:
+        """
+        :param name: Bank name
+        :param max_sensors: Size limit, None for no limit
+        :param n_workers: Threads starting and stopping the sensors
+        """
+        self.name = name
+        self.max_sensors = max_sensors
+        self.n_workers = n_workers
+        self.sensors: List[BaseSensor] = []
+        self._index: Dict[str, int] = {}
+        self._by_id: Dict[int, BaseSensor] = {}
+        self._by_type: Dict[Optional[str], Dict[str, BaseSensor]] = {}
+        self.lock = threading.RLock()
+        self.is_running = False
 
     def __iter__(self) -> Iterator:
-        return iter(self.sensors)
+        """ Iterate over a snapshot, sensors may come and go meanwhile """
+        with self.lock:
+            return iter(list(self.sensors))
 
     def __len__(self) -> int:
         return len(self.sensors)
 
+    def __contains__(self, sensor_name: str) -> bool:
+        return sensor_name in self._index
+
     def sensor_names(self):
         return [sensor.device_name for sensor in self]
 
-    def add_sensors(self, sensors: Union[Tuple[BaseSensor]|list[BaseSensor]]) -> None:
+    def add_sensors(self, sensors: Iterable[BaseSensor]) -> None:
         """
-        Add a list of sensors
-        :param sensors:
-        :return:
+        Add sensors, started right away when the bank is running.
+        Sensors whose name is already in the bank are skipped.
+        :param sensors: Iterable of BaseSensor
+        :return: None
         """
-        for sensor in sensors:
-            if len(self) > N_MAX_SENSORS:
-                print(f'Bank limit reached: {N_MAX_SENSORS} sensors max.')
-                break
-            self.sensors.append(sensor)
-
-    def remove_by_name(self, sensor_name: str) -> None:
+        added = []
+        with self.lock:
+            for sensor in sensors:
+                name = sensor.device_name
+                if name in self._index:
+                    print(f'Sensor: {name} is already in this bank')
+                    continue
+                if self.max_sensors is not None and \
+                        len(self) >= self.max_sensors:
+                    print(f'Bank limit reached: {self.max_sensors} sensors '
+                          f'max.')
+                    break
+                self._index[name] = len(self.sensors)
+                self.sensors.append(sensor)
+                self._by_id[sensor.sensor_id] = sensor
+                sensor_type = getattr(sensor, 'sensor_type', None)
+                self._by_type.setdefault(sensor_type, {})[name] = sensor
+                added.append(sensor)
+            running = self.is_running
+        if running:
+            self._start_all(added)
+
+    def _pop(self, sensor_name: str) -> Optional[BaseSensor]:
+        """ Unregister a sensor, the last one takes its place in the array """
+        with self.lock:
+            device_index = self._index.pop(sensor_name, None)
+            if device_index is None:
+                return None
+            device = self.sensors[device_index]
+            last = self.sensors.pop()
+            if last is not device:
+                self.sensors[device_index] = last
+                self._index[last.device_name] = device_index
+            self._by_id.pop(device.sensor_id, None)
+            sensor_type = getattr(device, 'sensor_type', None)
+            same_type = self._by_type.get(sensor_type, {})
+            same_type.pop(sensor_name, None)
+            if not same_type:
+                self._by_type.pop(sensor_type, None)
+            return device
+
+    def remove_by_name(self, sensor_name: str) -> Optional[BaseSensor]:
         """
         Remove Sensor device from the bank and stop it's thread
         :param sensor_name: Device's name
-        :return: None
+        :return: The removed sensor, None if it wasn't in the bank
         """
-        device_index, device = self.find_by_name(sensor_name)
-        self.sensors.pop(device_index)
+        device = self._pop(sensor_name)
+        if device is None:
+            print(f'Sensor: {sensor_name} is not in this bank')
+            return None
         device.stop_sensor()
+        return device
 
     def find_by_name(self, sensor_name: str) -> Tuple[Union[int|None],
                                                       Union[BaseSensor | None]]:
@@ -167,12 +364,28 @@ class SensorBank:
         :param sensor_name: str
         :return: device_index, device
         """
-        names = [sensor.device_name for sensor in self]
-        if sensor_name not in names:
-            print(f'Sensor: {sensor_name} is not in this bank')
-            return None, None
-        device_index = self.sensors.index(sensor_name)
-        return device_index, self.sensors[device_index]
+        with self.lock:
+            device_index = self._index.get(sensor_name)
+            if device_index is None:
+                print(f'Sensor: {sensor_name} is not in this bank')
+                return None, None
+            return device_index, self.sensors[device_index]
+
+    def find_by_id(self, device_id: int) -> Optional[BaseSensor]:
+        """
+        :param device_id: Sensor id, as in the readouts
+        :return: The sensor or None
+        """
+        return self._by_id.get(device_id)
+
+    def find_by_type(self, sensor_type) -> List[BaseSensor]:
+        """
+        :param sensor_type: SensorType or its value
+        :return: Sensors of that type
+        """
+        sensor_type = getattr(sensor_type, 'value', sensor_type)
+        with self.lock:
+            return list(self._by_type.get(sensor_type, {}).values())
 
     def start_sensor_by_name(self, sensor_name: str) -> None:
         """
@@ -195,38 +408,95 @@ class SensorBank:
         try:
             device = self.sensors[index]
         except IndexError:
-            print(f'Invalid index. Maximum index is {N_MAX_SENSORS - 1}')
+            print(f'Invalid index. Maximum index is {len(self) - 1}')
         else:
             device.start_sensor()
 
     def stop_by_index(self, index: int) -> None:
         """
-        Start a specific sensor identified by index
+        Stop a specific sensor identified by index
         :param index:
         :return:
         """
         try:
             device = self.sensors[index]
         except IndexError:
-            print(f'Invalid index. Maximum index is {N_MAX_SENSORS - 1}')
+            print(f'Invalid index. Maximum index is {len(self) - 1}')
         else:
             device.stop_sensor()
 
+    @staticmethod
+    def _by_scheduler(sensors: List[BaseSensor]) \
+            -> Tuple[List[Tuple[SensorScheduler, List[BaseSensor]]],
+                     List[BaseSensor]]:
+        """ :return: (scheduler, its sensors) groups, sensors with a thread """
+        groups: Dict[int, Tuple[SensorScheduler, List[BaseSensor]]] = {}
+        threaded = []
+        for sensor in sensors:
+            if sensor.scheduler is None:
+                threaded.append(sensor)
+            else:
+                groups.setdefault(id(sensor.scheduler),
+                                  (sensor.scheduler, []))[1].append(sensor)
+        return list(groups.values()), threaded
+
+    def _run_all(self, fn: Callable[[BaseSensor], None],
+                 sensors: List[BaseSensor]) -> None:
+        """ Apply fn to the sensors from a pool of threads """
+        if len(sensors) < 2 * self.n_workers:
+            for sensor in sensors:
+                fn(sensor)
+            return
+        with ThreadPoolExecutor(self.n_workers,
+                                thread_name_prefix=self.name) as pool:
+            for _ in pool.map(fn, sensors, chunksize=BANK_CHUNK):
+                pass
+
+    def _start_all(self, sensors: List[BaseSensor]) -> None:
+        """
+        Scheduled sensors are added to their scheduler in one go, the threads
+        of the others are started from the pool without the per-sensor wait
+        """
+        groups, threaded = self._by_scheduler(sensors)
+        for scheduler, group in groups:
+            for sensor in group:
+                if sensor.adaptive_rate is not None:
+                    sensor.adaptive_rate.resume()
+            scheduler.add_sensors(group)
+        self._run_all(lambda sensor: sensor.start_sensor(wait=False),
+                      threaded)
+
     def start_bank(self) -> None:
         """
-        Start all devices present at the bank
+        Start all devices present at the bank, concurrently
         :return:
         """
-        for sensor in self:
-            sensor.start_sensor()
+        with self.lock:
+            self.is_running = True
+            sensors = list(self.sensors)
+        self._start_all(sensors)
 
     def stop_bank(self) -> None:
         """
-        Stop all devices present at the bank
+        Stop all devices present at the bank. Every sensor is told to stop
+        first, then they are waited for; a sensor thread wakes up as soon as
+        it is told, whatever its interval.
         :return:
         """
-        for sensor in self:
-            sensor.stop_sensor()
+        with self.lock:
+            self.is_running = False
+            sensors = list(self.sensors)
+        groups, threaded = self._by_scheduler(sensors)
+        for scheduler, group in groups:
+            scheduler.remove_sensors(group)
+            for sensor in group:
+                if sensor.adaptive_rate is not None:
+                    sensor.adaptive_rate.release()
+                sensor.flush()
+        stopping = [sensor for sensor in threaded if sensor.is_alive()]
+        for sensor in stopping:
+            sensor.stop_sensor(wait=False)
+        self._run_all(BaseSensor.wait_stopped, stopping)
 
 
 if __name__ == "__main__":
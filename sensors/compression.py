@@ -0,0 +1,168 @@
+"""
+    Report-by-exception filters applied by the sensors before sending.
+
+    A filter is offered every sample and returns the points that must be
+    reported, so a slow-moving signal produces far fewer messages while the
+    reconstructed signal stays within the configured error bound:
+    - DeadbandFilter: sample-and-hold within an absolute or percent band
+    - SwingingDoorFilter: linear interpolation within a deviation
+    Both report a heartbeat when a sensor has been silent for max_silence.
+    Filters are stateful: every sensor needs its own instance.
+"""
+
+from typing import List, Optional, Tuple
+
+Point = Tuple[float, float]         # timestamp, value
+
+
+class ReportFilter:
+    """
+    Base filter, reports every sample
+    """
+
+    def __init__(self, *, max_silence: Optional[float] = None) -> None:
+        self.max_silence = max_silence
+        self.last_report: Optional[Point] = None
+        self.n_samples = 0
+        self.n_reported = 0
+
+    def stats(self) -> dict:
+        """
+        :return: Samples offered, points reported and compression ratio
+        """
+        ratio = self.n_samples / self.n_reported if self.n_reported else 0.0
+        return {'samples': self.n_samples,
+                'reported': self.n_reported,
+                'compression_ratio': ratio}
+
+    def offer(self, timestamp: float, value: float) -> List[Point]:
+        """
+        Offer a new sample
+        :param timestamp: posix timestamp
+        :param value: float
+        :return: Points to report, oldest first
+        """
+        self.n_samples += 1
+        if self.last_report is None or (
+                self.max_silence is not None and
+                timestamp - self.last_report[0] >= self.max_silence):
+            points = self._heartbeat(timestamp, value)
+        else:
+            points = self._filter(timestamp, value)
+        if points:
+            self.n_reported += len(points)
+            self.last_report = points[-1]
+        return points
+
+    def flush(self) -> List[Point]:
+        """
+        Report anything held back, e.g. before the sensor stops
+        :return: Points to report
+        """
+        return []
+
+    def _heartbeat(self, timestamp: float, value: float) -> List[Point]:
+        """ First sample, or the sensor has been silent for too long """
+        return [(timestamp, value)]
+
+    def _filter(self, timestamp: float, value: float) -> List[Point]:
+        return [(timestamp, value)]
+
+
+class DeadbandFilter(ReportFilter):
+    """
+    Report a sample only when it moves out of the band around the last
+    reported value. With both bounds given the wider band applies.
+    """
+
+    def __init__(self, *, absolute: Optional[float] = None,
+                 percent: Optional[float] = None,
+                 max_silence: Optional[float] = None) -> None:
+        if absolute is None and percent is None:
+            raise ValueError('A deadband needs an absolute or percent band')
+        super().__init__(max_silence=max_silence)
+        self.absolute = absolute or 0.0
+        self.percent = percent or 0.0
+
+    def band(self) -> float:
+        return max(self.absolute,
+                   self.percent / 100 * abs(self.last_report[1]))
+
+    def _filter(self, timestamp: float, value: float) -> List[Point]:
+        if abs(value - self.last_report[1]) > self.band():
+            return [(timestamp, value)]
+        return []
+
+
+class SwingingDoorFilter(ReportFilter):
+    """
+    Swinging door trending compression. Every sample between two reported
+    points lies within deviation of the straight line joining them. The
+    point closing a segment is reported one sample late, at the timestamp
+    of the previous sample and on the segment's line, i.e. within deviation
+    of that sample's value.
+    """
+
+    def __init__(self, *, deviation: float,
+                 max_silence: Optional[float] = None) -> None:
+        super().__init__(max_silence=max_silence)
+        self.deviation = deviation
+        self.held: Optional[Point] = None   # Last sample, not reported yet
+        self.upper = None                   # Steepest slope of the upper door
+        self.lower = None                   # Flattest slope of the lower door
+
+    def _slopes(self, anchor: Point, timestamp: float,
+                value: float) -> Tuple[float, float]:
+        elapsed = timestamp - anchor[0]
+        return ((value - anchor[1] - self.deviation) / elapsed,
+                (value - anchor[1] + self.deviation) / elapsed)
+
+    def _close(self) -> List[Point]:
+        """
+        Close the open segment at the held sample's time, on the mid slope
+        of the doors, so every sample since the last report stays within
+        deviation of the segment's line
+        """
+        if self.held is None:
+            return []
+        anchor_time, anchor_value = self.last_report
+        slope = (self.upper + self.lower) / 2
+        return [(self.held[0],
+                 anchor_value + slope * (self.held[0] - anchor_time))]
+
+    def flush(self) -> List[Point]:
+        """
+        Report the open segment, e.g. before the sensor stops
+        :return: Points to report
+        """
+        points = self._close()
+        if points:
+            self.n_reported += 1
+            self.last_report = points[-1]
+        self.held = None
+        self.upper = self.lower = None
+        return points
+
+    def _heartbeat(self, timestamp: float, value: float) -> List[Point]:
+        points = self._close() if self.last_report is not None else []
+        points.append((timestamp, value))
+        self.held = None
+        self.upper = self.lower = None
+        return points
+
+    def _filter(self, timestamp: float, value: float) -> List[Point]:
+        if timestamp <= self.last_report[0]:
+            return []
+        upper, lower = self._slopes(self.last_report, timestamp, value)
+        if self.upper is not None:
+            upper, lower = max(self.upper, upper), min(self.lower, lower)
+        if upper <= lower:
+            self.upper, self.lower = upper, lower
+            self.held = (timestamp, value)
+            return []
+        # The doors opened past parallel: close the segment and swing new
+        # doors from the closing point through the current sample
+        points = self._close()
+        self.upper, self.lower = self._slopes(points[0], timestamp, value)
+        self.held = (timestamp, value)
+        return points
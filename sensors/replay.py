@@ -0,0 +1,235 @@
+"""
+    Replay of recorded readouts.
+
+    A ReplaySource streams the readouts of a repository recording (a
+    FileRepository file in either wire format, or a SegmentRepository
+    directory) back into Network.send, keeping their relative timing at a
+    given speed, or as fast as possible. Recordings are read in chunks, in
+    file order, so they never have to fit in memory.
+"""
+
+import glob
+import json
+import os
+import threading
+from typing import Iterator, Optional
+
+from service.model.codec import WireFormat, Readout, \
+    TYPE_CODES, encode_readout, load_directory, message_to_readout, \
+    read_records
+from service.model.messages import DeviceMessage, DeviceMessageEnum, \
+    ReadoutMessage
+from service.repository.segment import Segment, SEGMENT_GLOB
+from utils.clock import Clock, SYSTEM_CLOCK
+from utils.network import Network
+
+READOUT = str(DeviceMessageEnum['DEVICE_READOUT'].value)
+SEGMENT_CHUNK = 1 << 16             # Rows read from a segment at once
+SLEEP_RESOLUTION = 0.001            # Readouts due within 1 ms are sent now
+START_STOP_WAIT = 1.5
+
+
+def read_text(path: str) -> Iterator[Readout]:
+    """ Readouts of a JSON lines file, lines that aren't readouts skipped """
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                content = json.loads(line)
+                message = DeviceMessage(content['msg_type'],
+                                        content['msg_content'])
+                readout = message_to_readout(message)
+            except (ValueError, KeyError, TypeError):
+                continue
+            if readout[1] in TYPE_CODES:
+                yield readout
+
+
+def read_segments(directory: str) -> Iterator[Readout]:
+    """ Readouts of the segments of a SegmentRepository, segment by segment """
+    for path in sorted(glob.glob(os.path.join(directory, SEGMENT_GLOB))):
+        segment = Segment(path)
+        for first in range(0, len(segment), SEGMENT_CHUNK):
+            rows = slice(first, first + SEGMENT_CHUNK)
+            for device_id, timestamp, value in zip(
+                    segment.sensor_ids[rows].tolist(),
+                    segment.timestamps[rows].tolist(),
+                    segment.values[rows].tolist()):
+                # Segments don't keep the interval
+                yield device_id, READOUT, timestamp, value, 0.0
+
+
+def read_recording(path: str, recording_format: Optional[WireFormat] = None) \
+        -> Iterator[Readout]:
+    """
+    Stream the readouts of a recording, whatever its kind
+    :param path: FileRepository file or SegmentRepository directory
+    :param recording_format: Format of a FileRepository file. By default a
+                             file with a <path>.sensors.json side file, which
+                             only BINARY repositories write, is BINARY.
+    :return: Iterator of readouts, in recording order
+    """
+    if os.path.isdir(path):
+        directory = os.path.join(path, 'sensors.json')
+        if os.path.exists(directory):
+            load_directory(directory)
+        return read_segments(path)
+    directory = f'{path}.sensors.json'
+    if os.path.exists(directory):
+        load_directory(directory)
+    if recording_format is None:
+        recording_format = WireFormat.BINARY if os.path.exists(directory) \
+            else WireFormat.JSON
+    if recording_format is WireFormat.JSON:
+        return read_text(path)
+    return read_records(path)
+
+
+class ReplaySource(threading.Thread):
+    """
+    Inject a recording into a Network as if its sensors were live
+    """
+
+    def __init__(self, *, path: str, net: Network, speed: float = 1.0,
+                 wire_format: WireFormat = WireFormat.JSON,
+                 retime: bool = False,
+                 recording_format: Optional[WireFormat] = None,
+                 clock: Clock = SYSTEM_CLOCK) -> None:
+        """
+        :param path: FileRepository file or SegmentRepository directory
+        :param net: Network receiving the readouts
+        :param speed: 1, 10, 100... times the recorded pace, 0 as fast as
+                      possible
+        :param wire_format: Format of the injected messages
+        :param retime: Stamp the readouts with the time they're injected at
+                       instead of their recorded time
+        :param recording_format: Format of a FileRepository recording,
+                                 detected by default, see read_recording()
+        :param clock: Time source
+        """
+        super().__init__(name='ReplaySource', daemon=True, target=self.run)
+        self.path = path
+        self.speed = speed
+        self.wire_format = wire_format
+        self.retime = retime
+        self.recording_format = recording_format
+        self.clock = clock
+        self.connection_point = net.connect_device()
+        self.stop_requested = threading.Event()
+        self.n_sent = 0
+        self.n_dropped = 0
+        self.first_ts = None
+        self.last_ts = None
+        self.started_at = None
+        self.stopped_at = None
+        self.max_lag = 0.0
+
+    def start_replay(self) -> None:
+        if self.is_alive():
+            print(f'The thread {self.name} is already running!')
+            return
+        print(f'Starting the thread: {self.name} for {self.path}')
+        self.start()
+
+    def stop_replay(self) -> None:
+        if not self.is_alive():
+            return
+        self.stop_requested.set()
+        self.join(START_STOP_WAIT)
+        if self.is_alive():
+            print(f'Thread {self.name} is still running!')
+        else:
+            print(f'Thread {self.name} has stopped!')
+
+    def wait_replay(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until the whole recording is replayed
+        :return: True when done
+        """
+        self.join(timeout)
+        return not self.is_alive()
+
+    def _message(self, readout: Readout) -> DeviceMessage:
+        device_id, msg_type, timestamp, value, interval = readout
+        if self.retime:
+            timestamp = self.clock.time()
+        if self.wire_format is WireFormat.BINARY:
+            return DeviceMessage(msg_type, encode_readout(
+                device_id, msg_type, timestamp, value, interval))
+        return ReadoutMessage(msg_type, device_id, timestamp, value, interval)
+
+    def stats(self) -> dict:
+        """
+        :return: Readouts sent and the requested versus achieved replay rate
+        """
+        end = self.stopped_at or self.clock.monotonic()
+        elapsed = end - self.started_at if self.started_at is not None else 0.0
+        span = (self.last_ts - self.first_ts) if self.n_sent else 0.0
+        requested = None
+        if self.speed and span:
+            requested = self.n_sent * self.speed / span
+        return {'sent': self.n_sent,
+                'dropped': self.n_dropped,
+                'recorded_seconds': span,
+                'elapsed_seconds': elapsed,
+                'requested_speed': self.speed or None,
+                'achieved_speed': span / elapsed if elapsed else None,
+                'requested_per_s': requested,
+                'achieved_per_s': self.n_sent / elapsed if elapsed else None,
+                'max_lag_seconds': self.max_lag}
+
+    def run(self) -> None:
+        """
+        Thread's worker function: send every readout when it's due
+        :return: None
+        """
+        self.started_at = self.clock.monotonic()
+        for readout in read_recording(self.path, self.recording_format):
+            if self.stop_requested.is_set():
+                break
+            timestamp = readout[2]
+            if self.first_ts is None:
+                self.first_ts = timestamp
+            if self.speed:
+                due = self.started_at + (timestamp - self.first_ts) / self.speed
+                delay = due - self.clock.monotonic()
+                if delay > SLEEP_RESOLUTION:
+                    if self.stop_requested.wait(delay):
+                        break
+                elif -delay > self.max_lag:
+                    self.max_lag = -delay
+            self.last_ts = max(timestamp, self.last_ts or timestamp)
+            if self.connection_point(self._message(readout)) is False:
+                self.n_dropped += 1
+            self.n_sent += 1
+        self.stopped_at = self.clock.monotonic()
+        print(f'Replay of {self.path} done: {self.stats()}')
+
+
+if __name__ == '__main__':
+
+    import argparse
+    from service.repository.repository import FileRepository
+    from utils.network import FlushPolicy
+
+    parser = argparse.ArgumentParser(prog='python -m sensors.replay')
+    parser.add_argument('path', help='Recording: repository file or segment '
+                                     'directory')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Replay speed, 0 as fast as possible')
+    parser.add_argument('--format', choices=[f.value for f in WireFormat],
+                        help='Format of a repository file, detected by '
+                             'default')
+    parser.add_argument('--output', default='./replay.txt',
+                        help='FileRepository receiving the replay')
+    args = parser.parse_args()
+    network = Network(capacity=100_000, flush_policy=FlushPolicy(1000, 0.05))
+    repository = FileRepository(location=args.output, network=network)
+    replay = ReplaySource(path=args.path, net=network, speed=args.speed,
+                          recording_format=WireFormat(args.format)
+                          if args.format else None)
+    repository.start_repository()
+    network.start_network()
+    replay.start_replay()
+    replay.wait_replay()
+    network.stop_network()
+    repository.stop_repository()
@@ -0,0 +1,251 @@
+"""
+    Central sensor scheduler.
+
+    A single dispatcher thread keeps every registered sensor in a heap ordered
+    by its next deadline and hands due sensors to a small pool of worker
+    threads, which call get_readout()/send_readout() on them. Deadlines are
+    computed at a fixed rate (start + k * interval), so the time spent building
+    and sending a readout never accumulates as drift.
+"""
+
+import heapq
+import itertools
+import queue
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+
+DEFAULT_WORKERS = 4
+START_STOP_WAIT = 1.5
+
+
+class ScheduledSensor:
+    """
+    Heap entry for a sensor plus its per-sensor jitter statistics
+    """
+    __slots__ = ('sensor', 'deadline', 'active', 'n_ticks', 'jitter_total',
+                 'jitter_max', 'jitter_last', 'overruns')
+
+    def __init__(self, sensor, deadline: float) -> None:
+        self.sensor = sensor
+        self.deadline = deadline
+        self.active = True
+        self.n_ticks = 0
+        self.jitter_total = 0.0
+        self.jitter_max = 0.0
+        self.jitter_last = 0.0
+        self.overruns = 0
+
+    def record(self, lateness: float) -> None:
+        """
+        Store the lateness of the current tick with respect to its deadline
+        :param lateness: seconds between the deadline and the actual start
+        :return: None
+        """
+        self.n_ticks += 1
+        self.jitter_last = lateness
+        self.jitter_total += lateness
+        if lateness > self.jitter_max:
+            self.jitter_max = lateness
+
+    def jitter(self) -> dict:
+        """
+        :return: Jitter summary for this sensor, times in ms
+        """
+        mean = self.jitter_total / self.n_ticks if self.n_ticks else 0.0
+        return {'ticks': self.n_ticks,
+                'jitter_mean_ms': 1000 * mean,
+                'jitter_max_ms': 1000 * self.jitter_max,
+                'jitter_last_ms': 1000 * self.jitter_last,
+                'overruns': self.overruns}
+
+
+class SensorScheduler:
+    """
+    Fire readouts for many sensors from a small worker pool
+    """
+
+    def __init__(self, *, n_workers: int = DEFAULT_WORKERS,
+                 name: str = 'SensorScheduler') -> None:
+        self.name = name
+        self.n_workers = n_workers
+        self._heap = []
+        self._entries: Dict[int, ScheduledSensor] = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._work = queue.SimpleQueue()
+        self._dispatcher: Optional[threading.Thread] = None
+        self._workers: List[threading.Thread] = []
+        self.start_running = threading.Event()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def start_scheduler(self) -> None:
+        if self.start_running.is_set():
+            print(f'The scheduler {self.name} is already running!')
+            return
+        print(f'Starting the scheduler: {self.name}')
+        self.start_running.set()
+        self._dispatcher = threading.Thread(name=f'{self.name}-dispatcher',
+                                            target=self._dispatch,
+                                            daemon=True)
+        self._workers = [threading.Thread(name=f'{self.name}-worker-{i}',
+                                          target=self._work_loop,
+                                          daemon=True)
+                         for i in range(self.n_workers)]
+        for thread in (self._dispatcher, *self._workers):
+            thread.start()
+
+    def stop_scheduler(self) -> None:
+        if not self.start_running.is_set():
+            return
+        self.start_running.clear()
+        with self._condition:
+            self._condition.notify_all()
+        for _ in self._workers:
+            self._work.put(None)
+        for thread in (self._dispatcher, *self._workers):
+            thread.join(START_STOP_WAIT)
+        if any(thread.is_alive() for thread in (self._dispatcher, *self._workers)):
+            print(f'Scheduler {self.name} is still running!')
+        else:
+            print(f'Scheduler {self.name} has stopped!')
+
+    def add_sensor(self, sensor) -> None:
+        """
+        Register a sensor. Its first readout is due one interval from now.
+        :param sensor: BaseSensor
+        :return: None
+        """
+        with self._condition:
+            if id(sensor) in self._entries:
+                print(f'Sensor {sensor.device_name} is already scheduled!')
+                return
+            entry = ScheduledSensor(sensor, time.monotonic() + sensor.interval)
+            self._entries[id(sensor)] = entry
+            self._push(entry)
+
+    def add_sensors(self, sensors: Iterable) -> None:
+        """
+        Register many sensors taking the lock once
+        :param sensors: Iterable of BaseSensor
+        :return: None
+        """
+        now = time.monotonic()
+        with self._condition:
+            for sensor in sensors:
+                if id(sensor) in self._entries:
+                    print(f'Sensor {sensor.device_name} is already scheduled!')
+                    continue
+                entry = ScheduledSensor(sensor, now + sensor.interval)
+                self._entries[id(sensor)] = entry
+                self._heap.append((entry.deadline, next(self._sequence),
+                                   entry))
+            heapq.heapify(self._heap)
+            self._condition.notify()
+
+    def remove_sensor(self, sensor) -> None:
+        """
+        Unregister a sensor. A readout already handed to a worker completes.
+        :param sensor: BaseSensor
+        :return: None
+        """
+        with self._condition:
+            entry = self._entries.pop(id(sensor), None)
+            if entry is not None:
+                entry.active = False
+
+    def remove_sensors(self, sensors: Iterable) -> None:
+        """
+        Unregister many sensors taking the lock once
+        :param sensors: Iterable of BaseSensor
+        :return: None
+        """
+        with self._condition:
+            for sensor in sensors:
+                entry = self._entries.pop(id(sensor), None)
+                if entry is not None:
+                    entry.active = False
+
+    def is_scheduled(self, sensor) -> bool:
+        return id(sensor) in self._entries
+
+    def jitter(self, sensor) -> Optional[dict]:
+        """
+        Jitter report for a single sensor
+        :param sensor: BaseSensor
+        :return: dict or None when the sensor is not scheduled
+        """
+        entry = self._entries.get(id(sensor))
+        return None if entry is None else entry.jitter()
+
+    def jitter_report(self) -> Dict[str, dict]:
+        """
+        :return: Jitter report of every scheduled sensor, keyed by device name
+        """
+        with self._condition:
+            entries = list(self._entries.values())
+        return {entry.sensor.device_name: entry.jitter() for entry in entries}
+
+    def _push(self, entry: ScheduledSensor) -> None:
+        """ Insert an entry in the heap. Caller holds the condition """
+        is_earliest = not self._heap or entry.deadline < self._heap[0][0]
+        heapq.heappush(self._heap,
+                       (entry.deadline, next(self._sequence), entry))
+        if is_earliest:
+            self._condition.notify()
+
+    def _reschedule(self, entry: ScheduledSensor) -> None:
+        """
+        Compute the next fixed-rate deadline. Periods that are already in the
+        past are skipped and counted as overruns instead of fired in a burst.
+        """
+        now = time.monotonic()
+        with self._condition:
+            if not entry.active:
+                return
+            interval = entry.sensor.interval
+            deadline = entry.deadline + interval
+            if deadline <= now:
+                skipped = int((now - deadline) // interval) + 1
+                entry.overruns += skipped
+                deadline += skipped * interval
+            entry.deadline = deadline
+            self._push(entry)
+
+    def _dispatch(self) -> None:
+        """
+        Dispatcher thread: hand every due sensor to the worker pool
+        :return: None
+        """
+        with self._condition:
+            while self.start_running.is_set():
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                deadline, _, entry = self._heap[0]
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                if entry.active:
+                    self._work.put(entry)
+
+    def _work_loop(self) -> None:
+        """
+        Worker thread: take a readout and send it
+        :return: None
+        """
+        while True:
+            entry = self._work.get()
+            if entry is None:
+                return
+            entry.record(time.monotonic() - entry.deadline)
+            try:
+                entry.sensor.tick()
+            except Exception as err:
+                print(f'Sensor {entry.sensor.device_name} failed: {err}')
+            self._reschedule(entry)
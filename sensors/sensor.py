@@ -1,8 +1,13 @@
 
 from enum import Enum
-from typing import Union
+from typing import Union, Optional
 from sensors.basesensor import BaseSensor
 from sensors.basesensor import SensorBank
+from sensors.scheduler import SensorScheduler
+from service.model.codec import WireFormat
+from sensors.compression import ReportFilter
+from sensors.adaptive import AdaptiveRate
+from utils.clock import Clock, SYSTEM_CLOCK
 
 from utils.network import Network
 
@@ -20,28 +25,48 @@ class Sensor(BaseSensor):
     Generic Sensor definition
     """
     def __init__(self, *, sensor_type: SensorType, name: str, net: Network,
-                 interval: Union[int | float]) -> None:
-        super().__init__(name=name, net=net, interval=interval)
+                 interval: Union[int | float],
+                 scheduler: Optional[SensorScheduler] = None,
+                 wire_format: WireFormat = WireFormat.JSON,
+                 report_filter: Optional[ReportFilter] = None,
+                 adaptive_rate: Optional[AdaptiveRate] = None,
+                 clock: Clock = SYSTEM_CLOCK) -> None:
         self.sensor_type = SensorType[sensor_type.name].value
-
-    def _build_sensor_message(self) -> dict:
-        out = {'sensor_type': self.sensor_type}
-        out.update(super()._build_sensor_message())
-        return out
+        super().__init__(name=name, net=net, interval=interval,
+                         scheduler=scheduler, wire_format=wire_format,
+                         report_filter=report_filter,
+                         adaptive_rate=adaptive_rate, clock=clock)
 
 
 def get_sensor(*, sensor_type: SensorType, sensor_name: str,
-               net: Network, exec_interval: float) -> Sensor:
+               net: Network, exec_interval: float,
+               scheduler: Optional[SensorScheduler] = None,
+               wire_format: WireFormat = WireFormat.JSON,
+               report_filter: Optional[ReportFilter] = None,
+               adaptive_rate: Optional[AdaptiveRate] = None,
+               clock: Clock = SYSTEM_CLOCK) -> Sensor:
     """
     Sensor factory function
     :param sensor_type: SensorType
     :param sensor_name: str
     :param exec_interval: float
     :param network: Network
+    :param scheduler: Optional SensorScheduler firing the readouts instead of
+                      a dedicated thread per sensor
+    :param wire_format: JSON or BINARY readouts
+    :param report_filter: Optional ReportFilter, e.g. DeadbandFilter, sending
+                          only the samples that leave its bounds
+    :param adaptive_rate: Optional AdaptiveRate, the interval then follows
+                          the volatility of the signal between its bounds,
+                          starting at its max_interval
+    :param clock: Time source of the readouts, e.g. a VirtualClock
     :return:
     """
     generic_sensor = Sensor(name=sensor_name, sensor_type=sensor_type,
-                            net=net, interval=exec_interval)
+                            net=net, interval=exec_interval,
+                            scheduler=scheduler, wire_format=wire_format,
+                            report_filter=report_filter,
+                            adaptive_rate=adaptive_rate, clock=clock)
     return generic_sensor
 
 
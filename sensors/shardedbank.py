@@ -0,0 +1,185 @@
+"""
+    Process-sharded sensor bank.
+    The sensors of a SensorBank are split across worker processes. Every
+    worker advances its shard's signals, builds the JSON readouts and writes
+    them into its own shared memory ring buffer; a drain thread in the parent
+    wraps them into DeviceMessages and sends them to the Network.
+"""
+
+import heapq
+import json
+import multiprocessing
+import os
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from sensors.basesensor import SensorBank, TS_FORMAT
+from sensors.signal import SignalBank
+from service.model.messages import DeviceMessage, DeviceMessageEnum
+from service.model.codec import WireFormat, sensor_id, encode_readout
+from utils.network import Network
+from utils.sharedring import SharedRingBuffer, DEFAULT_CAPACITY
+
+
+DRAIN_INTERVAL = 0.01       # 10 ms
+DRAIN_BATCH = 1024
+START_STOP_WAIT = 5.0
+READOUT = str(DeviceMessageEnum['DEVICE_READOUT'].value)
+
+SensorSpec = Tuple[str, Optional[str], float]   # name, sensor type, interval
+
+
+def _shard_worker(ring_name: str, specs: List[SensorSpec], seed: int,
+                  stop: multiprocessing.Event,
+                  wire_format: WireFormat = WireFormat.JSON) -> None:
+    """
+    Worker process: fixed-rate readouts for a shard of sensors
+    :param ring_name: Shared memory block of the shard's ring buffer
+    :param specs: Sensors of the shard
+    :param seed: SignalBank seed
+    :param stop: Event set by the parent to stop the worker
+    :param wire_format: Format of the records written into the ring
+    :return: None
+    """
+    if not specs:
+        return
+    ring = SharedRingBuffer(name=ring_name)
+    signals = SignalBank([name for name, _, _ in specs], seed=seed)
+    device_ids = [sensor_id(name) for name, _, _ in specs]
+    start = time.monotonic()
+    schedule = [(start + interval, index)
+                for index, (_, _, interval) in enumerate(specs)]
+    heapq.heapify(schedule)
+    try:
+        while not stop.is_set():
+            deadline = schedule[0][0]
+            delay = deadline - time.monotonic()
+            if delay > 0 and stop.wait(delay):
+                break
+            due = []
+            while schedule and schedule[0][0] <= deadline:
+                _, index = heapq.heappop(schedule)
+                due.append(index)
+                interval = specs[index][2]
+                heapq.heappush(schedule, (deadline + interval, index))
+            values = signals.step(np.array(due))
+            now = datetime.now().timestamp()
+            if wire_format is WireFormat.BINARY:
+                for index, value in zip(due, values):
+                    ring.put(encode_readout(device_ids[index], READOUT, now,
+                                            value, specs[index][2]))
+                continue
+            timestamp = f'{now:.{TS_FORMAT}f}'
+            for index, value in zip(due, values):
+                name, sensor_type, interval = specs[index]
+                out = {'device_name': name,
+                       'value': f'{value:.{signals.n_decimals}f}',
+                       'interval': f'{1000 * interval} ms',
+                       'posix_timestamp': timestamp}
+                if sensor_type is not None:
+                    out = {'sensor_type': sensor_type, **out}
+                ring.put(json.dumps({'readout': out}).encode())
+    finally:
+        ring.close()
+
+
+class ShardedSensorBank:
+    """
+    Run the sensors of a SensorBank in worker processes
+    """
+
+    def __init__(self, *, bank: SensorBank, net: Network,
+                 n_workers: Optional[int] = None,
+                 ring_capacity: int = DEFAULT_CAPACITY,
+                 seed: Optional[int] = None,
+                 wire_format: WireFormat = WireFormat.JSON) -> None:
+        self.name = 'ShardedSensorBank'
+        self.specs: List[SensorSpec] = [
+            (sensor.device_name, getattr(sensor, 'sensor_type', None),
+             sensor.interval) for sensor in bank]
+        self.n_workers = max(1, min(n_workers or os.cpu_count() or 1,
+                                    len(self.specs)))
+        self.ring_capacity = ring_capacity
+        self.wire_format = wire_format
+        self.seed = seed if seed is not None else time.time_ns()
+        self.send_batch = net.send_batch
+        self.rings: List[SharedRingBuffer] = []
+        self.workers: List[multiprocessing.Process] = []
+        self.drained = 0
+        self.dropped = 0
+        self._context = multiprocessing.get_context('spawn')
+        self._stop = self._context.Event()
+        self._drain_stop = threading.Event()
+        self._drainer: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(self.specs)
+
+    def shards(self) -> List[List[SensorSpec]]:
+        """ Round-robin split of the sensors among the workers """
+        return [self.specs[i::self.n_workers] for i in range(self.n_workers)]
+
+    def start_bank(self) -> None:
+        if self.workers:
+            print(f'The {self.name} is already running!')
+            return
+        print(f'Starting {self.n_workers} workers for {len(self)} sensors')
+        self._stop.clear()
+        self._drain_stop.clear()
+        for shard_id, shard in enumerate(self.shards()):
+            ring = SharedRingBuffer(capacity=self.ring_capacity)
+            worker = self._context.Process(
+                target=_shard_worker, name=f'{self.name}-{shard_id}',
+                args=(ring.name, shard, self.seed, self._stop,
+                      self.wire_format),
+                daemon=True)
+            self.rings.append(ring)
+            self.workers.append(worker)
+        for worker in self.workers:
+            worker.start()
+        self._drainer = threading.Thread(name=f'{self.name}-drain',
+                                         target=self._drain_loop, daemon=True)
+        self._drainer.start()
+
+    def stop_bank(self) -> None:
+        if not self.workers:
+            return
+        self._stop.set()
+        for worker in self.workers:
+            worker.join(START_STOP_WAIT)
+        self._drain_stop.set()
+        self._drainer.join(START_STOP_WAIT)
+        self.drain()
+        self.dropped += sum(ring.dropped for ring in self.rings)
+        for ring in self.rings:
+            ring.close()
+        self.rings, self.workers = [], []
+        print(f'{self.name} has stopped! {self.drained} readouts drained, '
+              f'{self.dropped} dropped')
+
+    def drain(self) -> int:
+        """
+        Move the readouts found in the rings to the Network, one
+        send_batch, so one lock of its queue, per chunk of a ring
+        :return: Number of readouts moved
+        """
+        n_messages = 0
+        decode = self.wire_format is WireFormat.JSON
+        for ring in self.rings:
+            records = ring.get_batch(DRAIN_BATCH)
+            if not records:
+                continue
+            self.send_batch([DeviceMessage(READOUT, record.decode() if decode
+                                           else record) for record in records])
+            n_messages += len(records)
+        self.drained += n_messages
+        return n_messages
+
+    def _drain_loop(self) -> None:
+        while not self._drain_stop.is_set():
+            if not self.drain():
+                self._drain_stop.wait(DRAIN_INTERVAL)
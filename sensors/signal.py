@@ -1,6 +1,9 @@
 ''' Synthetic signal module '''
 import random
-from random import gauss
+import zlib
+from typing import Optional, Sequence
+
+import numpy as np
 
 # Sensor MIN and MAX ranges
 SENSOR_MAX = 100
@@ -9,6 +12,10 @@ N_DECIMALS = 4
 MU = 0
 MAIN_VARIANCE = 24.5
 MINOR_VARIANCE = 0.6
+# splitmix64 constants of the per-sensor counter streams
+GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+MIX_2 = np.uint64(0x94D049BB133111EB)
 
 
 class Signal:
@@ -22,7 +29,15 @@ class Signal:
 
     @property
     def value(self) -> str:
-        delta = gauss(MU, MINOR_VARIANCE)
+        self.sample()
+        return f'{self.current_value:.{self.n_decimals}f}'
+
+    def sample(self) -> float:
+        """
+        Advance the signal
+        :return: The new value rounded to n_decimals, without formatting it
+        """
+        delta = self._rng.gauss(MU, MINOR_VARIANCE)
         self.current_value = self._value + delta
         if self.current_value < SENSOR_MIN:
             self._value += (-1.0 if delta < 0 else 1.0) * delta
@@ -32,18 +47,105 @@ class Signal:
             self.current_value += 4 * delta
         else:
             self._value = self.current_value
-        return f'{self.current_value:.{self.n_decimals}f}'
+        return round(self.current_value, self.n_decimals)
 
     @value.setter
     def value(self, value: str) -> None:
-        random.seed(value)
+        # Every signal owns its random stream, seeded by the given value
+        self._rng = random.Random(value)
         self._value = None
         if self.current_value is None:
-            self._value = gauss(MU, MAIN_VARIANCE)
-    
+            self._value = self._rng.gauss(MU, MAIN_VARIANCE)
+
     def __str__(self):
         return f'{self.value:.{self.n_decimals}f}'
 
-    
 
+def splitmix64(x: np.ndarray) -> np.ndarray:
+    """ Vectorized splitmix64 finalizer: 64 random bits per uint64 input """
+    x = x + GOLDEN_GAMMA
+    x = (x ^ (x >> np.uint64(30))) * MIX_1
+    x = (x ^ (x >> np.uint64(27))) * MIX_2
+    return x ^ (x >> np.uint64(31))
+
+
+class SignalBank:
+    """
+    The Gaussian processes of many sensors held in NumPy arrays and advanced
+    together with one vectorized draw per step.
+    Every sensor has its own stream, seeded from the bank's seed and a crc32
+    of its name: its n-th draw is a splitmix64 hash of its key and n, turned
+    into a normal value with Box-Muller, so a sensor's values only depend on
+    the seed and its name, not on the other sensors of the bank, and no
+    global random state is touched.
+    """
+    def __init__(self, names: Sequence[str], *,
+                 seed: Optional[int] = None) -> None:
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.n_decimals = N_DECIMALS
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self._keys = np.fromiter(
+            (self._seed(name).generate_state(1, np.uint64)[0]
+             for name in self.names), np.uint64, len(self.names))
+        self._draws = np.zeros(len(self.names), dtype=np.uint64)
+        self._value = self._normal(slice(None), MAIN_VARIANCE)
+        self.current_value = self._value.copy()
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _seed(self, name: str) -> np.random.SeedSequence:
+        return np.random.SeedSequence(self.seed_sequence.entropy,
+                                      spawn_key=(zlib.crc32(name.encode()),))
+
+    def generator(self, name: str) -> np.random.Generator:
+        """
+        Independent random stream of a single sensor
+        :param name: Sensor name
+        :return: Generator seeded from the bank's seed and the sensor's name
+        """
+        return np.random.default_rng(self._seed(name))
+
+    def _normal(self, indices, scale: float) -> np.ndarray:
+        """ Next draw of every sensor in indices, from its own stream """
+        draws = self._draws[indices]
+        bits = splitmix64(self._keys[indices] ^ splitmix64(draws))
+        self._draws[indices] = draws + np.uint64(1)
+        # Two 32 bit uniforms, the first one in (0, 1] for the log
+        first = ((bits >> np.uint64(32)).astype(np.float64) + 1.0) / 2.0 ** 32
+        second = (bits & np.uint64(0xFFFFFFFF)).astype(np.float64) / 2.0 ** 32
+        return MU + scale * np.sqrt(-2.0 * np.log(first)) * \
+            np.cos(2.0 * np.pi * second)
+
+    def step(self, indices: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Advance the signals one step, reflecting at SENSOR_MIN/SENSOR_MAX
+        exactly like Signal.value does.
+        :param indices: Slots to advance, all of them by default
+        :return: Current values of the advanced sensors
+        """
+        if indices is None:
+            indices = slice(None)
+        value = self._value[indices]
+        delta = self._normal(indices, MINOR_VARIANCE)
+        current = value + delta
+        below = current < SENSOR_MIN
+        above = current > SENSOR_MAX
+        out_of_range = below | above
+        magnitude = np.abs(delta)
+        np.copyto(value, current, where=~out_of_range)
+        value[below] += magnitude[below]
+        value[above] -= magnitude[above]
+        current[out_of_range] += 4 * delta[out_of_range]
+        self._value[indices] = value
+        self.current_value[indices] = current
+        return current
 
+    def value(self, name: str) -> str:
+        """
+        Last value of a sensor formatted like Signal.value
+        :param name: Sensor name
+        :return: str
+        """
+        return f'{self.current_value[self.index[name]]:.{self.n_decimals}f}'
@@ -0,0 +1,141 @@
+"""
+    Discrete-event simulation of a sensor fleet.
+
+    The sensors, created with a VirtualClock, are fired by the clock's event
+    heap instead of threads, and the network's flush policy is applied in
+    virtual time, so hours of sensor time run as fast as the CPU allows.
+    Everything happens on the caller's thread except the repository's
+    writer, which receives the batches in order: for a given seed the
+    messages, their order and their timestamps are the same on every run.
+"""
+
+import random
+import time
+from typing import Iterable, Optional
+
+from sensors.basesensor import BaseSensor
+from sensors.signal import Signal
+from utils.clock import VirtualClock
+from utils.network import Network
+
+
+class Simulation:
+    """
+    Fire the readouts of many sensors and flush the network in virtual time
+    """
+
+    def __init__(self, *, clock: VirtualClock, network: Network,
+                 seed: Optional[int] = None) -> None:
+        """
+        :param clock: Clock of the sensors and the network
+        :param network: Network whose thread is NOT started, the simulation
+                        hands the batches to its repository
+        :param seed: Selects the sensors' signals and the phase of their first
+                     readout. Without a seed every sensor starts one interval
+                     after being added, with its own name's signal.
+        """
+        self.clock = clock
+        self.network = network
+        self.seed = seed
+        self._rng = random.Random(seed)
+        self._flush_due = None
+        self.n_sensors = 0
+        self.n_ticks = 0
+        self.n_readouts = 0
+        self.n_flushes = 0
+        self.virtual_time = 0.0
+        self.wall_time = 0.0
+
+    def add_sensors(self, sensors: Iterable[BaseSensor]) -> None:
+        """
+        Schedule the first readout of every sensor
+        :param sensors: Sensors created with this simulation's clock
+        :return: None
+        """
+        for sensor in sensors:
+            if sensor.clock is not self.clock:
+                raise ValueError(f'Sensor {sensor.device_name} does not use '
+                                 f'the simulation clock')
+            delay = sensor.interval
+            if self.seed is not None:
+                sensor.signal = Signal(f'{self.seed}:{sensor.device_name}')
+                delay = self._rng.uniform(0, sensor.interval)
+            self.clock.call_later(delay, self._tick, sensor)
+            self.n_sensors += 1
+
+    def _tick(self, sensor: BaseSensor) -> None:
+        """ Readout event of a sensor, fixed rate """
+        self.n_ticks += 1
+        self.n_readouts += len(sensor.tick())
+        self.clock.call_later(sensor.interval, self._tick, sensor)
+        max_batch, max_latency = self.network.flush_policy
+        if len(self.network.message_queue) >= max_batch:
+            self.flush()
+        elif self._flush_due is None and len(self.network.message_queue):
+            self._flush_due = self.clock.monotonic() + max_latency
+            self.clock.call_at(self._flush_due, self._timed_flush,
+                               self._flush_due)
+
+    def _timed_flush(self, due: float) -> None:
+        if self._flush_due == due:
+            self.flush()
+
+    def flush(self) -> None:
+        """ Hand the queued messages over to the repository """
+        self._flush_due = None
+        if len(self.network.message_queue):
+            self.n_flushes += 1
+            self.network.notify_repository()
+
+    def run(self, duration: float) -> dict:
+        """
+        Simulate the fleet for some virtual time, then flush the network
+        :param duration: Virtual seconds
+        :return: Simulation statistics
+        """
+        start = time.perf_counter()
+        self.clock.run_until(self.clock.monotonic() + duration)
+        self.flush()
+        self.network.wait_delivered()
+        self.virtual_time += duration
+        self.wall_time += time.perf_counter() - start
+        return self.stats()
+
+    def stats(self) -> dict:
+        wall = self.wall_time
+        return {'sensors': self.n_sensors,
+                'virtual_seconds': self.virtual_time,
+                'wall_seconds': wall,
+                'speedup': self.virtual_time / wall if wall else 0.0,
+                'ticks': self.n_ticks,
+                'readouts': self.n_readouts,
+                'flushes': self.n_flushes,
+                'readouts_per_s': self.n_readouts / wall if wall else 0.0}
+
+
+if __name__ == '__main__':
+
+    import sys
+    from sensors.sensor import get_sensor, SensorType
+    from service.model.codec import WireFormat
+    from service.repository.repository import FileRepository
+    from utils.network import FlushPolicy
+
+    n_sensors = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    hours = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    clock = VirtualClock()
+    network = Network(capacity=20_000, flush_policy=FlushPolicy(10_000, 1.0),
+                      clock=clock)
+    repository = FileRepository(location='./simulation.bin', network=network,
+                                wire_format=WireFormat.BINARY)
+    repository.start_repository()
+    simulation = Simulation(clock=clock, network=network, seed=0)
+    sensor_types = list(SensorType)
+    simulation.add_sensors(
+        get_sensor(sensor_type=sensor_types[i % len(sensor_types)],
+                   sensor_name=f'Sim Sensor {i:05d}', net=network,
+                   exec_interval=5.0, wire_format=WireFormat.BINARY,
+                   clock=clock)
+        for i in range(n_sensors))
+    print(simulation.run(3600 * hours))
+    repository.stop_repository()
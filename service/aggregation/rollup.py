@@ -0,0 +1,345 @@
+"""
+  Streaming rollups of the sensor readings.
+  The RollupAggregator subscribes to the Network and keeps, for every sensor
+  and resolution (1 s, 1 min, 1 h by default), the min/max/sum/count of the
+  current tumbling window in NumPy arrays indexed by sensor slot. Windows
+  are finalized when a later reading arrives, or when they expire: a window
+  expires once the watermark, the latest reading time seen from any sensor
+  capped by the network's clock, is EXPIRY_GRACE past its end. Expiry thus
+  follows the data, whether it arrives live, delayed or replayed in virtual
+  time. Finalized windows go to a rollup sink and are never reopened:
+  readings of a window at or before the last one finalized for their sensor
+  are counted as late. Raw batches are passed through unchanged, so
+  repositories subscribe to the aggregator exactly as they would to the
+  Network, each with its own Subscription. stop_aggregator() finalizes the
+  windows still open at shutdown.
+"""
+
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from service.model.codec import message_to_readout, sensor_id
+from utils.network import Network, Subscription, SINK_CAPACITY, \
+    START_STOP_WAIT
+from utils.ringbuffer import OverflowPolicy, DEFAULT_BLOCK_TIMEOUT
+
+
+RESOLUTIONS = (1.0, 60.0, 3600.0)       # 1 s, 1 min, 1 h
+INITIAL_SLOTS = 1024
+EXPIRY_GRACE = 1.0                      # Wait 1 s for late readings
+
+
+class Rollup(NamedTuple):
+    sensor_id: int
+    resolution: float
+    window_start: float
+    count: int
+    minimum: float
+    maximum: float
+    mean: float
+
+
+class WindowAccumulator:
+    """
+    Open tumbling window of every sensor slot for one resolution
+    """
+
+    def __init__(self, resolution: float, capacity: int) -> None:
+        self.resolution = resolution
+        self.window = np.full(capacity, -1, dtype=np.int64)
+        self.count = np.zeros(capacity, dtype=np.int64)
+        self.total = np.zeros(capacity, dtype=np.float64)
+        self.minimum = np.full(capacity, np.inf)
+        self.maximum = np.full(capacity, -np.inf)
+        # Last finalized window of every slot
+        self.closed = np.full(capacity, -1, dtype=np.int64)
+        self.n_late = 0
+
+    def grow(self, capacity: int) -> None:
+        extra = capacity - len(self.window)
+        self.window = np.concatenate([self.window, np.full(extra, -1)])
+        self.count = np.concatenate([self.count, np.zeros(extra, np.int64)])
+        self.total = np.concatenate([self.total, np.zeros(extra)])
+        self.minimum = np.concatenate([self.minimum, np.full(extra, np.inf)])
+        self.maximum = np.concatenate([self.maximum, np.full(extra, -np.inf)])
+        self.closed = np.concatenate([self.closed, np.full(extra, -1)])
+
+    def _close(self, slots: np.ndarray) -> tuple:
+        """ Finalize the open windows of the given slots and reset them """
+        closed = (slots, self.window[slots], self.count[slots],
+                  self.total[slots], self.minimum[slots], self.maximum[slots])
+        self.closed[slots] = self.window[slots]
+        self.count[slots] = 0
+        self.total[slots] = 0.0
+        self.minimum[slots] = np.inf
+        self.maximum[slots] = -np.inf
+        return closed
+
+    def add(self, slots: np.ndarray, timestamps: np.ndarray,
+            values: np.ndarray) -> List[tuple]:
+        """
+        Fold a batch of readings into the open windows. The batch is grouped
+        per (slot, window) with one sort, so each reading costs O(1) array
+        work. Readings older than a slot's open window, or of a window
+        already finalized, are counted as late.
+        :return: Finalized windows as (slots, windows, count, total, min, max)
+        """
+        windows = (timestamps // self.resolution).astype(np.int64)
+        order = np.lexsort((windows, slots))
+        slots, windows, values = slots[order], windows[order], values[order]
+        starts = np.flatnonzero(np.r_[True, (slots[1:] != slots[:-1]) |
+                                      (windows[1:] != windows[:-1])])
+        g_slot, g_window = slots[starts], windows[starts]
+        g_count = np.diff(np.r_[starts, len(slots)])
+        g_total = np.add.reduceat(values, starts)
+        g_min = np.minimum.reduceat(values, starts)
+        g_max = np.maximum.reduceat(values, starts)
+
+        open_window = self.window[g_slot]
+        is_open = self.count[g_slot] > 0
+        late = (is_open & (g_window < open_window)) | \
+            (g_window <= self.closed[g_slot])
+        self.n_late += int(g_count[late].sum())
+        same = is_open & (g_window == open_window)
+        later = ~late & ~same
+        finalized = []
+
+        # Readings of the window already open
+        merge = g_slot[same]
+        self.count[merge] += g_count[same]
+        self.total[merge] += g_total[same]
+        self.minimum[merge] = np.minimum(self.minimum[merge], g_min[same])
+        self.maximum[merge] = np.maximum(self.maximum[merge], g_max[same])
+
+        # A later window closes the open one
+        closing = np.unique(g_slot[later & is_open])
+        if len(closing):
+            finalized.append(self._close(closing))
+
+        # Later windows: the last one of each slot stays open
+        last = np.r_[g_slot[1:] != g_slot[:-1], True]
+        complete = later & ~last
+        if complete.any():
+            finalized.append((g_slot[complete], g_window[complete],
+                              g_count[complete], g_total[complete],
+                              g_min[complete], g_max[complete]))
+            np.maximum.at(self.closed, g_slot[complete], g_window[complete])
+        opening = later & last
+        new = g_slot[opening]
+        self.window[new] = g_window[opening]
+        self.count[new] = g_count[opening]
+        self.total[new] = g_total[opening]
+        self.minimum[new] = g_min[opening]
+        self.maximum[new] = g_max[opening]
+        return finalized
+
+    def expire(self, now: float) -> List[tuple]:
+        """
+        Finalize the open windows that ended before now
+        :param now: posix timestamp
+        :return: Finalized windows
+        """
+        ended = (self.window + 1) * self.resolution <= now
+        slots = np.flatnonzero(ended & (self.count > 0))
+        return [self._close(slots)] if len(slots) else []
+
+
+class RollupStore:
+    """
+    In-memory rollup sink. Queries use the coarsest resolution whose windows
+    are aligned with the requested range.
+    """
+
+    def __init__(self) -> None:
+        self.rollups: Dict[Tuple[float, int], List[Rollup]] = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, rollups: Sequence[Rollup]) -> None:
+        with self.lock:
+            for rollup in rollups:
+                self.rollups.setdefault((rollup.resolution, rollup.sensor_id),
+                                        []).append(rollup)
+
+    def resolution_for(self, start: Optional[float],
+                       end: Optional[float]) -> Optional[float]:
+        """
+        :return: Coarsest resolution aligned with [start, end)
+        """
+        resolutions = sorted({resolution for resolution, _ in self.rollups},
+                             reverse=True)
+        for resolution in resolutions:
+            if all(bound is None or bound % resolution == 0
+                   for bound in (start, end)):
+                return resolution
+        return resolutions[-1] if resolutions else None
+
+    def query(self, sensor_name: str, start: Optional[float] = None,
+              end: Optional[float] = None) -> List[Rollup]:
+        """
+        Finalized rollups of a sensor whose window starts in [start, end)
+        :param sensor_name: str
+        :param start: posix timestamp
+        :param end: posix timestamp
+        :return: List of Rollup, oldest first
+        """
+        with self.lock:
+            resolution = self.resolution_for(start, end)
+            rollups = list(self.rollups.get((resolution,
+                                             sensor_id(sensor_name)), []))
+        return sorted(rollup for rollup in rollups
+                      if (start is None or rollup.window_start >= start)
+                      and (end is None or rollup.window_start < end))
+
+
+class RollupAggregator:
+    """
+    Aggregation stage between the Network and the repositories
+    """
+
+    def __init__(self, *, network: Network,
+                 resolutions: Sequence[float] = RESOLUTIONS,
+                 sink: Optional[Callable[[List[Rollup]], None]] = None) -> None:
+        self.name = 'RollupAggregator'
+        self.sink = sink if sink is not None else RollupStore()
+        self.slots: Dict[int, int] = {}
+        self.slot_ids = np.zeros(INITIAL_SLOTS, dtype=np.int64)
+        self.accumulators = [WindowAccumulator(resolution, INITIAL_SLOTS)
+                             for resolution in resolutions]
+        self.subscriptions: Dict[str, Subscription] = {}
+        self.n_rollups = 0
+        self.n_invalid = 0
+        self.watermark = -np.inf
+        self.clock = network.clock
+        self.lock = threading.Lock()
+        self.get_upstream = network.connect_repository(self.notifyme,
+                                                       name=self.name)
+
+    def connect_repository(self, notification_fn: Callable, *,
+                           name: Optional[str] = None,
+                           capacity: int = SINK_CAPACITY,
+                           policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+                           block_timeout: float = DEFAULT_BLOCK_TIMEOUT) \
+            -> Callable:
+        """
+        Subscribe a repository to the raw batches, as with the Network: every
+        subscriber gets every batch through its own bounded queue and worker
+        thread, so a slow repository doesn't hold the rollups back.
+        :param notification_fn: Called for every batch
+        :param name: Subscriber's name, used in the stats
+        :param capacity: Messages that can wait for this subscriber
+        :param policy: What happens to this subscriber's batches when its
+                       queue is full
+        :param block_timeout: Longest wait of the BLOCK policy
+        :return: returns the function to get the batch being delivered
+        """
+        name = name or f'subscriber-{len(self.subscriptions)}'
+        if name in self.subscriptions:
+            raise ValueError(f'The aggregator already has a subscriber {name}')
+        subscription = Subscription(name=name, notification_fn=notification_fn,
+                                    capacity=capacity, policy=policy,
+                                    block_timeout=block_timeout,
+                                    clock=self.clock)
+        self.subscriptions[name] = subscription
+        subscription.start()
+        return subscription.get
+
+    def sink_stats(self) -> Dict[str, dict]:
+        """
+        :return: Pending, delivered and dropped messages and the lag of every
+                 subscriber
+        """
+        return {name: subscription.stats()
+                for name, subscription in self.subscriptions.items()}
+
+    def notifyme(self) -> None:
+        batch = self.get_upstream()
+        with self.lock:
+            if batch:
+                self.add(batch)
+            self.expire()
+        if batch:
+            for subscription in self.subscriptions.values():
+                subscription.offer(batch)
+
+    def stop_aggregator(self, timeout: float = START_STOP_WAIT) -> None:
+        """
+        Finalize the open windows and let the subscribers deliver what they
+        hold. Call it once the network has stopped.
+        :param timeout: Longest wait for the subscribers, in seconds
+        """
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            self.flush()
+        for subscription in self.subscriptions.values():
+            subscription.close(wait=False)
+        for subscription in self.subscriptions.values():
+            subscription.join(max(0.0, deadline - time.monotonic()))
+
+    def _slot(self, device_id: int) -> int:
+        slot = self.slots.get(device_id)
+        if slot is None:
+            slot = self.slots[device_id] = len(self.slots)
+            if slot >= len(self.slot_ids):
+                capacity = 2 * len(self.slot_ids)
+                self.slot_ids = np.concatenate(
+                    [self.slot_ids, np.zeros(capacity - len(self.slot_ids),
+                                             dtype=np.int64)])
+                for accumulator in self.accumulators:
+                    accumulator.grow(capacity)
+            self.slot_ids[slot] = device_id
+        return slot
+
+    def add(self, messages: List) -> None:
+        """
+        Fold a batch of messages into every resolution
+        :param messages: List of DeviceMessage
+        :return: None
+        """
+        readouts = []
+        for message in messages:
+            try:
+                readouts.append(message_to_readout(message))
+            except (ValueError, KeyError, TypeError, AttributeError):
+                # One bad message must not cost the batch its rollups
+                self.n_invalid += 1
+        slots = np.fromiter((self._slot(r[0]) for r in readouts), np.int64,
+                            len(readouts))
+        timestamps = np.fromiter((r[2] for r in readouts), np.float64,
+                                 len(readouts))
+        values = np.fromiter((r[3] for r in readouts), np.float64,
+                             len(readouts))
+        if len(timestamps):
+            self.watermark = max(self.watermark, float(timestamps.max()))
+        for accumulator in self.accumulators:
+            self._emit(accumulator, accumulator.add(slots, timestamps, values))
+
+    def expire(self, now: Optional[float] = None) -> None:
+        """
+        Finalize the windows that ended, even if their sensor went silent
+        :param now: posix timestamp, the watermark minus the grace by default
+        :return: None
+        """
+        if now is None:
+            now = min(self.watermark, self.clock.time()) - EXPIRY_GRACE
+        for accumulator in self.accumulators:
+            self._emit(accumulator, accumulator.expire(now))
+
+    def flush(self) -> None:
+        """ Finalize every open window, e.g. at shutdown """
+        self.expire(np.inf)
+
+    def _emit(self, accumulator: WindowAccumulator,
+              finalized: List[tuple]) -> None:
+        rollups = []
+        resolution = accumulator.resolution
+        for slots, windows, count, total, minimum, maximum in finalized:
+            rollups.extend(Rollup(*row) for row in zip(
+                self.slot_ids[slots].tolist(), [resolution] * len(slots),
+                (windows * resolution).tolist(), count.tolist(),
+                minimum.tolist(), maximum.tolist(), (total / count).tolist()))
+        if rollups:
+            self.n_rollups += len(rollups)
+            self.sink(rollups)
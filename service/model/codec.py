@@ -0,0 +1,226 @@
+"""
+  Wire formats of the sensor readouts.
+
+  JSON is the historic, human readable format. BINARY is a fixed-layout
+  struct record, 21 bytes per readout:
+      sensor id (uint32), message type (uint8), posix timestamp (float64),
+      value (float32), interval in seconds (float32)
+  A batch of binary readouts is the plain concatenation of its records, so
+  it is encoded into and decoded from a single buffer without copies.
+"""
+
+import json
+import struct
+import threading
+import zlib
+from enum import Enum
+from typing import Dict, Iterator, Optional, Sequence, Set, Tuple, Union
+
+from service.model.messages import DeviceMessage, DeviceMessageEnum, \
+    ReadoutMessage
+
+
+RECORD = struct.Struct('<IBdff')
+TIMESTAMP = struct.Struct('<d')
+TIMESTAMP_OFFSET = 5                # After the sensor id and the type
+READ_CHUNK = 4096 * RECORD.size
+TS_FORMAT = 6
+N_DECIMALS = 4
+
+MESSAGE_TYPES = [member.value for member in DeviceMessageEnum]
+TYPE_CODES = {msg_type: code for code, msg_type in enumerate(MESSAGE_TYPES)}
+
+# sensor id -> (sensor name, sensor type) of every sensor created in this
+# process, used to give names back to binary records
+SENSOR_DIRECTORY: Dict[int, Tuple[str, Optional[str]]] = {}
+_DIRECTORY_LOCK = threading.Lock()
+
+Readout = Tuple[int, str, float, float, float]  # id, type, ts, value, interval
+
+
+class WireFormat(Enum):
+    JSON = 'json'
+    BINARY = 'binary'
+
+
+def sensor_id(sensor_name: str) -> int:
+    """
+    Stable numeric id of a sensor, the same in every process and run.
+    Two names may hash to the same id: register_sensor() refuses the second.
+    :param sensor_name: str
+    :return: uint32
+    """
+    return zlib.crc32(sensor_name.encode())
+
+
+def _add_to_directory(device_id: int, sensor_name: str,
+                      sensor_type: Optional[str]) -> None:
+    with _DIRECTORY_LOCK:
+        known = SENSOR_DIRECTORY.get(device_id)
+        if known is not None and known[0] != sensor_name:
+            raise ValueError(f'Sensor {sensor_name!r} has the id {device_id} '
+                             f'of sensor {known[0]!r}, rename one of them')
+        SENSOR_DIRECTORY[device_id] = (sensor_name, sensor_type)
+
+
+def register_sensor(sensor_name: str, sensor_type: Optional[str]) -> int:
+    """
+    Add a sensor to the directory
+    :return: The sensor id
+    :raises ValueError: Another sensor has the same id
+    """
+    device_id = sensor_id(sensor_name)
+    _add_to_directory(device_id, sensor_name, sensor_type)
+    return device_id
+
+
+def save_directory(path: str, device_ids=None) -> None:
+    """
+    Write the names of the given sensors, all of them by default, to a JSON
+    side file so binary records can be decoded by another process
+    """
+    ids = SENSOR_DIRECTORY.keys() if device_ids is None else device_ids
+    with open(path, 'w') as f:
+        json.dump({str(i): SENSOR_DIRECTORY[i] for i in ids
+                   if i in SENSOR_DIRECTORY}, f)
+
+
+def load_directory(path: str) -> Set[int]:
+    """
+    Add the sensors of a JSON side file to the directory
+    :return: Ids of the sensors of the file
+    :raises ValueError: A sensor of the file has the id of another sensor
+    """
+    device_ids = set()
+    with open(path) as f:
+        for device_id, (name, sensor_type) in json.load(f).items():
+            _add_to_directory(int(device_id), name, sensor_type)
+            device_ids.add(int(device_id))
+    return device_ids
+
+
+def encode_readout(device_id: int, msg_type: str, timestamp: float,
+                   value: float, interval: float) -> bytes:
+    return RECORD.pack(device_id, TYPE_CODES[msg_type], timestamp, value,
+                       interval)
+
+
+def decode_readout(record: Union[bytes, memoryview]) -> Readout:
+    device_id, code, timestamp, value, interval = RECORD.unpack(record)
+    return device_id, MESSAGE_TYPES[code], timestamp, value, interval
+
+
+def encode_batch(readouts: Sequence[Readout]) -> memoryview:
+    """
+    Pack many readouts into one preallocated buffer
+    :param readouts: (sensor id, message type, timestamp, value, interval)
+    :return: memoryview over the packed records
+    """
+    buffer = bytearray(len(readouts) * RECORD.size)
+    for offset, (device_id, msg_type, timestamp, value, interval) in zip(
+            range(0, len(buffer), RECORD.size), readouts):
+        RECORD.pack_into(buffer, offset, device_id, TYPE_CODES[msg_type],
+                         timestamp, value, interval)
+    return memoryview(buffer)
+
+
+def decode_batch(buffer: Union[bytes, bytearray, memoryview]) \
+        -> Iterator[Readout]:
+    """
+    Iterate the readouts of a packed buffer without copying it
+    :param buffer: Concatenated records
+    :return: Iterator of (sensor id, message type, timestamp, value, interval)
+    """
+    for device_id, code, timestamp, value, interval in \
+            RECORD.iter_unpack(memoryview(buffer)):
+        yield device_id, MESSAGE_TYPES[code], timestamp, value, interval
+
+
+def read_records(path: str) -> Iterator[Readout]:
+    """
+    Stream the readouts of a binary repository file in fixed-size chunks
+    :param path: str
+    :return: Iterator of readouts
+    """
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(READ_CHUNK)
+            if not chunk:
+                return
+            whole = len(chunk) - len(chunk) % RECORD.size
+            yield from decode_batch(memoryview(chunk)[:whole])
+
+
+def message_to_readout(message: DeviceMessage) -> Readout:
+    """
+    Decoded readout of a message in any wire format
+    :param message: DeviceMessage
+    :return: (sensor id, message type, timestamp, value, interval)
+    """
+    if isinstance(message, ReadoutMessage):
+        return message.readout()
+    if isinstance(message.message, (bytes, bytearray, memoryview)):
+        return decode_readout(message.message)
+    readout = json.loads(message.message)['readout']
+    device_id = sensor_id(readout['device_name'])
+    if device_id not in SENSOR_DIRECTORY:
+        register_sensor(readout['device_name'], readout.get('sensor_type'))
+    interval = float(readout['interval'].split()[0]) / 1000
+    return (device_id, message.message_type,
+            float(readout['posix_timestamp']), float(readout['value']),
+            interval)
+
+
+def message_timestamp(message: DeviceMessage) -> Optional[float]:
+    """
+    Timestamp of a readout without decoding the rest of the message
+    :param message: DeviceMessage
+    :return: posix timestamp, None for JSON text
+    """
+    if isinstance(message, ReadoutMessage):
+        return message.timestamp
+    if isinstance(message.message, (bytes, bytearray, memoryview)):
+        return TIMESTAMP.unpack_from(message.message, TIMESTAMP_OFFSET)[0]
+    return None
+
+
+def message_to_record(message: DeviceMessage) -> bytes:
+    """
+    Binary record of a message in any wire format
+    :param message: DeviceMessage
+    :return: bytes
+    """
+    if isinstance(message, ReadoutMessage):
+        return encode_readout(*message.readout())
+    if isinstance(message.message, (bytes, bytearray, memoryview)):
+        return bytes(message.message)
+    return encode_readout(*message_to_readout(message))
+
+
+def readout_to_dict(readout: Readout) -> dict:
+    """
+    JSON readout body of a decoded binary record, as built by the sensors
+    :param readout: Readout
+    :return: dict
+    """
+    device_id, _, timestamp, value, interval = readout
+    name, sensor_type = SENSOR_DIRECTORY.get(device_id, (str(device_id), None))
+    out = {} if sensor_type is None else {'sensor_type': sensor_type}
+    out.update({'device_name': name,
+                'value': f'{value:.{N_DECIMALS}f}',
+                'interval': f'{1000 * round(interval, 6)} ms',
+                'posix_timestamp': f'{timestamp:.{TS_FORMAT}f}'})
+    return out
+
+
+def message_to_text(message: DeviceMessage) -> str:
+    """
+    One line JSON representation of a message in any wire format
+    :param message: DeviceMessage
+    :return: str
+    """
+    content = message.message
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        content = json.dumps({'readout': readout_to_dict(decode_readout(content))})
+    return json.dumps({'msg_type': message.message_type,
+                       'msg_content': content})
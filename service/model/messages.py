@@ -2,7 +2,7 @@
 """ Internal message structure """
 
 import json
-from typing import Protocol
+from typing import Protocol, Union
 from enum import Enum
 
 
@@ -23,47 +23,90 @@ class RepositoryMessageEnum(MessageEnum):
 
 class Message(Protocol):
     msg_type: str
-    msg_content: str
+    msg_content: Union[str, bytes]
 
 
 class DeviceMessage:
     """
-    IoT device messages providing the device's readout
+    IoT device messages providing the device's readout.
+    The content is a JSON string, or a packed record in the BINARY wire format
     """
-    def __init__(self, message_type: str, message: str):
+    __slots__ = ('msg_type', 'msg_content')
+
+    def __init__(self, message_type: str, message: Union[str, bytes]):
         self.msg_type = message_type
         self.msg_content = message
 
     @property
     def message_type(self):
-        return self.__dict__.get('msg_type')
+        return self.msg_type
 
     @property
     def message(self):
-        return self.__dict__.get('msg_content')
+        return self.msg_content
 
     def __str__(self):
-        return str(self.__dict__)
+        return str({'msg_type': self.message_type,
+                    'msg_content': self.message})
+
+
+class ReadoutMessage(DeviceMessage):
+    """
+    Device readout holding its raw fields. The JSON content is only built
+    when a sink asks for the text, the codec reads the fields directly.
+    """
+    __slots__ = ('device_id', 'timestamp', 'value', 'interval')
+
+    def __init__(self, message_type: str, device_id: int, timestamp: float,
+                 value: float, interval: float):
+        self.msg_type = message_type
+        self.device_id = device_id
+        self.timestamp = timestamp
+        self.value = value
+        self.interval = interval
+
+    @property
+    def msg_content(self) -> str:
+        from service.model.codec import readout_to_dict
+        return json.dumps({'readout': readout_to_dict(self.readout())})
+
+    @property
+    def message(self) -> str:
+        return self.msg_content
+
+    def __reduce__(self):
+        return ReadoutMessage, (self.msg_type, self.device_id, self.timestamp,
+                                self.value, self.interval)
+
+    def readout(self) -> tuple:
+        """
+        :return: (sensor id, message type, timestamp, value, interval)
+        """
+        return (self.device_id, self.msg_type, self.timestamp, self.value,
+                self.interval)
 
 
 class RepositoryMessage:
     """
     Repository messages
     """
+    __slots__ = ('msg_type', 'msg_content')
+
     def __init__(self, message_type: str, message: str):
         self.msg_type = message_type
         self.msg_content = message
 
     @property
     def message_type(self):
-        return self.__dict__.get('msg_type')
+        return self.msg_type
 
     @property
     def message(self):
-        return self.__dict__.get('msg_content')
+        return self.msg_content
 
     def __str__(self):
-        return str(self.__dict__)
+        return str({'msg_type': self.message_type,
+                    'msg_content': self.message})
 
 
 if __name__ == "__main__":
@@ -0,0 +1,52 @@
+"""
+  Asyncio repository fed by the AsyncNetwork
+"""
+
+import os
+from typing import List, Optional, TextIO
+
+from service.repository.repository import resolve_location
+from service.model.codec import message_to_text
+from utils.asyncnetwork import AsyncNetwork
+
+
+class AsyncFileRepository:
+    """
+    File repository running as a coroutine of the network. Each batch is
+    appended with a single buffered write.
+    """
+
+    def __init__(self, *, location: str, network: AsyncNetwork) -> None:
+        self.name = 'AsyncFileRepository'
+        self.repo_dir, self.repo_name = resolve_location(location)
+        self.fullpath = os.path.join(self.repo_dir, self.repo_name)
+        self.network = network
+        self.get = network.connect_repository(self.notifyme)
+        self.messages: List = []
+        self._file: Optional[TextIO] = None
+
+    async def start_repository(self) -> None:
+        if self._file is not None:
+            print(f'The repository {self.name} is already running!')
+            return
+        print(f'Starting the repository: {self.name}')
+        self._file = open(self.fullpath, "+a")
+
+    async def stop_repository(self) -> None:
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        print(f'Repository {self.name} has stopped!')
+
+    async def notifyme(self, messages: List) -> None:
+        self.messages = messages
+        self.save()
+
+    def save(self) -> None:
+        if self._file is None:
+            print(f'Repository {self.name} is not running, '
+                  f'{len(self.messages)} messages lost')
+            return
+        self._file.write(''.join(f'{message_to_text(message)}\n'
+                                 for message in self.messages))
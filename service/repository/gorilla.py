@@ -0,0 +1,458 @@
+"""
+  Gorilla compressed blocks.
+  The readings of every sensor are regular (a fixed interval) and vary
+  slowly, so each sensor's series is encoded in blocks the way the Gorilla
+  TSDB does it:
+  - timestamps as delta-of-delta, a single bit when the interval holds
+  - values as the XOR with the previous value, a single bit when unchanged
+    and only the meaningful bits otherwise
+  Timestamps are kept in integer microseconds (the precision of the
+  readouts), so the delta-of-delta buckets are wider than Gorilla's
+  second-based ones. Values are kept as float64, decoding is lossless.
+
+  Block layout: BLOCK_HEADER followed by the bit stream of its points.
+"""
+
+import os
+import struct
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, BinaryIO
+
+from service.model.codec import MESSAGE_TYPES, TYPE_CODES, Readout, \
+    message_to_readout, save_directory, load_directory, sensor_id
+from service.repository.repository import Repository, resolve_location, \
+    WRITE_BUFFER_SIZE
+from utils.network import Network
+
+
+# sensor id, type code, interval, first and last timestamp (us), points,
+# payload bytes
+BLOCK_HEADER = struct.Struct('<IBfqqII')
+BLOCK_POINTS = 1024
+BLOCK_MAX_AGE = 60.0                # 1 min, longest a block stays in memory
+TS_SCALE = 1_000_000                # microseconds
+# Delta-of-delta buckets: control bits, number of control bits, value bits
+DOD_BUCKETS = ((0b10, 2, 12),       # +-2 ms
+               (0b110, 3, 16),      # +-32 ms
+               (0b1110, 4, 24))     # +-8 s
+DOD_OVERFLOW = (0b1111, 4, 64)
+FLOAT = struct.Struct('<d')
+UINT64 = struct.Struct('<Q')
+
+
+def float_bits(value: float) -> int:
+    return UINT64.unpack(FLOAT.pack(value))[0]
+
+
+def bits_float(bits: int) -> float:
+    return FLOAT.unpack(UINT64.pack(bits))[0]
+
+
+class BitWriter:
+    """
+    Append-only bit stream, most significant bit first
+    """
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+        self._pending = 0               # Bits not yet in the buffer
+        self._n_pending = 0
+
+    def __len__(self) -> int:
+        """ :return: Number of bits written """
+        return 8 * len(self.buffer) + self._n_pending
+
+    def write(self, value: int, n_bits: int) -> None:
+        self._pending = (self._pending << n_bits) | (value & ((1 << n_bits) - 1))
+        self._n_pending += n_bits
+        while self._n_pending >= 8:
+            self._n_pending -= 8
+            self.buffer.append(self._pending >> self._n_pending)
+            self._pending &= (1 << self._n_pending) - 1
+
+    def getvalue(self) -> bytes:
+        """ :return: The stream padded with zeros to a whole byte """
+        if not self._n_pending:
+            return bytes(self.buffer)
+        return bytes(self.buffer) + bytes(
+            [self._pending << (8 - self._n_pending)])
+
+
+class BitReader:
+    """
+    Read a bit stream written by BitWriter
+    """
+
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+        self._position = 0
+        self._pending = 0
+        self._n_pending = 0
+
+    def read(self, n_bits: int) -> int:
+        while self._n_pending < n_bits:
+            self._pending = (self._pending << 8) | self.data[self._position]
+            self._position += 1
+            self._n_pending += 8
+        self._n_pending -= n_bits
+        value = self._pending >> self._n_pending
+        self._pending &= (1 << self._n_pending) - 1
+        return value
+
+    def read_signed(self, n_bits: int) -> int:
+        value = self.read(n_bits)
+        if value >> (n_bits - 1):
+            value -= 1 << n_bits
+        return value
+
+
+class BlockEncoder:
+    """
+    Compressed block of a single sensor's readings
+    """
+
+    def __init__(self, device_id: int, msg_type: str, interval: float) -> None:
+        self.device_id = device_id
+        self.msg_type = msg_type
+        self.interval = interval
+        self.bits = BitWriter()
+        self.opened_at = 0.0            # monotonic time of the first reading
+        self.count = 0
+        self.first_ts = 0
+        self.last_ts = 0
+        self._delta = 0
+        self._value = 0                 # Bits of the previous value
+        self._leading = -1              # Window of the previous XOR
+        self._trailing = 0
+
+    def append(self, timestamp: float, value: float) -> None:
+        """
+        Add a reading to the block
+        :param timestamp: posix timestamp
+        :param value: float
+        :return: None
+        """
+        ts = round(timestamp * TS_SCALE)
+        bits = float_bits(value)
+        if not self.count:
+            self.first_ts = ts
+            self.bits.write(bits, 64)
+        else:
+            delta = ts - self.last_ts
+            self._write_dod(delta - self._delta)
+            self._delta = delta
+            self._write_xor(bits ^ self._value)
+        self.last_ts = ts
+        self._value = bits
+        self.count += 1
+
+    def _write_dod(self, dod: int) -> None:
+        if dod == 0:
+            self.bits.write(0, 1)
+            return
+        for control, n_control, n_bits in DOD_BUCKETS:
+            if -(1 << (n_bits - 1)) <= dod < 1 << (n_bits - 1):
+                break
+        else:
+            control, n_control, n_bits = DOD_OVERFLOW
+        self.bits.write(control, n_control)
+        self.bits.write(dod, n_bits)
+
+    def _write_xor(self, xor: int) -> None:
+        if xor == 0:
+            self.bits.write(0, 1)
+            return
+        leading = 64 - xor.bit_length()
+        trailing = (xor & -xor).bit_length() - 1
+        if self._leading >= 0 and leading >= self._leading and \
+                trailing >= self._trailing:
+            # Fits in the previous window
+            self.bits.write(0b10, 2)
+            self.bits.write(xor >> self._trailing,
+                            64 - self._leading - self._trailing)
+            return
+        meaningful = 64 - leading - trailing
+        self.bits.write(0b11, 2)
+        self.bits.write(leading, 6)
+        self.bits.write(meaningful - 1, 6)
+        self.bits.write(xor >> trailing, meaningful)
+        self._leading, self._trailing = leading, trailing
+
+    def to_bytes(self) -> bytes:
+        """ :return: Header and payload of the block """
+        payload = self.bits.getvalue()
+        return BLOCK_HEADER.pack(self.device_id, TYPE_CODES[self.msg_type],
+                                 self.interval, self.first_ts, self.last_ts,
+                                 self.count, len(payload)) + payload
+
+
+def _read_dod(reader: BitReader) -> int:
+    if not reader.read(1):
+        return 0
+    for _, _, n_bits in DOD_BUCKETS:
+        if not reader.read(1):
+            return reader.read_signed(n_bits)
+    return reader.read_signed(DOD_OVERFLOW[2])
+
+
+def decode_block(header: tuple, payload: bytes) -> Iterator[Readout]:
+    """
+    Readings of a block
+    :param header: Unpacked BLOCK_HEADER
+    :param payload: Bit stream of the block
+    :return: Iterator of (sensor id, message type, timestamp, value, interval)
+    """
+    device_id, code, interval, first_ts, _, count, _ = header
+    msg_type = MESSAGE_TYPES[code]
+    reader = BitReader(payload)
+    ts, delta = first_ts, 0
+    bits = reader.read(64)
+    leading = trailing = 0
+    yield device_id, msg_type, ts / TS_SCALE, bits_float(bits), interval
+    for _ in range(count - 1):
+        delta += _read_dod(reader)
+        ts += delta
+        if reader.read(1):
+            if reader.read(1):
+                leading = reader.read(6)
+                meaningful = reader.read(6) + 1
+                trailing = 64 - leading - meaningful
+            bits ^= reader.read(64 - leading - trailing) << trailing
+        yield device_id, msg_type, ts / TS_SCALE, bits_float(bits), interval
+
+
+def decode_blocks(data: bytes) -> Iterator[Readout]:
+    """
+    Readings of consecutive blocks held in memory
+    :param data: Encoded blocks
+    :return: Iterator of readouts, block by block
+    """
+    view = memoryview(data)
+    offset = 0
+    while offset + BLOCK_HEADER.size <= len(view):
+        header = BLOCK_HEADER.unpack_from(view, offset)
+        offset += BLOCK_HEADER.size
+        payload = bytes(view[offset:offset + header[-1]])
+        offset += header[-1]
+        yield from decode_block(header, payload)
+
+
+class GorillaEncoder:
+    """
+    Streaming encoder: one open block per sensor, fed with network batches.
+    A block closes when it holds block_points readings, or with expire()
+    once it is max_age seconds old.
+    """
+
+    def __init__(self, *, block_points: int = BLOCK_POINTS,
+                 max_age: float = BLOCK_MAX_AGE) -> None:
+        self.block_points = block_points
+        self.max_age = max_age
+        self.blocks: Dict[int, BlockEncoder] = {}
+        self.device_ids = set()         # Every sensor seen
+
+    def add(self, messages: List, now: float = 0.0) -> List[bytes]:
+        """
+        Encode a batch of messages
+        :param messages: List of DeviceMessage
+        :param now: monotonic time, the age of the blocks it opens
+        :return: Blocks closed by this batch
+        """
+        closed = []
+        for message in messages:
+            device_id, msg_type, timestamp, value, interval = \
+                message_to_readout(message)
+            block = self.blocks.get(device_id)
+            if block is not None and (block.msg_type != msg_type or
+                                      block.interval != interval):
+                closed.append(self.blocks.pop(device_id).to_bytes())
+                block = None
+            if block is None:
+                block = self.blocks[device_id] = BlockEncoder(
+                    device_id, msg_type, interval)
+                block.opened_at = now
+                self.device_ids.add(device_id)
+            block.append(timestamp, value)
+            if block.count >= self.block_points:
+                closed.append(self.blocks.pop(device_id).to_bytes())
+        return closed
+
+    def next_due(self) -> Optional[float]:
+        """ :return: monotonic time the oldest open block expires """
+        if not self.blocks:
+            return None
+        return min(block.opened_at for block in self.blocks.values()) + \
+            self.max_age
+
+    def expire(self, now: float) -> List[bytes]:
+        """
+        Close the blocks opened max_age seconds ago or more
+        :param now: monotonic time
+        :return: Blocks
+        """
+        expired = [device_id for device_id, block in self.blocks.items()
+                   if now - block.opened_at >= self.max_age]
+        return [self.blocks.pop(device_id).to_bytes()
+                for device_id in expired]
+
+    def open_blocks(self, device_id: Optional[int] = None) -> List[bytes]:
+        """
+        :param device_id: Only this sensor's block, all of them by default
+        :return: Copies of the blocks still open
+        """
+        if device_id is None:
+            return [block.to_bytes() for block in self.blocks.values()]
+        block = self.blocks.get(device_id)
+        return [] if block is None else [block.to_bytes()]
+
+    def flush(self) -> List[bytes]:
+        """
+        Close every open block
+        :return: Blocks
+        """
+        closed = [block.to_bytes() for block in self.blocks.values()]
+        self.blocks.clear()
+        return closed
+
+
+def read_blocks(f: BinaryIO, device_id: Optional[int] = None,
+                start: Optional[float] = None,
+                end: Optional[float] = None,
+                limit: Optional[int] = None) -> Iterator[Readout]:
+    """
+    Streaming decoder: readings of the blocks of a file. Blocks of other
+    sensors or outside of [start, end) are skipped without being decoded.
+    :param f: File open in binary mode
+    :param device_id: Only this sensor, all of them by default
+    :param start: posix timestamp
+    :param end: posix timestamp
+    :param limit: Stop at this offset, the end of the file by default
+    :return: Iterator of readouts, block by block
+    """
+    while limit is None or f.tell() < limit:
+        raw = f.read(BLOCK_HEADER.size)
+        if len(raw) < BLOCK_HEADER.size:
+            return
+        header = BLOCK_HEADER.unpack(raw)
+        block_id, _, _, first_ts, last_ts, _, size = header
+        if (device_id is not None and block_id != device_id) or \
+                (start is not None and last_ts < start * TS_SCALE) or \
+                (end is not None and first_ts >= end * TS_SCALE):
+            f.seek(size, os.SEEK_CUR)
+            continue
+        payload = f.read(size)
+        if len(payload) < size:
+            return
+        for readout in decode_block(header, payload):
+            if start is not None and readout[2] < start:
+                continue
+            if end is not None and readout[2] >= end:
+                continue
+            yield readout
+
+
+class GorillaRepository(Repository):
+    """
+    Append Gorilla compressed blocks to a file. A block is written when it
+    holds block_points readings, when it is max_age seconds old, so that a
+    crash loses at most that much of a sensor's readings, or when the
+    repository stops. The names of the sensors are kept in the side file
+    <location>.sensors.json.
+    """
+
+    def __init__(self, *, location: str, network: Network,
+                 block_points: int = BLOCK_POINTS,
+                 max_age: float = BLOCK_MAX_AGE) -> None:
+        super().__init__(name='GorillaRepository', thread_name='GorillaArchive',
+                         network=network)
+        self.repo_dir, self.repo_name = resolve_location(location)
+        self.fullpath = os.path.join(self.repo_dir, self.repo_name)
+        self.encoder = GorillaEncoder(block_points=block_points,
+                                      max_age=max_age)
+        # Held by the writer while it encodes and writes, so that a query
+        # sees every reading once, in the file or in an open block
+        self.blocks_lock = threading.Lock()
+        self.directory_path = f'{self.fullpath}.sensors.json'
+        # The side file keeps the sensors of the earlier runs too
+        self.known_sensors = set()
+        if os.path.exists(self.directory_path):
+            self.known_sensors = load_directory(self.directory_path)
+        # Writer statistics
+        self.n_blocks = 0
+        self.n_messages = 0
+        self.bytes_written = 0
+
+    def write_stats(self) -> dict:
+        """
+        :return: Writer counters and bytes per stored reading
+        """
+        return {'blocks': self.n_blocks,
+                'messages': self.n_messages,
+                'bytes': self.bytes_written,
+                'bytes_per_message': self.bytes_written / self.n_messages
+                if self.n_messages else 0.0}
+
+    def _write(self, f, blocks: List[bytes]) -> None:
+        if not blocks:
+            return
+        data = b''.join(blocks)
+        f.write(data)
+        f.flush()
+        self.n_blocks += len(blocks)
+        self.n_messages += sum(BLOCK_HEADER.unpack_from(block)[5]
+                               for block in blocks)
+        self.bytes_written += len(data)
+
+    def append(self, f, messages: List) -> None:
+        with self.blocks_lock:
+            self._write(f, self.encoder.add(messages,
+                                            self.clock.monotonic()))
+        sensors = self.encoder.device_ids - self.known_sensors
+        if sensors:
+            self.known_sensors |= sensors
+            save_directory(self.directory_path, self.known_sensors)
+
+    def query(self, sensor_name: Optional[str] = None,
+              start: Optional[float] = None,
+              end: Optional[float] = None) -> Iterator[Readout]:
+        """
+        Stored readings of a sensor in the time window [start, end), the
+        ones of the blocks still open included
+        :param sensor_name: All the sensors by default
+        :param start: posix timestamp
+        :param end: posix timestamp
+        :return: Generator of readouts, the file's blocks first
+        """
+        device_id = None if sensor_name is None else sensor_id(sensor_name)
+        with self.blocks_lock:
+            size = os.path.getsize(self.fullpath) \
+                if os.path.exists(self.fullpath) else 0
+            open_blocks = self.encoder.open_blocks(device_id)
+        if size:
+            with open(self.fullpath, 'rb') as f:
+                yield from read_blocks(f, device_id, start, end, size)
+        for readout in decode_blocks(b''.join(open_blocks)):
+            if start is not None and readout[2] < start:
+                continue
+            if end is not None and readout[2] >= end:
+                continue
+            yield readout
+
+    def run(self):
+        self.started_at = time.monotonic()
+        with open(self.fullpath, 'ab', buffering=WRITE_BUFFER_SIZE) as f:
+            stop = False
+            while not stop:
+                due = self.encoder.next_due()
+                timeout = None if due is None else \
+                    max(0.0, due - self.clock.monotonic())
+                batches, stop = self._next_batches(timeout)
+                messages = [message for batch in batches for message in batch]
+                if messages:
+                    self.append(f, messages)
+                with self.blocks_lock:
+                    self._write(f, self.encoder.expire(self.clock.monotonic()))
+            with self.blocks_lock:
+                self._write(f, self.encoder.flush())
+        self.stopped_at = time.monotonic()
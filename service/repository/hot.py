@@ -0,0 +1,221 @@
+"""
+  In-memory hot tier.
+  Keeps the recent readings of every sensor in RAM, next to the durable
+  repositories: a fixed-size ring of (timestamp, value) per sensor, stored
+  as rows of preallocated NumPy arrays, and a latest-value table. The
+  number of rows follows from a memory budget; when they are all taken the
+  sensor that reported least recently gives its row up to the new one.
+  Readers don't take the lock: a sequence number bumped around every write
+  tells them to read again when a write got in the way.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from service.model.codec import message_to_readout, message_timestamp, \
+    sensor_id
+from service.repository.repository import Repository
+from utils.network import Network
+
+HOT_HISTORY = 128                   # Readings kept per sensor
+HOT_MEMORY_BUDGET = 256 << 20       # 256 MiB, ~170k sensors of 128 readings
+TS_DTYPE = np.float64
+VALUE_DTYPE = np.float32
+# Ring and latest value of a row, plus its write count and the index entry
+SLOT_OVERHEAD = 2 * np.dtype(np.int64).itemsize + 64
+
+Reading = Tuple[float, float]
+
+
+def slot_size(history: int) -> int:
+    """ :return: Bytes of memory taken by one sensor """
+    reading = np.dtype(TS_DTYPE).itemsize + np.dtype(VALUE_DTYPE).itemsize
+    return (history + 1) * reading + SLOT_OVERHEAD
+
+
+class HotRepository(Repository):
+    """
+    Latest value and last readings of every sensor, in memory
+    """
+
+    def __init__(self, *, name: str = 'HotRepository',
+                 network: Optional[Network] = None,
+                 history: int = HOT_HISTORY,
+                 memory_budget: int = HOT_MEMORY_BUDGET) -> None:
+        """
+        :param name: Repository name, labels its metrics and subscription
+        :param network: Network to subscribe to, None to feed it with store()
+        :param history: Readings kept per sensor
+        :param memory_budget: Bytes for all the sensors, sets how many of them
+                              are kept
+        """
+        super().__init__(name=name, thread_name='HotArchive', network=network)
+        self.history = history
+        self.n_slots = memory_budget // slot_size(history)
+        if self.n_slots < 1:
+            raise ValueError(f'A memory budget of {memory_budget} bytes '
+                             f'does not hold a sensor of {history} readings')
+        self._ts = np.zeros((self.n_slots, history), TS_DTYPE)
+        self._values = np.zeros((self.n_slots, history), VALUE_DTYPE)
+        self._latest_ts = np.zeros(self.n_slots, TS_DTYPE)
+        self._latest_values = np.zeros(self.n_slots, VALUE_DTYPE)
+        self._counts = np.zeros(self.n_slots, np.int64)
+        # Sensor id -> row, least recently written first
+        self._slots: OrderedDict = OrderedDict()
+        self._free = list(range(self.n_slots - 1, -1, -1))
+        self._write_lock = threading.Lock()
+        self._sequence = 0
+        # Writer statistics
+        self.n_messages = 0
+        self.n_evicted = 0
+        self.n_failed = 0
+
+    def __len__(self) -> int:
+        """ :return: Number of sensors kept """
+        return len(self._slots)
+
+    def __contains__(self, sensor_name: str) -> bool:
+        return sensor_id(sensor_name) in self._slots
+
+    def _slot(self, device_id: int) -> int:
+        """ Row of a sensor, taking over the least recent one when full """
+        slot = self._slots.get(device_id)
+        if slot is not None:
+            self._slots.move_to_end(device_id)
+            return slot
+        if self._free:
+            slot = self._free.pop()
+        else:
+            _, slot = self._slots.popitem(last=False)
+            self.n_evicted += 1
+        self._counts[slot] = 0
+        self._slots[device_id] = slot
+        return slot
+
+    def store(self, messages: List) -> None:
+        """
+        Add readouts to the rings and the latest-value table
+        :param messages: List of DeviceMessage, in arrival order
+        :return: None
+        """
+        readouts = [message_to_readout(message) for message in messages]
+        if not readouts:
+            return
+        devices = list(dict.fromkeys(r[0] for r in readouts))
+        if len(devices) > self.n_slots:
+            # Only the sensors of the end of the batch fit
+            kept = set(devices[-self.n_slots:])
+            readouts = [r for r in readouts if r[0] in kept]
+            devices = devices[-self.n_slots:]
+        n = len(readouts)
+        timestamps = np.fromiter((r[2] for r in readouts), TS_DTYPE, n)
+        values = np.fromiter((r[3] for r in readouts), VALUE_DTYPE, n)
+        with self._write_lock:
+            self._sequence += 1         # Odd: write in progress
+            try:
+                # Touch the sensors already kept before taking rows over
+                for device_id in devices:
+                    if device_id in self._slots:
+                        self._slots.move_to_end(device_id)
+                rows = {device_id: self._slot(device_id)
+                        for device_id in devices}
+                slots = np.fromiter((rows[r[0]] for r in readouts),
+                                    np.int64, n)
+                # Readings of the same sensor go to consecutive positions
+                order = np.argsort(slots, kind='stable')
+                slots = slots[order]
+                timestamps, values = timestamps[order], values[order]
+                starts = np.flatnonzero(np.diff(slots)) + 1
+                starts = np.concatenate(([0], starts))
+                counts = np.diff(np.concatenate((starts, [n])))
+                rank = np.arange(n) - np.repeat(starts, counts)
+                positions = (self._counts[slots] + rank) % self.history
+                self._ts[slots, positions] = timestamps
+                self._values[slots, positions] = values
+                last = starts + counts - 1
+                self._latest_ts[slots[last]] = timestamps[last]
+                self._latest_values[slots[last]] = values[last]
+                self._counts[slots[starts]] += counts
+                self.n_messages += n
+            finally:
+                self._sequence += 1
+
+    def _read(self, device_id: int, read):
+        """ Run read(slot) until no write got in the middle """
+        while True:
+            sequence = self._sequence
+            if sequence & 1:
+                time.sleep(0)
+                continue
+            slot = self._slots.get(device_id)
+            result = None if slot is None else read(slot)
+            if self._sequence == sequence:
+                return result
+
+    def latest(self, sensor_name: str) -> Optional[Reading]:
+        """
+        Last reading of a sensor
+        :param sensor_name: str
+        :return: (timestamp, value) or None if the sensor isn't kept
+        """
+        return self._read(sensor_id(sensor_name), lambda slot: (
+            float(self._latest_ts[slot]), float(self._latest_values[slot])))
+
+    def last(self, sensor_name: str, n: Optional[int] = None) \
+            -> List[Reading]:
+        """
+        Last readings of a sensor, oldest first
+        :param sensor_name: str
+        :param n: At most this many readings, all the kept ones by default
+        :return: List of (timestamp, value)
+        """
+        def read(slot: int) -> List[Reading]:
+            count = int(self._counts[slot])
+            k = min(count, self.history) if n is None \
+                else min(n, count, self.history)
+            positions = np.arange(count - k, count) % self.history
+            return list(zip(self._ts[slot, positions].tolist(),
+                            self._values[slot, positions].tolist()))
+        return self._read(sensor_id(sensor_name), read) or []
+
+    def memory_stats(self) -> dict:
+        """
+        :return: Sensors kept and evicted, memory taken
+        """
+        return {'sensors': len(self._slots),
+                'capacity': self.n_slots,
+                'history': self.history,
+                'messages': self.n_messages,
+                'evicted': self.n_evicted,
+                'failed': self.n_failed,
+                'bytes': self.n_slots * slot_size(self.history)}
+
+    def run(self):
+        self.started_at = time.monotonic()
+        stop = False
+        while not stop:
+            batches, stop = self._next_batches(None)
+            messages = [message for batch in batches for message in batch]
+            if not messages:
+                continue
+            start = time.perf_counter()
+            try:
+                self.store(messages)
+            except (ValueError, KeyError, TypeError, AttributeError) as err:
+                # A bad batch must not stop the writer
+                self.n_failed += len(messages)
+                print(f'{self.repo_name} dropped a batch of '
+                      f'{len(messages)} messages! {err!r}')
+                continue
+            self.write_duration.record(time.perf_counter() - start)
+            now = self.clock.time()
+            timestamps = map(message_timestamp, messages)
+            self.write_latency.record_many(
+                now - timestamp for timestamp in timestamps
+                if timestamp is not None)
+            self.messages_written.inc(len(messages))
+        self.stopped_at = time.monotonic()
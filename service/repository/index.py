@@ -0,0 +1,281 @@
+"""
+  Sparse offset index of a repository file.
+  For every time bucket and sensor id it keeps the runs of bytes holding
+  that sensor's readings of that bucket: consecutive readings of a sensor
+  make a single run, so a query reads the sensor's readings and nothing
+  else, even when the whole fleet writes interleaved in the same file.
+  While a bucket is open its runs are collected in memory. It is closed,
+  and written to the side file as one checkpoint block, once the readings
+  are INDEX_CLOSE_LAG buckets ahead of it. A block holds the bucket's runs
+  sorted by sensor, as delta-encoded NumPy columns compressed with zlib. A
+  late reading of a closed bucket reopens it, and its next block adds to
+  the first one.
+  Every block records the file offset below which everything has been
+  checkpointed. On load, the runs past the last one are dropped, the side
+  file is compacted into one block per bucket, and the repository indexes
+  the rest of its file again.
+"""
+
+import os
+import struct
+import threading
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+INDEX_BUCKET = 60.0         # 1 min
+INDEX_CLOSE_LAG = 1         # Buckets a late reading may lag without reopening
+MAGIC = b'SNSRIDX1'
+HEADER = struct.Struct('<8sd')          # magic, bucket in seconds
+BLOCK = struct.Struct('<qQII')          # bucket, covered, runs, payload size
+ID_DTYPE = np.dtype('<u4')
+OFFSET_DTYPE = np.dtype('<i8')
+
+Entry = Tuple[int, float, int]      # sensor id, timestamp, size in bytes
+
+
+class BucketRuns(NamedTuple):
+    """
+    Runs of a closed bucket, sorted by sensor: the runs of devices[i] are
+    firsts/ends[starts[i]:starts[i + 1]]
+    """
+    devices: np.ndarray
+    starts: np.ndarray
+    firsts: np.ndarray
+    ends: np.ndarray
+
+    @classmethod
+    def from_columns(cls, ids: np.ndarray, firsts: np.ndarray,
+                     ends: np.ndarray) -> 'BucketRuns':
+        order = np.lexsort((firsts, ids))
+        ids, firsts, ends = ids[order], firsts[order], ends[order]
+        devices, starts = np.unique(ids, return_index=True)
+        return cls(devices, np.append(starts, len(ids)), firsts, ends)
+
+    def runs(self, device_id: Optional[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """ :return: firsts, ends of a sensor, or of all of them for None """
+        if device_id is None:
+            return self.firsts, self.ends
+        i = int(np.searchsorted(self.devices, device_id))
+        if i == len(self.devices) or self.devices[i] != device_id:
+            return self.firsts[:0], self.ends[:0]
+        first, last = self.starts[i], self.starts[i + 1]
+        return self.firsts[first:last], self.ends[first:last]
+
+    def encode(self) -> bytes:
+        ids = np.repeat(self.devices, np.diff(self.starts)).astype(ID_DTYPE)
+        gaps = np.diff(self.firsts, prepend=0).astype(OFFSET_DTYPE)
+        lengths = (self.ends - self.firsts).astype(OFFSET_DTYPE)
+        return zlib.compress(ids.tobytes() + gaps.tobytes() +
+                             lengths.tobytes())
+
+    @classmethod
+    def decode(cls, payload: bytes, n_runs: int) -> 'BucketRuns':
+        data = zlib.decompress(payload)
+        ids = np.frombuffer(data, ID_DTYPE, n_runs)
+        offset = ids.nbytes
+        firsts = np.cumsum(np.frombuffer(data, OFFSET_DTYPE, n_runs, offset))
+        offset += n_runs * OFFSET_DTYPE.itemsize
+        ends = firsts + np.frombuffer(data, OFFSET_DTYPE, n_runs, offset)
+        return cls.from_columns(ids.astype(np.int64), firsts, ends)
+
+
+def merge_runs(runs: Iterable[BucketRuns]) -> BucketRuns:
+    runs = list(runs)
+    if len(runs) == 1:
+        return runs[0]
+    ids = np.concatenate([np.repeat(r.devices, np.diff(r.starts))
+                          for r in runs])
+    return BucketRuns.from_columns(ids,
+                                   np.concatenate([r.firsts for r in runs]),
+                                   np.concatenate([r.ends for r in runs]))
+
+
+class SparseIndex:
+    """
+    (time bucket, sensor id) -> runs of [first byte, end byte) of a
+    repository file
+    """
+
+    def __init__(self, path: str, *, bucket: float = INDEX_BUCKET) -> None:
+        self.path = path
+        self.bucket = bucket
+        self.buckets: List[int] = []        # Sorted, open and closed
+        self.closed: Dict[int, BucketRuns] = {}
+        # bucket -> sensor id -> flat first, end, first, end... of its runs
+        self.open: Dict[int, Dict[int, array]] = {}
+        self.newest: Optional[int] = None
+        self.indexed_bytes = 0
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            self._load()
+        self._compact()
+
+    def __len__(self) -> int:
+        """ :return: Number of runs """
+        with self.lock:
+            return (sum(len(runs.firsts) for runs in self.closed.values()) +
+                    sum(len(runs) // 2 for sensors in self.open.values()
+                        for runs in sensors.values()))
+
+    def _load(self) -> None:
+        """ Read the closed buckets, drop the runs past the last checkpoint """
+        blocks: Dict[int, List[BucketRuns]] = {}
+        covered = 0
+        with open(self.path, 'rb') as f:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size or header[:len(MAGIC)] != MAGIC:
+                # Not an index of this format: the repository rebuilds it
+                print(f'Rebuilding the index {self.path}')
+                return
+            self.bucket = HEADER.unpack(header)[1]
+            while True:
+                head = f.read(BLOCK.size)
+                if len(head) < BLOCK.size:
+                    break
+                bucket, covered_at, n_runs, size = BLOCK.unpack(head)
+                payload = f.read(size)
+                if len(payload) < size:
+                    break               # Torn last block
+                blocks.setdefault(bucket, []).append(
+                    BucketRuns.decode(payload, n_runs))
+                covered = covered_at
+        for bucket, runs in blocks.items():
+            runs = merge_runs(runs)
+            kept = runs.ends <= covered
+            if not kept.all():
+                ids = np.repeat(runs.devices, np.diff(runs.starts))
+                runs = BucketRuns.from_columns(
+                    ids[kept], runs.firsts[kept], runs.ends[kept])
+            if len(runs.firsts):
+                self.closed[bucket] = runs
+        self.buckets = sorted(self.closed)
+        self.indexed_bytes = covered
+
+    def _compact(self) -> None:
+        """ Rewrite the side file with one block per closed bucket """
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, self.bucket))
+            for bucket in self.buckets:
+                self._write_block(f, bucket, self.closed[bucket],
+                                  self.indexed_bytes)
+        os.replace(temporary, self.path)
+
+    @staticmethod
+    def _write_block(f, bucket: int, runs: BucketRuns, covered: int) -> None:
+        payload = runs.encode()
+        f.write(BLOCK.pack(bucket, covered, len(runs.firsts), len(payload)))
+        f.write(payload)
+
+    def _covered(self) -> int:
+        """ Offset below which every run is in a closed bucket """
+        firsts = [runs[0] for sensors in self.open.values()
+                  for runs in sensors.values()]
+        return min(firsts) if firsts else self.indexed_bytes
+
+    def _close(self, buckets: List[int]) -> None:
+        """ Move open buckets to the closed ones and checkpoint them """
+        with open(self.path, 'ab') as f:
+            for bucket in buckets:
+                sensors = self.open.pop(bucket)
+                ids = np.concatenate([np.full(len(runs) // 2, device_id,
+                                              np.int64)
+                                      for device_id, runs in sensors.items()])
+                flat = np.frombuffer(b''.join(runs.tobytes() for runs in
+                                              sensors.values()), np.int64)
+                runs = BucketRuns.from_columns(ids, flat[0::2], flat[1::2])
+                self._write_block(f, bucket, runs, self._covered())
+                if bucket in self.closed:
+                    runs = merge_runs((self.closed[bucket], runs))
+                self.closed[bucket] = runs
+
+    def add(self, offset: int, entries: Iterable[Entry]) -> None:
+        """
+        Index readings written consecutively from a byte offset
+        :param offset: Position of the first reading in the file
+        :param entries: (sensor id, timestamp, size) of every reading, in
+                        file order
+        :return: None
+        """
+        bucket_size = self.bucket
+        with self.lock:
+            open_buckets = self.open
+            newest = self.newest
+            for device_id, timestamp, size in entries:
+                bucket = int(timestamp // bucket_size)
+                sensors = open_buckets.get(bucket)
+                if sensors is None:
+                    sensors = open_buckets[bucket] = {}
+                    if bucket not in self.closed:
+                        insort(self.buckets, bucket)
+                    if newest is None or bucket > newest:
+                        newest = bucket
+                runs = sensors.get(device_id)
+                if runs is None:
+                    sensors[device_id] = array('q', (offset, offset + size))
+                elif runs[-1] == offset:
+                    runs[-1] = offset + size
+                else:
+                    runs.append(offset)
+                    runs.append(offset + size)
+                offset += size
+            self.newest = newest
+            self.indexed_bytes = max(self.indexed_bytes, offset)
+            if newest is not None:
+                due = [bucket for bucket in open_buckets
+                       if bucket < newest - INDEX_CLOSE_LAG]
+                if due:
+                    self._close(sorted(due))
+
+    def close(self) -> None:
+        """ Checkpoint the open buckets, e.g. when the repository stops """
+        with self.lock:
+            if self.open:
+                self._close(sorted(self.open))
+
+    def find(self, device_id: Optional[int] = None,
+             start: Optional[float] = None,
+             end: Optional[float] = None) -> List[Tuple[int, int]]:
+        """
+        Byte ranges that may hold readings of a sensor in [start, end)
+        :param device_id: Sensor id, all the sensors by default
+        :param start: posix timestamp
+        :param end: posix timestamp
+        :return: Sorted, non overlapping (first, end) byte ranges
+        """
+        firsts, ends = [], []
+        with self.lock:
+            low = 0 if start is None else \
+                bisect_left(self.buckets, int(start // self.bucket))
+            # end is excluded: a range ending on a boundary stops before it
+            high = len(self.buckets) if end is None else \
+                bisect_right(self.buckets, int(-(-end // self.bucket)) - 1)
+            for bucket in self.buckets[low:high]:
+                closed = self.closed.get(bucket)
+                if closed is not None:
+                    bucket_firsts, bucket_ends = closed.runs(device_id)
+                    firsts.append(bucket_firsts)
+                    ends.append(bucket_ends)
+                sensors = self.open.get(bucket, {})
+                open_runs = sensors.values() if device_id is None else \
+                    [sensors[device_id]] if device_id in sensors else []
+                for runs in open_runs:
+                    # A copy: the array grows while the index is written
+                    flat = np.frombuffer(runs.tobytes(), np.int64)
+                    firsts.append(flat[0::2])
+                    ends.append(flat[1::2])
+        if not firsts:
+            return []
+        firsts, ends = np.concatenate(firsts), np.concatenate(ends)
+        order = np.argsort(firsts, kind='stable')
+        firsts, ends = firsts[order], ends[order]
+        # Adjacent runs, e.g. of consecutive sensors, are read as one
+        ends = np.maximum.accumulate(ends)
+        breaks = np.flatnonzero(firsts[1:] > ends[:-1]) + 1
+        range_firsts = firsts[np.r_[0, breaks]]
+        range_ends = ends[np.r_[breaks - 1, len(ends) - 1]]
+        return list(zip(range_firsts.tolist(), range_ends.tolist()))
@@ -1,26 +1,35 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime
+from typing import Optional
+from sqlalchemy import Column, Integer, String, DateTime, Float, Index
 from sqlalchemy.orm import validates
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
 
+SENSOR_MIN = -100
+SENSOR_MAX = 100
+
 
 class Message(Base):
     """
-        DB model for sensor readings
+        DB model for sensor readings.
+        The surrogate id is the primary key: two sensors reading at the same
+        timestamp must not collide.
     """
 
     __tablename__ = 'messages'
+    __table_args__ = (Index('ix_messages_sensor_timestamp',
+                            'sensor_name', 'timestamp'),)
 
-    timestamp = Column(DateTime, primary_key=True)
-    id = Column(Integer)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    timestamp = Column(DateTime, nullable=False)
     sensor_name = Column(String, nullable=False)
-    sensor_type = Column(String, nullable=False)
-    value = Column(Integer, nullable=False)
+    sensor_type = Column(String)
+    value = Column(Float, nullable=False)
 
-    def __init__(self, timestamp: datetime, id: int, sensor_name: str,
-                 sensor_type: str, value: int) -> None:
+    def __init__(self, timestamp: datetime, sensor_name: str,
+                 sensor_type: Optional[str], value: float,
+                 id: Optional[int] = None) -> None:
         super(Message, self).__init__()
         self.timestamp = timestamp
         self.id = id
@@ -29,6 +38,7 @@ class Message(Base):
         self.value = self.validate_value('value', value)
 
     @validates('value')
-    def validate_value(self, key, value) -> int:
-        assert -100 <= value <= 100, f"ERROR: valor out of range :{value}"
+    def validate_value(self, key, value) -> float:
+        assert SENSOR_MIN <= value <= SENSOR_MAX, \
+            f"ERROR: valor out of range :{value}"
         return value
@@ -1,132 +1,502 @@
 
 """ Create and initialize a relational Repository """
+import json
 import os
+import queue
 import time
 import threading
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from enum import Enum
+from datetime import datetime
+from sqlalchemy import create_engine, event
 from sqlalchemy.exc import SQLAlchemyError
-from typing import List, Union
-from service.repository.message import Message
+from typing import List, Union, Tuple, Optional, Iterator, BinaryIO
+from service.repository.message import Message, SENSOR_MIN, SENSOR_MAX
+from service.model.codec import WireFormat, RECORD, READ_CHUNK, \
+    SENSOR_DIRECTORY, message_to_text, message_to_record, message_to_readout, \
+    save_directory, load_directory, sensor_id, decode_readout
+from service.model.messages import DeviceMessage
+from service.repository.index import SparseIndex, INDEX_BUCKET
 from utils.network import Network
+from utils.metrics import REGISTRY, instance_id
+from utils.clock import SYSTEM_CLOCK
 
 START_STOP_WAIT = 1.5
 REPOSITORY_INTERVAL = 0.5
+FSYNC_INTERVAL = 1.0                # 1 s
+WRITE_BUFFER_SIZE = 1 << 20         # 1 MiB
+MAX_COALESCED_BATCHES = 4096
+MAX_PENDING_BATCHES = 2            # Then the network queues for this sink
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-65536',         # 64 MiB
+    'PRAGMA busy_timeout=5000',         # 5 s
+)
+
+
+def resolve_location(location: str) -> Tuple[str, str]:
+    """
+    Split a repository location into its directory and file name
+    :param location: str
+    :return: repo_dir, repo_name
+    """
+    fullpath = os.path.abspath(location)
+    head_tail = os.path.split(fullpath)
+    if os.path.exists(fullpath):
+        return head_tail[0], head_tail[1]
+    if all(head_tail):
+        return head_tail[0], head_tail[1]
+    if head_tail[0] and not head_tail[1]:
+        return head_tail[0], "default_file_repo.txt"
+    return os.getcwd(), head_tail[1]
+
 
 class Repository(threading.Thread):
     """
-    Base class for Repository
+    Base class for Repository.
+    The network's subscription worker hands every batch over to the
+    repository's writer thread through self.batches; run() takes them with
+    _next_batches(). The hand-off is bounded: a slow writer holds its own
+    subscription back, never the network or the other repositories. Once a
+    stop has been requested, no hand-off waits past the stop deadline.
     """
-    def __init__(self, *, name: str, thread_name: str):
+    def __init__(self, *, name: str, thread_name: str,
+                 network: Optional[Network] = None):
         super().__init__(name=thread_name, daemon=True, target=self.run)
         self.repo_name = name
-
-    def notifyme(self) -> None:
-        pass
-
-    def save(self):
-        pass
-
-
-class FileRepository(Repository):
-
-    def __init__(self, *, location: str, network: Network) -> None:
-        super().__init__(name='FileRepository', thread_name='FileArchive')
-        fullpath = os.path.abspath(location)
-        head_tail = os.path.split(fullpath)
-        if os.path.exists(fullpath):
-            self.repo_dir = head_tail[0]
-            self.repo_name = head_tail[1]
-        elif all(head_tail):
-            self.repo_dir = head_tail[0]
-            self.repo_name = head_tail[1]
-        elif head_tail[0] and not head_tail[1]:
-            self.repo_dir = head_tail[0]
-            self.repo_name = "default_file_repo.txt"
-        else:
-            self.repo_dir = os.getcwd()
-            self.repo_name = head_tail[1]
-        self.fullpath = os.path.join(self.repo_dir, self.repo_name)
-        # Function exchange between network and repository
-        self.network = network
-        self.get = network.connect_repository(self.notifyme)
         self.messages = []
-        self.new_messages = threading.Event()
+        self.batches = queue.Queue(maxsize=MAX_PENDING_BATCHES)
         self.is_running = threading.Event()
         self.lock = threading.Lock()
+        self.started_at = None
+        self.stopped_at = None
+        self.stop_deadline: Optional[float] = None
+        self.n_dropped = 0
+        # Repositories share names, the id keeps their metrics apart
+        labels = self.metric_labels = {'repository': name,
+                                       'id': instance_id()}
+        self.write_latency = REGISTRY.histogram(
+            'repository_write_latency_seconds',
+            'Sensor readout to repository write', labels=labels)
+        self.write_duration = REGISTRY.histogram(
+            'repository_write_seconds', 'Duration of a repository write',
+            labels=labels)
+        self.messages_written = REGISTRY.counter(
+            'repository_messages_written_total', 'Messages stored',
+            labels=labels)
+        self.bytes_counter = REGISTRY.counter(
+            'repository_bytes_written_total', 'Bytes stored', labels=labels)
+        # Function exchange between network and repository
+        self.network = network
+        self.clock = getattr(network, 'clock', SYSTEM_CLOCK)
+        if network is not None:
+            self.get = network.connect_repository(self.notifyme, name=name)
 
-    def start_repository(self) -> None:
+    def start_repository(self, wait: bool = True) -> None:
+        """
+        :param wait: Give the thread START_STOP_WAIT seconds to get going
+        """
         if not self.is_alive():
             # Activate the thread
             print(f'Starting the thread: {self.name}')
-            self.start()
             self.is_running.set()
-            time.sleep(START_STOP_WAIT)
+            self.start()
+            if wait:
+                self.clock.sleep(START_STOP_WAIT)
             return
         print(f'The thread {self.name} is already running!')
 
-    def stop_repository(self) -> None:
+    def stop_repository(self, timeout: float = 1.5 * REPOSITORY_INTERVAL) \
+            -> None:
+        """
+        :param timeout: Longest wait for the writer, in seconds
+        """
         if not self.is_alive():
             return
+        self.stop_deadline = time.monotonic() + timeout
         self.is_running.clear()
-        self.join(1.5 * REPOSITORY_INTERVAL)
+        # A writer that misses the sentinel stops once its queue is empty
+        self._hand_over(None)
+        self.join(max(0.0, self.stop_deadline - time.monotonic()))
+        REGISTRY.unregister(self.metric_labels)
         if self.is_alive():
             print(f'Thread {self.name} is still running!')
         else:
             print(f'Thread {self.name} has stopped!')
 
     def notifyme(self) -> None:
-        print("Network notification. Get messages")
         with self.lock:
             self.messages = self.get()
-
-        for message in self.messages:
-            print(message)
         self.save()
-        return
 
     def save(self) -> None:
-        self.new_messages.set()
+        """
+        Hand the last batch over to the writer thread. The network replaces
+        self.messages on the next notification, the writer keeps this list.
+        """
+        if self.messages and not self._hand_over(self.messages):
+            self.n_dropped += len(self.messages)
+            print(f'{self.repo_name} dropped a batch of '
+                  f'{len(self.messages)} messages!')
+
+    def _hand_over(self, batch: Optional[list]) -> bool:
+        """
+        Put a batch, or the stop sentinel, into self.batches. Waits as long
+        as the writer is alive, but not past the stop deadline
+        :return: False if the writer is gone or the deadline has passed
+        """
+        while True:
+            deadline = self.stop_deadline
+            timeout = REPOSITORY_INTERVAL if deadline is None else \
+                max(0.0, deadline - time.monotonic())
+            try:
+                self.batches.put(batch, timeout=timeout)
+                return True
+            except queue.Full:
+                if self.ident is not None and not self.is_alive():
+                    return False
+                if deadline is not None and time.monotonic() >= deadline:
+                    return False
+
+    def elapsed(self) -> float:
+        """
+        :return: Seconds the writer has been running
+        """
+        if self.started_at is None:
+            return 0.0
+        return (self.stopped_at or time.monotonic()) - self.started_at
+
+    def _next_batches(self, timeout: Optional[float]) -> Tuple[List[list], bool]:
+        """
+        Wait for a batch, then take every batch already waiting
+        :param timeout: Longest wait for the first batch, None waits until
+                        a batch comes or a stop is requested
+        :return: batches, stop requested
+        """
+        while True:
+            try:
+                batch = self.batches.get(timeout=REPOSITORY_INTERVAL
+                                         if timeout is None else timeout)
+                break
+            except queue.Empty:
+                if not self.is_running.is_set():
+                    return [], True
+                if timeout is not None:
+                    return [], False
+        batches = []
+        while batch is not None:
+            batches.append(batch)
+            if len(batches) >= MAX_COALESCED_BATCHES:
+                return batches, False
+            try:
+                batch = self.batches.get_nowait()
+            except queue.Empty:
+                return batches, False
+        return batches, True
+
+
+class FsyncPolicy(Enum):
+    NEVER = 'never'             # Leave it to the OS
+    INTERVAL = 'interval'       # At most every fsync_interval seconds
+    BATCH = 'batch'             # After every group write
+
+
+class FileRepository(Repository):
+    """
+    Append the messages to a file: one JSON line per message, or fixed-size
+    records in the BINARY wire format. The names of the sensors of a binary
+    file are kept in the side file <location>.sensors.json.
+    The network thread hands every batch over to the writer thread, which
+    coalesces all the batches waiting into a single buffered write.
+    A sparse index <location>.idx of byte ranges per time bucket and sensor
+    lets query() read only the part of the file it needs.
+    """
+
+    def __init__(self, *, location: str, network: Network,
+                 fsync_policy: FsyncPolicy = FsyncPolicy.NEVER,
+                 fsync_interval: float = FSYNC_INTERVAL,
+                 wire_format: WireFormat = WireFormat.JSON,
+                 index_bucket: float = INDEX_BUCKET) -> None:
+        super().__init__(name='FileRepository', thread_name='FileArchive',
+                         network=network)
+        self.repo_dir, self.repo_name = resolve_location(location)
+        self.fullpath = os.path.join(self.repo_dir, self.repo_name)
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.wire_format = wire_format
+        self.directory_path = f'{self.fullpath}.sensors.json'
+        # The side file keeps the sensors of the earlier runs too
+        self.known_sensors = set()
+        if os.path.exists(self.directory_path):
+            self.known_sensors = load_directory(self.directory_path)
+        self.index = SparseIndex(f'{self.fullpath}.idx', bucket=index_bucket)
+        self._index_tail()
+        # Writer statistics
+        self.n_writes = 0
+        self.n_messages = 0
+        self.n_fsyncs = 0
+        self.bytes_written = 0
+        self.write_time = 0.0
+
+    def write_stats(self) -> dict:
+        """
+        :return: Writer counters and throughput since the repository started
+        """
+        elapsed = self.elapsed()
+        return {'writes': self.n_writes,
+                'messages': self.n_messages,
+                'bytes': self.bytes_written,
+                'fsyncs': self.n_fsyncs,
+                'write_seconds': self.write_time,
+                'messages_per_s': self.n_messages / elapsed if elapsed else 0.0,
+                'bytes_per_s': self.bytes_written / elapsed if elapsed else 0.0}
+
+    def _encode(self, batches: List[list]) -> Tuple[bytes, List[tuple]]:
+        """
+        :return: Data to append, (sensor id, timestamp, size) of every message
+        """
+        entries = []
+        if self.wire_format is WireFormat.JSON:
+            lines = []
+            for batch in batches:
+                for message in batch:
+                    line = f'{message_to_text(message)}\n'.encode()
+                    device_id, _, timestamp, *_ = message_to_readout(message)
+                    entries.append((device_id, timestamp, len(line)))
+                    lines.append(line)
+            return b''.join(lines), entries
+        data = b''.join(message_to_record(message) for batch in batches
+                        for message in batch)
+        entries = [(device_id, timestamp, RECORD.size) for
+                   device_id, _, timestamp, *_ in RECORD.iter_unpack(data)]
+        sensors = {device_id for device_id, *_ in entries}
+        if not sensors <= self.known_sensors:
+            self.known_sensors |= sensors
+            save_directory(self.directory_path, self.known_sensors)
+        return data, entries
+
+    def _write(self, f, batches: List[list]) -> None:
+        data, entries = self._encode(batches)
+        start = time.perf_counter()
+        offset = f.tell()
+        f.write(data)
+        f.flush()
+        if self.fsync_policy is FsyncPolicy.BATCH:
+            os.fsync(f.fileno())
+            self.n_fsyncs += 1
+        duration = time.perf_counter() - start
+        self.write_time += duration
+        self.index.add(offset, entries)
+        self.n_writes += 1
+        self.n_messages += len(entries)
+        self.bytes_written += len(data)
+        now = self.clock.time()
+        self.write_latency.record_many(now - timestamp
+                                       for _, timestamp, _ in entries)
+        self.write_duration.record(duration)
+        self.messages_written.inc(len(entries))
+        self.bytes_counter.inc(len(data))
+
+    def _read_range(self, f: BinaryIO, first: int, end: int) \
+            -> Iterator[Tuple[int, DeviceMessage]]:
+        """
+        Messages stored between two byte offsets of the file
+        :return: Iterator of (size, message), unreadable lines have no message
+        """
+        f.seek(first)
+        position = first
+        if self.wire_format is WireFormat.BINARY:
+            while position < end:
+                chunk = f.read(min(READ_CHUNK, end - position))
+                if len(chunk) < RECORD.size:
+                    return
+                chunk = chunk[:len(chunk) - len(chunk) % RECORD.size]
+                position += len(chunk)
+                for offset in range(0, len(chunk), RECORD.size):
+                    record = chunk[offset:offset + RECORD.size]
+                    msg_type = decode_readout(record)[1]
+                    yield RECORD.size, DeviceMessage(msg_type, record)
+            return
+        while position < end:
+            line = f.readline()
+            if not line:
+                return
+            position += len(line)
+            try:
+                content = json.loads(line)
+                message = DeviceMessage(content['msg_type'],
+                                        content['msg_content'])
+            except (ValueError, KeyError, TypeError):
+                message = None
+            yield len(line), message
+
+    def _index_tail(self) -> None:
+        """ Index what was written to the file before the index existed """
+        if not os.path.exists(self.fullpath):
+            return
+        size = os.path.getsize(self.fullpath)
+        if size <= self.index.indexed_bytes:
+            return
+        entries = []
+        with open(self.fullpath, 'rb') as f:
+            for length, message in self._read_range(
+                    f, self.index.indexed_bytes, size):
+                try:
+                    device_id, _, timestamp, *_ = message_to_readout(message)
+                except (AttributeError, ValueError, KeyError, TypeError):
+                    # Not a readout, e.g. a line of the old repr format
+                    device_id, timestamp = 0, 0.0
+                entries.append((device_id, timestamp, length))
+        self.index.add(self.index.indexed_bytes, entries)
+
+    def query(self, sensor_name: Optional[str] = None,
+              start: Optional[float] = None,
+              end: Optional[float] = None) -> Iterator[DeviceMessage]:
+        """
+        Stored readouts of a sensor in the time window [start, end).
+        Only the byte ranges the index points to are read.
+        :param sensor_name: All the sensors by default
+        :param start: posix timestamp
+        :param end: posix timestamp
+        :return: Generator of DeviceMessage, in file order
+        """
+        device_id = None if sensor_name is None else sensor_id(sensor_name)
+        with open(self.fullpath, 'rb') as f:
+            for first, last in self.index.find(device_id, start, end):
+                for _, message in self._read_range(f, first, last):
+                    if message is None:
+                        continue
+                    try:
+                        readout = message_to_readout(message)
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                    if device_id is not None and readout[0] != device_id:
+                        continue
+                    if start is not None and readout[2] < start:
+                        continue
+                    if end is not None and readout[2] >= end:
+                        continue
+                    yield message
 
     def run(self):
-        with open(self.fullpath, "+a") as f:
-            while self.is_running.is_set():
-                self.new_messages.wait()
-                for message in self.messages:
-                    print(message)
-                    f.write(str(message) + '\n')
-                self.new_messages.clear()
+        self.started_at = time.monotonic()
+        last_sync = self.started_at
+        dirty = False
+        with open(self.fullpath, "ab", buffering=WRITE_BUFFER_SIZE) as f:
+            stop = False
+            while not stop:
+                timeout = None
+                if dirty and self.fsync_policy is FsyncPolicy.INTERVAL:
+                    timeout = max(0.0, last_sync + self.fsync_interval
+                                  - time.monotonic())
+                batches, stop = self._next_batches(timeout)
+                if batches:
+                    self._write(f, batches)
+                    dirty = self.fsync_policy is FsyncPolicy.INTERVAL
+                if dirty and (stop or time.monotonic() - last_sync
+                              >= self.fsync_interval):
+                    os.fsync(f.fileno())
+                    self.n_fsyncs += 1
+                    last_sync = time.monotonic()
+                    dirty = False
+        self.index.close()
+        self.stopped_at = time.monotonic()
 
 
 class DBRepository(Repository):
     """
-        Repository with a simple relational DB
+        Repository with a simple relational DB.
+        Every batch handed over by the network is converted into rows and
+        inserted with a single executemany in its own transaction.
     """
-    def __init__(self, *, name: str, db: str = 'sqlite:///sensors.sqlite'):
-        super().__init__(name=name)
+    def __init__(self, *, name: str = 'DBRepository', network: Network,
+                 db: str = 'sqlite:///sensors.sqlite'):
+        super().__init__(name=name, thread_name='DBArchive', network=network)
         self.engine = create_engine(db)
-        self.Session = sessionmaker(bind=self.engine)
-        self.session = self.Session()
-
+        if self.engine.dialect.name == 'sqlite':
+            event.listen(self.engine, 'connect', _sqlite_pragmas)
         Message.metadata.create_all(self.engine)
+        self.insert = Message.__table__.insert()
+        # Writer statistics
+        self.n_transactions = 0
+        self.n_rows = 0
+        self.n_rejected = 0
+        self.n_failed = 0
+        self.write_time = 0.0
 
-    def add_message(self, message: Message) -> None:
-        self.session.add(message)
+    def to_rows(self, messages: List) -> List[dict]:
+        """
+        Convert the network messages into rows of the messages table.
+        Readouts outside of the model's valid range are rejected.
+        :param messages: List of DeviceMessage
+        :return: List of rows
+        """
+        rows = []
+        for message in messages:
+            device_id, _, timestamp, value, _ = message_to_readout(message)
+            if not SENSOR_MIN <= value <= SENSOR_MAX:
+                self.n_rejected += 1
+                continue
+            name, sensor_type = SENSOR_DIRECTORY.get(device_id,
+                                                     (str(device_id), None))
+            rows.append({'timestamp': datetime.fromtimestamp(timestamp),
+                         'sensor_name': name,
+                         'sensor_type': sensor_type,
+                         'value': value})
+        return rows
 
-    def save(self) -> None:
-        pass
-        # if isinstance(messages, list):
-        #     try:
-        #         for msg in messages:
-        #             self.add_message(msg)
-        #     except SQLAlchemyError:
-        #         self.session.rollback()
-        #         print(f'Last repository session rolled back!')
-        #     else:
-        #         self.session.commit()
-        # else:
-        #     self.add_message(messages)
-        #     self.session.commit()
+    def write_stats(self) -> dict:
+        """
+        :return: Insert counters and throughput since the repository started
+        """
+        elapsed = self.elapsed()
+        return {'transactions': self.n_transactions,
+                'rows': self.n_rows,
+                'rejected': self.n_rejected,
+                'failed': self.n_failed,
+                'write_seconds': self.write_time,
+                'rows_per_s': self.n_rows / elapsed if elapsed else 0.0}
+
+    def _insert(self, batch: List) -> None:
+        rows = self.to_rows(batch)
+        if not rows:
+            return
+        start = time.perf_counter()
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(self.insert, rows)
+        except SQLAlchemyError as err:
+            self.n_failed += len(rows)
+            print(f'Last repository transaction rolled back! {err}')
+        else:
+            self.n_transactions += 1
+            self.n_rows += len(rows)
+            now = self.clock.time()
+            self.write_latency.record_many(now - row['timestamp'].timestamp()
+                                           for row in rows)
+            self.messages_written.inc(len(rows))
+        duration = time.perf_counter() - start
+        self.write_time += duration
+        self.write_duration.record(duration)
+
+    def run(self):
+        self.started_at = time.monotonic()
+        stop = False
+        while not stop:
+            batches, stop = self._next_batches(None)
+            for batch in batches:
+                self._insert(batch)
+        self.engine.dispose()
+        self.stopped_at = time.monotonic()
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """ Tune every new SQLite connection for bulk appends """
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
 
 
 if __name__ == '__main__':
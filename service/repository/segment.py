@@ -0,0 +1,252 @@
+"""
+  Columnar segment store.
+  Readings are appended to fixed-capacity segment files, each one holding
+  three memory-mapped columns (timestamp, sensor id, value) behind a small
+  header with the row count and the min/max timestamp. Scans map the
+  columns and work on NumPy views instead of parsing text.
+"""
+
+import glob
+import os
+import struct
+import time
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from service.model.codec import message_to_readout, save_directory, \
+    load_directory, sensor_id
+from service.repository.repository import Repository
+from utils.network import Network
+
+
+MAGIC = b'SNSRSEG1'
+HEADER = struct.Struct('<8sQQdd')       # magic, capacity, count, min_ts, max_ts
+HEADER_SIZE = 64
+DEFAULT_SEGMENT_ROWS = 1 << 20          # ~16 MiB per segment
+SEGMENT_PATTERN = 'segment-{:06d}.col'
+SEGMENT_GLOB = 'segment-*.col'
+TS_DTYPE = np.float64
+ID_DTYPE = np.uint32
+VALUE_DTYPE = np.float32
+
+
+def segment_number(path: str) -> int:
+    """ :return: Number of a segment file named after SEGMENT_PATTERN """
+    name = os.path.basename(path)
+    return int(name[name.index('-') + 1:name.index('.')])
+
+
+class Segment:
+    """
+    One append-only segment file
+    """
+
+    def __init__(self, path: str, *, capacity: Optional[int] = None) -> None:
+        """
+        Open a segment, creating it when a capacity is given
+        :param path: Segment file
+        :param capacity: Number of rows of a new segment
+        """
+        self.path = path
+        self.writable = writable = capacity is not None
+        if writable:
+            size = HEADER_SIZE + capacity * (np.dtype(TS_DTYPE).itemsize +
+                                             np.dtype(ID_DTYPE).itemsize +
+                                             np.dtype(VALUE_DTYPE).itemsize)
+            # 'x': never truncate an existing segment
+            with open(path, 'xb') as f:
+                f.truncate(size)
+        mode = 'r+' if writable else 'r'
+        self._header = np.memmap(path, dtype=np.uint8, mode=mode,
+                                 shape=(HEADER_SIZE,))
+        if writable:
+            self.capacity, self.count = capacity, 0
+            self.min_ts, self.max_ts = np.inf, -np.inf
+            self._write_header()
+        else:
+            magic, self.capacity, self.count, self.min_ts, self.max_ts = \
+                HEADER.unpack_from(self._header)
+            if magic != MAGIC:
+                raise ValueError(f'{path} is not a segment file')
+        offset = HEADER_SIZE
+        self._ts = np.memmap(path, dtype=TS_DTYPE, mode=mode, offset=offset,
+                             shape=(self.capacity,))
+        offset += self._ts.nbytes
+        self._ids = np.memmap(path, dtype=ID_DTYPE, mode=mode, offset=offset,
+                              shape=(self.capacity,))
+        offset += self._ids.nbytes
+        self._values = np.memmap(path, dtype=VALUE_DTYPE, mode=mode,
+                                 offset=offset, shape=(self.capacity,))
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def room(self) -> int:
+        return self.capacity - self.count
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self._ts[:self.count]
+
+    @property
+    def sensor_ids(self) -> np.ndarray:
+        return self._ids[:self.count]
+
+    @property
+    def values(self) -> np.ndarray:
+        return self._values[:self.count]
+
+    def refresh(self) -> None:
+        """ Reload the header of a segment another thread is appending to """
+        _, _, self.count, self.min_ts, self.max_ts = \
+            HEADER.unpack_from(self._header)
+
+    def overlaps(self, start: Optional[float], end: Optional[float]) -> bool:
+        if not self.count:
+            return False
+        return (start is None or self.max_ts >= start) and \
+            (end is None or self.min_ts < end)
+
+    def append(self, timestamps: np.ndarray, sensor_ids: np.ndarray,
+               values: np.ndarray) -> int:
+        """
+        Append as many rows as fit. The header is updated once the columns
+        hold the new rows, so readers never see partial rows.
+        :return: Number of rows appended
+        """
+        n_rows = min(self.room, len(timestamps))
+        if not n_rows:
+            return 0
+        rows = slice(self.count, self.count + n_rows)
+        self._ts[rows] = timestamps[:n_rows]
+        self._ids[rows] = sensor_ids[:n_rows]
+        self._values[rows] = values[:n_rows]
+        self.min_ts = min(self.min_ts, float(timestamps[:n_rows].min()))
+        self.max_ts = max(self.max_ts, float(timestamps[:n_rows].max()))
+        self.count += n_rows
+        self._write_header()
+        return n_rows
+
+    def flush(self) -> None:
+        for column in (self._ts, self._ids, self._values, self._header):
+            column.flush()
+
+    def _write_header(self) -> None:
+        HEADER.pack_into(self._header, 0, MAGIC, self.capacity, self.count,
+                         self.min_ts, self.max_ts)
+
+
+class SegmentRepository(Repository):
+    """
+    Repository storing the readings in columnar segments inside a directory
+    """
+
+    def __init__(self, *, location: str, network: Network,
+                 segment_rows: int = DEFAULT_SEGMENT_ROWS) -> None:
+        super().__init__(name='SegmentRepository', thread_name='SegmentArchive',
+                         network=network)
+        self.repo_dir = os.path.abspath(location)
+        os.makedirs(self.repo_dir, exist_ok=True)
+        self.segment_rows = segment_rows
+        self.directory_path = os.path.join(self.repo_dir, 'sensors.json')
+        # The side file keeps the sensors of the earlier sessions too
+        self.known_sensors = set()
+        if os.path.exists(self.directory_path):
+            self.known_sensors = load_directory(self.directory_path)
+        # Existing segments are read only, new readings go to new segments
+        paths = sorted(glob.glob(os.path.join(self.repo_dir, SEGMENT_GLOB)))
+        self.segments: List[Segment] = [Segment(path) for path in paths]
+        # Numbered after the last one: the numbering may have gaps
+        self.next_segment = max(map(segment_number, paths), default=-1) + 1
+        self.n_rows = 0
+
+    def _current_segment(self) -> Segment:
+        last = self.segments[-1] if self.segments else None
+        if last is None or not last.writable or not last.room:
+            if last is not None and last.writable:
+                last.flush()
+            path = os.path.join(self.repo_dir,
+                                SEGMENT_PATTERN.format(self.next_segment))
+            self.next_segment += 1
+            self.segments.append(Segment(path, capacity=self.segment_rows))
+        return self.segments[-1]
+
+    def append(self, messages: List) -> None:
+        """
+        Convert messages into columns and append them to the segments
+        :param messages: List of DeviceMessage
+        :return: None
+        """
+        readouts = [message_to_readout(message) for message in messages]
+        ids = np.fromiter((r[0] for r in readouts), ID_DTYPE, len(readouts))
+        timestamps = np.fromiter((r[2] for r in readouts), TS_DTYPE,
+                                 len(readouts))
+        values = np.fromiter((r[3] for r in readouts), VALUE_DTYPE,
+                             len(readouts))
+        written = 0
+        while written < len(readouts):
+            written += self._current_segment().append(
+                timestamps[written:], ids[written:], values[written:])
+        self.n_rows += written
+        new_sensors = set(np.unique(ids).tolist()) - self.known_sensors
+        if new_sensors:
+            self.known_sensors |= new_sensors
+            save_directory(self.directory_path, self.known_sensors)
+
+    def scan(self, sensor_name: Optional[str] = None,
+             start: Optional[float] = None, end: Optional[float] = None) \
+            -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Timestamps and values of the readings in [start, end), segment by
+        segment. Segments whose header is outside the range aren't touched.
+        :param sensor_name: Only this sensor, all of them by default
+        :param start: posix timestamp
+        :param end: posix timestamp
+        :return: Iterator of (timestamps, values) arrays
+        """
+        device_id = None if sensor_name is None else sensor_id(sensor_name)
+        for segment in list(self.segments):
+            segment.refresh()
+            if not segment.overlaps(start, end):
+                continue
+            timestamps, values = segment.timestamps, segment.values
+            mask = None
+            if device_id is not None:
+                mask = segment.sensor_ids == device_id
+            if start is not None:
+                mask = timestamps >= start if mask is None \
+                    else mask & (timestamps >= start)
+            if end is not None:
+                mask = timestamps < end if mask is None \
+                    else mask & (timestamps < end)
+            if mask is None:
+                yield timestamps, values
+            else:
+                yield timestamps[mask], values[mask]
+
+    def mean(self, sensor_name: str, start: Optional[float] = None,
+             end: Optional[float] = None) -> Optional[float]:
+        """
+        Mean value of a sensor over [start, end)
+        :return: float or None without readings
+        """
+        total, count = 0.0, 0
+        for _, values in self.scan(sensor_name, start, end):
+            total += float(values.sum(dtype=np.float64))
+            count += len(values)
+        return total / count if count else None
+
+    def run(self):
+        self.started_at = time.monotonic()
+        stop = False
+        while not stop:
+            batches, stop = self._next_batches(None)
+            messages = [message for batch in batches for message in batch]
+            if messages:
+                self.append(messages)
+        for segment in self.segments[-1:]:
+            if segment.writable:
+                segment.flush()
+        self.stopped_at = time.monotonic()
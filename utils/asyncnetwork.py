@@ -0,0 +1,116 @@
+"""
+  Asyncio implementation of the Network.
+  Sensors and repositories are coroutines sharing one event loop; the
+  messages travel through an asyncio.Queue and the network awakes only
+  when there is something to deliver.
+"""
+
+import asyncio
+from typing import List, Callable, Awaitable, Optional
+
+from utils.network import N_MESSAGES
+
+
+_STOP = object()          # Queue sentinel requesting the shutdown
+
+
+class AsyncNetwork:
+    """
+    Logging service for asyncio devices and repository
+    """
+
+    def __init__(self, *, maxsize: int = 3 * N_MESSAGES,
+                 batch_size: int = N_MESSAGES) -> None:
+        self.name = 'AsyncNetwork'
+        self.batch_size = batch_size
+        self.message_queue = asyncio.Queue(maxsize=maxsize)
+        self.devices = dict()
+        self.notify_repo: Optional[Callable[[List], Awaitable[None]]] = None
+        self.stopped = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start_network(self) -> None:
+        if self._task is not None and not self._task.done():
+            print(f'The task {self.name} is already running!')
+            return
+        print(f'Starting the task: {self.name}')
+        self.stopped.clear()
+        self._task = asyncio.create_task(self.run(), name=self.name)
+
+    async def stop_network(self) -> None:
+        """
+        Stop the network. Messages queued before the call are delivered first.
+        :return: None
+        """
+        if self._task is None:
+            return
+        await self.message_queue.put(_STOP)
+        await self._task
+        self._task = None
+        self.stopped.set()
+        print(f'Task {self.name} has stopped!')
+
+    async def wait_stopped(self) -> None:
+        await self.stopped.wait()
+
+    async def send(self, message) -> None:
+        """
+        All Sensor devices place their messages into the queue. When it is full
+        the sensor waits for room instead of failing.
+        :param message: DeviceMessage
+        :return: None
+        """
+        await self.message_queue.put(message)
+
+    def get(self, max_messages: Optional[int] = None) -> List:
+        """
+        Extract the messages available in the queue without waiting
+        :param max_messages: Upper bound of messages to extract
+        :return: List of messages
+        """
+        result = []
+        limit = self.message_queue.qsize() if max_messages is None \
+            else max_messages
+        while len(result) < limit:
+            try:
+                result.append(self.message_queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return result
+
+    def connect_device(self) -> Callable:
+        """
+        Subscription method to the network
+        :return: returns the coroutine function to access the queue
+        """
+        return self.send
+
+    def connect_repository(self, notification_fn: Callable) -> Callable:
+        """
+        Subscribe the repository. notification_fn is a coroutine function
+        receiving every batch of messages.
+        :return: returns the function to get data from the queue
+        """
+        self.notify_repo = notification_fn
+        return self.get
+
+    async def notify_repository(self, messages: List) -> None:
+        if self.notify_repo is not None and messages:
+            await self.notify_repo(messages)
+
+    async def run(self) -> None:
+        """
+        Wait for the first message, then deliver everything that is queued in
+        groups of batch_size until the stop sentinel is found.
+        :return: None
+        """
+        while True:
+            batch = [await self.message_queue.get()]
+            batch.extend(self.get(self.batch_size - 1))
+            if _STOP in batch:
+                # Anything sent after the stop request is still delivered
+                batch.remove(_STOP)
+                batch.extend(self.get())
+                await self.notify_repository(batch)
+                return
+            await self.notify_repository(batch)
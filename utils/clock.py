@@ -0,0 +1,126 @@
+"""
+  Pluggable clocks.
+
+  Sensors, the network and the repositories read the time and sleep through
+  a Clock. SYSTEM_CLOCK is the wall clock. VirtualClock is a discrete-event
+  clock for simulations: time only moves when it is advanced, running the
+  scheduled events in (time, insertion) order, so a run is as fast as the
+  CPU allows and identical every time. VirtualClock is meant to be driven
+  from a single thread, see sensors/simulation.py.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Callable
+
+# Posix time of the virtual clock's origin: 2023-01-01 00:00:00 UTC
+VIRTUAL_EPOCH = datetime(2023, 1, 1, tzinfo=timezone.utc).timestamp()
+
+
+class Clock(ABC):
+    """
+    Time source and sleep
+    """
+
+    @abstractmethod
+    def time(self) -> float:
+        """ :return: posix timestamp """
+
+    @abstractmethod
+    def monotonic(self) -> float:
+        """ :return: seconds of a clock that never goes back """
+
+    @abstractmethod
+    def sleep(self, seconds: float) -> None:
+        """ Block for the given seconds of this clock """
+
+    @abstractmethod
+    def wait(self, event: threading.Event, seconds: float) -> bool:
+        """
+        Sleep, unless the event is set meanwhile
+        :return: True when the event is set
+        """
+
+
+class SystemClock(Clock):
+    """
+    The wall clock
+    """
+
+    def time(self) -> float:
+        return time.time()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+    def wait(self, event: threading.Event, seconds: float) -> bool:
+        return event.wait(seconds)
+
+
+class VirtualClock(Clock):
+    """
+    Discrete-event clock, starting at monotonic() == 0 and time() == start
+    """
+
+    def __init__(self, *, start: float = VIRTUAL_EPOCH) -> None:
+        self.start = start
+        self._now = 0.0
+        self._events = []
+        self._sequence = itertools.count()
+        self.n_events = 0
+
+    def __len__(self) -> int:
+        """ :return: Number of pending events """
+        return len(self._events)
+
+    def time(self) -> float:
+        return self.start + self._now
+
+    def monotonic(self) -> float:
+        return self._now
+
+    def sleep(self, seconds: float) -> None:
+        """ Advance the time, running the events due meanwhile """
+        self.run_until(self._now + max(0.0, seconds))
+
+    def wait(self, event: threading.Event, seconds: float) -> bool:
+        """ Advance the time, the event can only be set by the events run """
+        if not event.is_set():
+            self.sleep(seconds)
+        return event.is_set()
+
+    def call_at(self, when: float, fn: Callable, *args) -> None:
+        """
+        Schedule an event
+        :param when: monotonic time, events in the past run on the next advance
+        :param fn: Callable run with args
+        :return: None
+        """
+        heapq.heappush(self._events, (when, next(self._sequence), fn, args))
+
+    def call_later(self, delay: float, fn: Callable, *args) -> None:
+        self.call_at(self._now + delay, fn, *args)
+
+    def run_until(self, when: float) -> None:
+        """
+        Run every event due up to a monotonic time, then move the time there
+        :param when: monotonic time
+        :return: None
+        """
+        events = self._events
+        while events and events[0][0] <= when:
+            due, _, fn, args = heapq.heappop(events)
+            self._now = max(self._now, due)
+            self.n_events += 1
+            fn(*args)
+        self._now = max(self._now, when)
+
+
+SYSTEM_CLOCK = SystemClock()
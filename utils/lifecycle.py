@@ -0,0 +1,187 @@
+"""
+  Lifecycle of a sensor -> network -> repository pipeline.
+
+  Lifecycle starts the components without the per-component start waits
+  and shuts them down against a single deadline, stage by stage so that
+  nothing in flight is lost: the sensors stop producing, the network hands
+  what is still queued over to its subscribers, the aggregators finalize
+  their open windows, then the repositories write what they were given.
+  The components of a stage are stopped concurrently and every wait is
+  interruptible, so shutting down takes about as long as writing the last
+  batches, whatever the fleet size or the sensor intervals.
+"""
+
+import signal
+import threading
+import time
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from sensors.basesensor import SensorBank
+from sensors.scheduler import SensorScheduler
+from service.aggregation.rollup import RollupAggregator
+from service.repository.repository import Repository
+from utils.network import Network, BatchSender
+
+SHUTDOWN_TIMEOUT = 10.0             # 10 s for the whole shutdown
+SHUTDOWN_SIGNALS = (signal.SIGINT, signal.SIGTERM)
+
+Step = Tuple[str, Callable[[], None]]
+
+
+def run_concurrently(steps: Iterable[Step], deadline: float) -> List[str]:
+    """
+    Run every step in its own thread and wait for them until the deadline
+    :param steps: (name, function) pairs
+    :param deadline: time.monotonic() time
+    :return: Names of the steps still running at the deadline
+    """
+    threads = [threading.Thread(name=f'stop-{name}', target=fn, daemon=True)
+               for name, fn in steps]
+    for thread in threads:
+        thread.start()
+    late = []
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+        if thread.is_alive():
+            late.append(thread.name[len('stop-'):])
+    return late
+
+
+class Lifecycle:
+    """
+    Start and stop a pipeline as a whole
+    """
+
+    def __init__(self, *, network: Network,
+                 repositories: Iterable[Repository] = (),
+                 banks: Iterable[SensorBank] = (),
+                 schedulers: Iterable[SensorScheduler] = (),
+                 senders: Iterable[BatchSender] = (),
+                 aggregators: Iterable[RollupAggregator] = (),
+                 timeout: float = SHUTDOWN_TIMEOUT) -> None:
+        """
+        :param network: Network of the pipeline
+        :param repositories: Subscribers of the network
+        :param banks: Sensor banks feeding the network, SensorBank or
+                      ShardedSensorBank
+        :param schedulers: Schedulers firing the banks' sensors
+        :param senders: BatchSenders between the sensors and the network
+        :param aggregators: RollupAggregators between the network and some
+                            of the repositories
+        :param timeout: Longest shutdown, in seconds
+        """
+        self.network = network
+        self.repositories = list(repositories)
+        self.banks = list(banks)
+        self.schedulers = list(schedulers)
+        self.senders = list(senders)
+        self.aggregators = list(aggregators)
+        self.timeout = timeout
+        self.stop_requested = threading.Event()
+        self.is_running = False
+        self.is_stopped = False
+        self.last_shutdown: Optional[dict] = None
+
+    def start(self) -> float:
+        """
+        Start the sinks first, then the network, then the sensors. A
+        Lifecycle is single use: its threads can't be started again once
+        shut down.
+        :return: Seconds taken
+        :raises RuntimeError: The pipeline has been shut down
+        """
+        if self.is_stopped:
+            raise RuntimeError('The pipeline has been shut down and can not '
+                               'be restarted, create new components and a '
+                               'new Lifecycle')
+        if self.is_running:
+            print('The pipeline is already running!')
+            return 0.0
+        start = time.monotonic()
+        self.stop_requested.clear()
+        for repository in self.repositories:
+            repository.start_repository(wait=False)
+        self.network.start_network(wait=False)
+        for sender in self.senders:
+            sender.start_sender()
+        for scheduler in self.schedulers:
+            scheduler.start_scheduler()
+        for bank in self.banks:
+            bank.start_bank()
+        self.is_running = True
+        return time.monotonic() - start
+
+    def request_stop(self, *_) -> None:
+        """ Ask run() to shut down, safe from a signal handler """
+        self.stop_requested.set()
+
+    def run(self, duration: Optional[float] = None) -> dict:
+        """
+        Start, run until SIGINT/SIGTERM, request_stop() or the end of the
+        duration, then shut down
+        :param duration: Seconds, None runs until asked to stop
+        :return: Shutdown report
+        """
+        handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in SHUTDOWN_SIGNALS:
+                handlers[signum] = signal.signal(signum, self.request_stop)
+        try:
+            self.start()
+            self.stop_requested.wait(duration)
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+        return self.shutdown()
+
+    def shutdown(self, timeout: Optional[float] = None) -> dict:
+        """
+        Stop the sensors, drain the network into the repositories and stop
+        them, within one deadline
+        :param timeout: Seconds, the lifecycle's timeout by default
+        :return: Report: seconds taken, messages left in the network, the
+                 subscribers or the repositories, and the components that
+                 missed the deadline
+        """
+        start = time.monotonic()
+        deadline = start + (self.timeout if timeout is None else timeout)
+
+        def remaining() -> float:
+            return max(0.0, deadline - time.monotonic())
+
+        late = run_concurrently(
+            [(f'bank-{i}', bank.stop_bank)
+             for i, bank in enumerate(self.banks)], deadline)
+        late += run_concurrently(
+            [(scheduler.name, scheduler.stop_scheduler)
+             for scheduler in self.schedulers], deadline)
+        late += run_concurrently(
+            [(f'sender-{i}', sender.stop_sender)
+             for i, sender in enumerate(self.senders)], deadline)
+        # The network delivers its queue to the subscribers before it stops
+        late += run_concurrently(
+            [(self.network.name,
+              lambda: self.network.stop_network(remaining()))], deadline)
+        # The aggregators finalize their open windows and deliver the rest
+        late += run_concurrently(
+            [(f'aggregator-{i}', lambda aggregator=aggregator:
+              aggregator.stop_aggregator(remaining()))
+             for i, aggregator in enumerate(self.aggregators)], deadline)
+        late += run_concurrently(
+            [(repository.repo_name, lambda repository=repository:
+              repository.stop_repository(remaining()))
+             for repository in self.repositories], deadline)
+        late += [repository.repo_name for repository in self.repositories
+                 if repository.is_alive() and repository.repo_name not in late]
+        self.is_running = False
+        self.is_stopped = True
+        self.last_shutdown = {
+            'seconds': time.monotonic() - start,
+            'network_pending': len(self.network.message_queue),
+            'subscribers_pending': sum(
+                stats['pending'] for stats in self.network.sink_stats().values()),
+            'repositories_pending': sum(repository.batches.qsize()
+                                        for repository in self.repositories),
+            'late': late}
+        print(f'Pipeline stopped: {self.last_shutdown}')
+        return self.last_shutdown
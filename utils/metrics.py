@@ -0,0 +1,339 @@
+"""
+  Pipeline metrics.
+
+  Counters, gauges and HDR-style histograms kept in a registry, REGISTRY by
+  default, which the network and the repositories record into. Recording is
+  a couple of integer operations under a lock; gauges are callbacks only
+  evaluated when a snapshot is taken.
+  The registry provides a snapshot() dict and the Prometheus text format,
+  served by MetricsServer at http://<host>:<port>/metrics.
+"""
+
+import itertools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+SUB_BUCKET_BITS = 7             # 1 / 2**6: ~1.6% relative precision
+MAX_VALUE_BITS = 48             # Values up to 2**48 units
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+LATENCY_SCALE = 1_000_000       # Latencies are recorded in microseconds
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9108
+START_STOP_WAIT = 1.5
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_instance_ids = itertools.count(1)
+
+
+def instance_id() -> str:
+    """
+    Label value telling apart the components of the same name, e.g. the
+    networks of consecutive benchmark runs
+    :return: str, unique in the process
+    """
+    return str(next(_instance_ids))
+
+
+class Counter:
+    """
+    Monotonic counter
+    """
+
+    def __init__(self, name: str, help_text: str = '') -> None:
+        self.name = name
+        self.help = help_text
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def reset(self) -> None:
+        with self._lock:
+            self.value = 0
+
+    def snapshot(self) -> int:
+        return self.value
+
+
+class Gauge:
+    """
+    Current value of something, read from a callback at snapshot time
+    """
+
+    def __init__(self, name: str, fn: Callable[[], float],
+                 help_text: str = '') -> None:
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+
+    def snapshot(self) -> float:
+        return self.fn()
+
+
+class Histogram:
+    """
+    HDR-style histogram: values below 2**SUB_BUCKET_BITS units are counted
+    exactly, above that every power of two is split in 2**(SUB_BUCKET_BITS-1)
+    linear sub-buckets, so quantiles keep a constant relative precision.
+    Values are given in seconds (or any unit) and stored as integer units of
+    1/scale.
+    """
+
+    def __init__(self, name: str, help_text: str = '', *,
+                 scale: float = LATENCY_SCALE,
+                 lock: Optional[threading.Lock] = None) -> None:
+        """
+        :param lock: Lock to share, e.g. with the queue whose critical
+                     section records into the histogram
+        """
+        self.name = name
+        self.help = help_text
+        self.scale = scale
+        self._half = 1 << (SUB_BUCKET_BITS - 1)
+        self.counts = [0] * ((MAX_VALUE_BITS - SUB_BUCKET_BITS + 2) *
+                             self._half)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self._lock = lock or threading.Lock()
+
+    def _index(self, units: int) -> int:
+        shift = units.bit_length() - SUB_BUCKET_BITS
+        if shift <= 0:
+            return units
+        return min((shift + 1) * self._half + (units >> shift) - self._half,
+                   len(self.counts) - 1)
+
+    def _lower_bound(self, index: int) -> int:
+        if index < 2 * self._half:
+            return index
+        shift = index // self._half - 1
+        return (index % self._half + self._half) << shift
+
+    def _record(self, units: int) -> None:
+        """ Caller holds the lock """
+        self.counts[self._index(units)] += 1
+        self.count += 1
+        self.total += units
+        if self.min is None or units < self.min:
+            self.min = units
+        if self.max is None or units > self.max:
+            self.max = units
+
+    def record(self, value: float) -> None:
+        units = max(0, int(value * self.scale))
+        with self._lock:
+            self._record(units)
+
+    def record_locked(self, value: float) -> None:
+        """ record() for a caller already holding the histogram's lock """
+        self._record(max(0, int(value * self.scale)))
+
+    def record_many(self, values: Iterable[float]) -> None:
+        """ Record a batch of values taking the lock once """
+        scale = self.scale
+        with self._lock:
+            for value in values:
+                self._record(max(0, int(value * scale)))
+
+    def quantile(self, q: float) -> float:
+        """
+        :param q: 0..1
+        :return: Lower bound of the bucket holding the q-quantile, 0 when empty
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, round(q * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self._lower_bound(index), self.max) / self.scale
+        return self.max / self.scale
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            if not self.count:
+                return {'count': 0, 'sum': 0.0}
+            out = {'count': self.count,
+                   'sum': self.total / self.scale,
+                   'min': self.min / self.scale,
+                   'max': self.max / self.scale,
+                   'mean': self.total / self.count / self.scale}
+            out.update({f'p{100 * q:g}': self.quantile(q) for q in QUANTILES})
+        return out
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counts = [0] * len(self.counts)
+            self.count = self.total = 0
+            self.min = self.max = None
+
+
+class MetricsRegistry:
+    """
+    Metrics by name and labels. Asking twice for the same metric returns the
+    same instance, so every component can get its metrics at construction.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[Tuple[str, Labels], object] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name: str, labels: Optional[Dict[str, str]], factory):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = self._metrics[key] = factory()
+            return metric
+
+    def counter(self, name: str, help_text: str = '', *,
+                labels: Optional[Dict[str, str]] = None) -> Counter:
+        return self._get(name, labels, lambda: Counter(name, help_text))
+
+    def histogram(self, name: str, help_text: str = '', *,
+                  labels: Optional[Dict[str, str]] = None,
+                  scale: float = LATENCY_SCALE,
+                  lock: Optional[threading.Lock] = None) -> Histogram:
+        return self._get(name, labels,
+                         lambda: Histogram(name, help_text, scale=scale,
+                                           lock=lock))
+
+    def gauge(self, name: str, fn: Callable[[], float], help_text: str = '',
+              *, labels: Optional[Dict[str, str]] = None) -> Gauge:
+        """ A new callback replaces the one of an existing gauge """
+        gauge = self._get(name, labels, lambda: Gauge(name, fn, help_text))
+        gauge.fn = fn
+        return gauge
+
+    def unregister(self, labels: Dict[str, str]) -> int:
+        """
+        Remove the metrics of a stopped component, so the registry doesn't
+        keep it alive through its gauges' callbacks
+        :param labels: Labels every removed metric has
+        :return: Number of metrics removed
+        """
+        items = set(labels.items())
+        with self._lock:
+            keys = [key for key in self._metrics if items <= set(key[1])]
+            for key in keys:
+                del self._metrics[key]
+        return len(keys)
+
+    def reset(self) -> None:
+        """ Zero every counter and histogram, e.g. between benchmark runs """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            if not isinstance(metric, Gauge):
+                metric.reset()
+
+    def snapshot(self) -> Dict[str, object]:
+        """
+        :return: Current value of every metric, keyed by name{labels}
+        """
+        with self._lock:
+            items = list(self._metrics.items())
+        return {_key(name, labels): metric.snapshot()
+                for (name, labels), metric in items}
+
+    def to_prometheus(self) -> str:
+        """
+        :return: Every metric in the Prometheus text exposition format;
+                 histograms are exported as summaries
+        """
+        with self._lock:
+            items = sorted(self._metrics.items(), key=lambda item: item[0])
+        lines = []
+        described = set()
+        for (name, labels), metric in items:
+            if name not in described:
+                described.add(name)
+                kind = {Counter: 'counter', Gauge: 'gauge',
+                        Histogram: 'summary'}[type(metric)]
+                if metric.help:
+                    lines.append(f'# HELP {name} {metric.help}')
+                lines.append(f'# TYPE {name} {kind}')
+            if isinstance(metric, Histogram):
+                snapshot = metric.snapshot()
+                for q in QUANTILES:
+                    value = snapshot.get(f'p{100 * q:g}', float('nan'))
+                    lines.append(f'{_key(name, (*labels, ("quantile", str(q))))}'
+                                 f' {value}')
+                lines.append(f'{_key(name + "_sum", labels)} {snapshot["sum"]}')
+                lines.append(f'{_key(name + "_count", labels)} '
+                             f'{snapshot["count"]}')
+            else:
+                lines.append(f'{_key(name, labels)} {metric.snapshot()}')
+        return '\n'.join(lines) + '\n'
+
+
+def _key(name: str, labels: Labels) -> str:
+    if not labels:
+        return name
+    text = ','.join(f'{k}="{v}"' for k, v in labels)
+    return f'{name}{{{text}}}'
+
+
+REGISTRY = MetricsRegistry()
+
+
+class MetricsServer(threading.Thread):
+    """
+    Local HTTP endpoint serving the registry in the Prometheus text format
+    """
+
+    def __init__(self, *, registry: MetricsRegistry = REGISTRY,
+                 host: str = METRICS_HOST, port: int = METRICS_PORT) -> None:
+        super().__init__(name='MetricsServer', daemon=True, target=self.run)
+        self.registry = registry
+        self.address = (host, port)
+        self.server: Optional[ThreadingHTTPServer] = None
+
+    def start_server(self) -> None:
+        if self.is_alive():
+            print(f'The thread {self.name} is already running!')
+            return
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(self.address, Handler)
+        self.address = self.server.server_address
+        print(f'Starting the thread: {self.name} on '
+              f'http://{self.address[0]}:{self.address[1]}/metrics')
+        self.start()
+
+    def stop_server(self) -> None:
+        if not self.is_alive():
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        self.join(START_STOP_WAIT)
+        if self.is_alive():
+            print(f'Thread {self.name} is still running!')
+        else:
+            print(f'Thread {self.name} has stopped!')
+
+    def run(self) -> None:
+        self.server.serve_forever()
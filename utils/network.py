@@ -10,8 +10,13 @@
 
 import threading
 import time
-from queue import Queue
-from typing import List, Callable
+import weakref
+from collections import deque
+from typing import Dict, List, Callable, Optional, NamedTuple
+from utils.ringbuffer import RingBuffer, OverflowPolicy, DEFAULT_BLOCK_TIMEOUT
+from utils.metrics import REGISTRY, instance_id
+from utils.clock import Clock, SYSTEM_CLOCK
+from service.model.codec import message_timestamp
 
 
 N_MESSAGES = 5
@@ -19,6 +24,342 @@ DEFAULT_WAIT = 1            # Wait at most 1 sec
 START_STOP_WAIT = 2         # 2 s
 NETWORK_INTERVAL = 0.5      # 500 ms
 NETWORK_START_WAIT = 5      # 5 s
+FLUSH_LATENCY = 0.05        # 50 ms
+SINK_CAPACITY = 100_000     # Messages waiting for a subscriber
+SEND_BATCH = 256            # Messages a BatchSender submits at once
+SEND_LINGER = 0.01          # 10 ms, longest a message waits in a BatchSender
+
+
+class FlushPolicy(NamedTuple):
+    """
+    The network hands the queued messages to the repository as soon as
+    max_batch messages are waiting or the oldest one is max_latency seconds
+    old, whichever happens first.
+    """
+    max_batch: int = N_MESSAGES
+    max_latency: float = FLUSH_LATENCY
+
+
+class Subscription(threading.Thread):
+    """
+    A subscriber of the network: its own bounded queue of batches and its own
+    worker thread calling the subscriber's notification function, so a slow
+    subscriber only fills its own queue. When the queue is full the overflow
+    policy applies to this subscriber alone.
+    Batches are shared by every subscriber and must not be modified. The
+    batches waiting when the worker gets to them are delivered as one, so a
+    slow subscriber gets larger batches.
+    """
+
+    def __init__(self, *, name: str, notification_fn: Callable,
+                 capacity: int = SINK_CAPACITY,
+                 policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+                 block_timeout: float = DEFAULT_BLOCK_TIMEOUT,
+                 clock: Clock = SYSTEM_CLOCK) -> None:
+        """
+        :param name: Subscriber's name
+        :param notification_fn: Called by the worker for every batch, it
+                                takes the batch with get()
+        :param capacity: Maximum number of messages waiting
+        :param policy: BLOCK, DROP_OLDEST or DROP_NEWEST
+        :param block_timeout: Longest wait of the BLOCK policy
+        :param clock: Time source of the lag
+        """
+        if policy is OverflowPolicy.SPILL:
+            raise ValueError('Subscriptions do not support the SPILL policy')
+        super().__init__(name=f'Subscription-{name}', daemon=True,
+                         target=self.run)
+        self.sink_name = name
+        self.notification_fn = notification_fn
+        self.capacity = capacity
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.clock = clock
+        self._pending = deque()         # (enqueue time, batch)
+        self._n_pending = 0
+        self._current = []
+        self._busy = False
+        self._closed = False
+        self._condition = threading.Condition()
+        # Counters
+        self.delivered = 0
+        self.dropped = 0
+        self.high_water = 0
+
+    def offer(self, batch: List) -> None:
+        """
+        Queue a batch for the subscriber, applying the overflow policy
+        :param batch: List of messages
+        :return: None
+        """
+        with self._condition:
+            if self._n_pending + len(batch) > self.capacity and \
+                    self.policy is OverflowPolicy.BLOCK:
+                self._condition.wait_for(
+                    lambda: self._n_pending + len(batch) <= self.capacity,
+                    self.block_timeout)
+            while self._pending and \
+                    self._n_pending + len(batch) > self.capacity and \
+                    self.policy is OverflowPolicy.DROP_OLDEST:
+                _, oldest = self._pending.popleft()
+                self._n_pending -= len(oldest)
+                self.dropped += len(oldest)
+            if self._n_pending + len(batch) > self.capacity:
+                self.dropped += len(batch)
+                return
+            self._pending.append((self.clock.monotonic(), batch))
+            self._n_pending += len(batch)
+            self.high_water = max(self.high_water, self._n_pending)
+            self._condition.notify_all()
+
+    def get(self) -> List:
+        """
+        :return: The batch being delivered
+        """
+        batch, self._current = self._current, []
+        return batch
+
+    def lag(self) -> float:
+        """
+        :return: Seconds the oldest waiting batch has been queued
+        """
+        with self._condition:
+            if not self._pending:
+                return 0.0
+            return self.clock.monotonic() - self._pending[0][0]
+
+    def stats(self) -> dict:
+        return {'pending': self._n_pending,
+                'pending_batches': len(self._pending),
+                'delivered': self.delivered,
+                'dropped': self.dropped,
+                'high_water': self.high_water,
+                'lag_seconds': self.lag()}
+
+    def wait_delivered(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every queued batch has been delivered
+        :return: False on timeout
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._pending and not self._busy, timeout)
+
+    def close(self, wait: bool = True) -> None:
+        """
+        Deliver what is queued, then stop the worker
+        :param wait: Wait for the worker to finish
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if wait:
+            self.join(START_STOP_WAIT)
+
+    def run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._pending or self._closed)
+                if not self._pending:
+                    return
+                if len(self._pending) == 1:
+                    _, batch = self._pending.popleft()
+                else:
+                    batch = [message for _, waiting in self._pending
+                             for message in waiting]
+                    self._pending.clear()
+                self._n_pending = 0
+                self._busy = True
+                self._condition.notify_all()
+            self._current = batch
+            try:
+                self.notification_fn()
+            except Exception as err:
+                print(f'Subscriber {self.sink_name} failed: {err}')
+            with self._condition:
+                self.delivered += len(batch)
+                self._busy = False
+                self._condition.notify_all()
+
+
+class SendBuffer(deque):
+    """
+    Messages collected by one producing thread. The owner appends, the owner
+    or the linger thread take, both without a lock: deque's append and
+    popleft are atomic. The buffer only holds a weak reference to its owner,
+    so it can be dropped once the owner has exited and it is empty.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.first_at = 0.0         # Clock's monotonic time of the oldest
+        self.owner = weakref.ref(threading.current_thread())
+
+    def is_orphan(self) -> bool:
+        """ :return: True when the owner has exited and nothing is left """
+        owner = self.owner()
+        return not self and (owner is None or not owner.is_alive())
+
+    def take(self, n: int) -> List:
+        """ :return: Up to n messages, oldest first """
+        batch = []
+        try:
+            for _ in range(n):
+                batch.append(self.popleft())
+        except IndexError:
+            pass
+        return batch
+
+
+class BatchSender(threading.Thread):
+    """
+    Client side batching for producers sending many messages, e.g. the
+    sensors of a scheduler: every producing thread collects its messages in
+    its own buffer, without a lock, and submits them with a single
+    Network.send_batch, taking the network's queue lock once per batch
+    instead of once per message. A batch is submitted when it holds
+    max_batch messages or its first message is max_linger seconds old on
+    the network's clock.
+    The sender stands for the network towards the sensors: give it as their
+    net, it provides connect_device().
+    """
+
+    def __init__(self, *, network: 'Network', max_batch: int = SEND_BATCH,
+                 max_linger: float = SEND_LINGER) -> None:
+        """
+        :param network: Network receiving the batches
+        :param max_batch: Messages per batch
+        :param max_linger: Longest wait of a message, in seconds
+        """
+        super().__init__(name='BatchSender', daemon=True, target=self.run)
+        if max_batch < 1:
+            raise ValueError('The batch size must be positive')
+        self.network = network
+        self.clock = network.clock
+        self.max_batch = max_batch
+        self.max_linger = max_linger
+        self._local = threading.local()
+        self._buffers: List[SendBuffer] = []
+        self._lock = threading.Lock()
+        self._filled = threading.Event()    # A buffer got its first message
+        self._stopping = threading.Event()
+        self._closed = False
+        self.n_batches = 0
+        self.n_messages = 0
+        self.n_dropped = 0
+
+    def connect_device(self) -> Callable:
+        """
+        Subscription method for the sensors
+        :return: returns the function collecting their messages
+        """
+        return self.send
+
+    def _buffer(self) -> SendBuffer:
+        """ Buffer of the calling thread, registered on first use """
+        buffer = SendBuffer()
+        with self._lock:
+            self._buffers.append(buffer)
+        self._local.buffer = buffer
+        return buffer
+
+    def send(self, message) -> bool:
+        """
+        Collect a message, submitting the batch when it is full
+        :param message: DeviceMessage
+        :return: True, drops of the network queue are counted in stats()
+        """
+        try:
+            buffer = self._local.buffer
+        except AttributeError:
+            buffer = self._buffer()
+        buffer.append(message)
+        size = len(buffer)
+        if size == 1:
+            buffer.first_at = self.clock.monotonic()
+            self._filled.set()
+        if size >= self.max_batch or self._closed:
+            self._submit(buffer.take(size))
+        return True
+
+    def flush(self) -> None:
+        """ Submit what has been collected so far """
+        with self._lock:
+            buffers = list(self._buffers)
+        for buffer in buffers:
+            while buffer:
+                self._submit(buffer.take(self.max_batch))
+        self._prune()
+
+    def _prune(self) -> None:
+        """ Drop the drained buffers of the threads that have exited """
+        with self._lock:
+            self._buffers = [buffer for buffer in self._buffers
+                             if not buffer.is_orphan()]
+
+    def _submit(self, batch: List) -> None:
+        if not batch:
+            return
+        accepted = self.network.send_batch(batch)
+        with self._lock:
+            self.n_batches += 1
+            self.n_messages += len(batch)
+            self.n_dropped += len(batch) - accepted
+
+    def stats(self) -> dict:
+        """
+        :return: Batches and messages submitted, messages dropped
+        """
+        return {'batches': self.n_batches,
+                'messages': self.n_messages,
+                'dropped': self.n_dropped,
+                'mean_batch': (self.n_messages / self.n_batches
+                               if self.n_batches else 0.0),
+                'waiting': sum(len(buffer) for buffer in self._buffers)}
+
+    def start_sender(self) -> None:
+        if self.is_alive():
+            print(f'The thread {self.name} is already running!')
+            return
+        print(f'Starting the thread: {self.name}')
+        self.start()
+
+    def stop_sender(self) -> None:
+        """ Submit what is waiting, then stop the linger thread """
+        self._closed = True
+        self._stopping.set()
+        self._filled.set()
+        if self.is_alive():
+            self.join(START_STOP_WAIT)
+        self.flush()
+
+    def run(self) -> None:
+        """
+        Thread's worker function: submit the batches whose first message
+        reaches max_linger
+        :return: None
+        """
+        while not self._stopping.is_set():
+            self._filled.wait()
+            self._filled.clear()
+            with self._lock:
+                buffers = list(self._buffers)
+            next_due = None
+            now = self.clock.monotonic()
+            for buffer in buffers:
+                if not buffer:
+                    continue
+                due = buffer.first_at + self.max_linger
+                if due <= now:
+                    self._submit(buffer.take(len(buffer)))
+                elif next_due is None or due < next_due:
+                    next_due = due
+            self._prune()
+            if next_due is not None:
+                # Still lingering: look again when the oldest is due
+                self._filled.set()
+                self._stopping.wait(next_due - now)
 
 
 class Network(threading.Thread):
@@ -26,59 +367,135 @@ class Network(threading.Thread):
     Logging service for devices and repository
     """
 
-    def __init__(self):
+    def __init__(self, *, capacity: int = 3 * N_MESSAGES,
+                 overflow_policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+                 block_timeout: float = DEFAULT_BLOCK_TIMEOUT,
+                 spill_path: Optional[str] = None,
+                 flush_policy: FlushPolicy = FlushPolicy(),
+                 clock: Clock = SYSTEM_CLOCK):
+        """
+        :param capacity: Maximum number of messages in flight
+        :param overflow_policy: What send() does when the queue is full
+        :param block_timeout: Longest wait of the BLOCK policy
+        :param spill_path: Overflow file of the SPILL policy
+        :param flush_policy: When the queued messages go to the repository
+        :param clock: Time source, e.g. a VirtualClock
+        """
         super().__init__(name='Network', target=self.run,
                          daemon=True)
-        self.lock = threading.Lock()
-        self.message_queue = Queue(maxsize=3*N_MESSAGES)
+        self.message_queue = RingBuffer(capacity, policy=overflow_policy,
+                                        block_timeout=block_timeout,
+                                        spill_path=spill_path)
+        self.flush_policy = flush_policy
+        self.clock = clock
         self.devices = dict()
-        self.notify_repo = None
+        self.subscriptions: Dict[str, Subscription] = {}
         self.start_running = threading.Event()
+        self._register_metrics()
+
+    def _register_metrics(self) -> None:
+        # Networks share a name, the id keeps their metrics apart
+        labels = self.metric_labels = {'network': self.name,
+                                       'id': instance_id()}
+        # Recorded by send() in the queue's critical section
+        self.enqueue_latency = REGISTRY.histogram(
+            'network_enqueue_latency_seconds',
+            'Sensor readout to network enqueue', labels=labels,
+            lock=self.message_queue.lock)
+        self.batch_size = REGISTRY.histogram(
+            'network_batch_size', 'Messages handed to the repository at once',
+            labels=labels, scale=1)
+        for key, help_text in (('depth', 'Messages in the queue'),
+                               ('high_water', 'Highest queue depth'),
+                               ('enqueued', 'Messages accepted'),
+                               ('dropped', 'Messages dropped on overflow'),
+                               ('spilled', 'Messages spilled to disk')):
+            REGISTRY.gauge(f'network_queue_{key}',
+                           lambda key=key: self.message_queue.stats()[key],
+                           help_text, labels=labels)
 
-    def start_network(self) -> None:
+    def start_network(self, wait: bool = True) -> None:
+        """
+        :param wait: Give the thread START_STOP_WAIT seconds to get going
+        """
         if not self.is_alive():
             # Activate the thread
             print(f'Starting the thread: {self.name}')
             self.start()
             self.start_running.set()
-            time.sleep(START_STOP_WAIT)
+            if wait:
+                self.clock.sleep(START_STOP_WAIT)
             return
         print(f'The thread {self.name} is already running!')
 
-    def stop_network(self) -> None:
+    def stop_network(self, timeout: float = START_STOP_WAIT) -> None:
+        """
+        Stop the thread, then let the subscribers deliver what they hold
+        :param timeout: Longest wait for the thread and the subscribers
+                        together, in seconds
+        """
         if not self.is_alive():
             return
+        deadline = time.monotonic() + timeout
         self.start_running.clear()
-        self.join(1.5 * NETWORK_INTERVAL)
+        self.message_queue.wake()
+        self.join(min(1.5 * NETWORK_INTERVAL, timeout))
         if self.is_alive():
             print(f'Thread {self.name} is still running!')
         else:
             print(f'Thread {self.name} has stopped!')
+        # The subscribers deliver what they hold concurrently
+        for subscription in self.subscriptions.values():
+            subscription.close(wait=False)
+        for subscription in self.subscriptions.values():
+            subscription.join(max(0.0, deadline - time.monotonic()))
+        REGISTRY.unregister(self.metric_labels)
 
-    def send(self, message: str) -> None:
+    def send(self, message: str) -> bool:
         """
         All Sensor devices place their messages into a thread safe queue.
         The access is provided by setting this function as a callback to each sensor
+        A full queue is handled by the overflow policy, it never raises.
         :param message: SensorDeviceMessage
-        :return: None
+        :return: False when the message was dropped
+        """
+        timestamp = message_timestamp(message)
+        now = self.clock.time()
+        message_queue = self.message_queue
+        with message_queue.lock:
+            accepted = message_queue.put_locked(message)
+            if accepted and timestamp is not None:
+                self.enqueue_latency.record_locked(now - timestamp)
+        return accepted
+
+    def send_batch(self, messages: List) -> int:
+        """
+        Place many messages into the queue at once, taking its lock once.
+        The overflow policy applies to every message as in send().
+        :param messages: List of SensorDeviceMessage, oldest first
+        :return: Number of messages accepted
         """
-        with self.lock:
-            print("Inserting message into the queue")
-            self.message_queue.put_nowait(message)
+        accepted = self.message_queue.put_many(messages)
+        now = self.clock.time()
+        self.enqueue_latency.record_many(
+            now - timestamp for timestamp in map(message_timestamp, messages)
+            if timestamp is not None)
+        return accepted
 
     def get(self) -> List[str]:
         """
-        Extract the readout messages from the Sensor devices placed into the queue
-        in groups of N_MESSAGES
+        Extract every readout message placed into the queue in one batch
         :return:
         """
-        result = []
-        # with self.lock:
-        print("Storing messages into repository")
-        for _ in range(self.message_queue.qsize()):
-            item = self.message_queue.get_nowait()
-            result.append(item)
-        return result
+        messages = self.message_queue.drain()
+        self.batch_size.record(len(messages))
+        return messages
+
+    def queue_stats(self) -> dict:
+        """
+        :return: Enqueued, dropped and high-water mark counters of the queue
+        """
+        return self.message_queue.stats()
 
     def connect_device(self) -> Callable:
         """
@@ -88,20 +505,88 @@ class Network(threading.Thread):
         # Provide the callback function to the device
         return self.send
 
-    def connect_repository(self, notification_fn: Callable) -> Callable:
+    def connect_device_batch(self, *, max_batch: int = SEND_BATCH,
+                             max_linger: float = SEND_LINGER) -> BatchSender:
+        """
+        Batched subscription for many devices: the returned BatchSender is
+        given to the sensors as their net, and started with start_sender()
+        :param max_batch: Messages per batch
+        :param max_linger: Longest wait of a message, in seconds
+        :return: BatchSender
+        """
+        return BatchSender(network=self, max_batch=max_batch,
+                           max_linger=max_linger)
+
+    def connect_repository(self, notification_fn: Callable, *,
+                           name: Optional[str] = None,
+                           capacity: int = SINK_CAPACITY,
+                           policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+                           block_timeout: float = DEFAULT_BLOCK_TIMEOUT) \
+            -> Callable:
+        """
+        Subscribe a repository. Every subscriber gets every batch, through
+        its own bounded queue and worker thread.
+        :param notification_fn: Called for every batch
+        :param name: Subscriber's name, used in the stats and metrics
+        :param capacity: Messages that can wait for this subscriber
+        :param policy: What happens to this subscriber's batches when its
+                       queue is full
+        :param block_timeout: Longest wait of the BLOCK policy
+        :return: returns the function to get the batch being delivered
+        """
+        name = name or f'subscriber-{len(self.subscriptions)}'
+        if name in self.subscriptions:
+            raise ValueError(f'The network already has a subscriber {name}')
+        subscription = Subscription(name=name, notification_fn=notification_fn,
+                                    capacity=capacity, policy=policy,
+                                    block_timeout=block_timeout,
+                                    clock=self.clock)
+        self.subscriptions[name] = subscription
+        labels = {**self.metric_labels, 'sink': name}
+        for key, help_text in (('pending', 'Messages waiting for the sink'),
+                               ('dropped', 'Messages the sink missed'),
+                               ('lag_seconds', 'Age of the oldest waiting batch')):
+            REGISTRY.gauge(f'network_sink_{key}',
+                           lambda key=key: subscription.stats()[key],
+                           help_text, labels=labels)
+        subscription.start()
+        return subscription.get
+
+    def sink_stats(self) -> Dict[str, dict]:
+        """
+        :return: Pending, delivered and dropped messages and the lag of every
+                 subscriber
+        """
+        return {name: subscription.stats()
+                for name, subscription in self.subscriptions.items()}
+
+    def wait_delivered(self, timeout: Optional[float] = None) -> bool:
         """
-        Subscribe the repository
-        :return: returns the function to get data from the queue
+        Wait until every subscriber got every batch handed over so far
+        :return: False on timeout
         """
-        self.notify_repo = notification_fn
-        return self.get
+        return all(subscription.wait_delivered(timeout)
+                   for subscription in self.subscriptions.values())
 
     def notify_repository(self) -> None:
-        self.notify_repo()
+        """ Drain the queue once and hand the batch over to every subscriber """
+        messages = self.get()
+        if not messages:
+            return
+        for subscription in self.subscriptions.values():
+            subscription.offer(messages)
 
     def run(self) -> None:
+        """
+        Sleep until the flush policy is met, then hand the batch over to the
+        subscribers.
+        Whatever is still queued when the network stops is delivered too.
+        :return: None
+        """
         self.start_running.wait()
+        max_batch, max_latency = self.flush_policy
         while self.start_running.is_set():
-            time.sleep(NETWORK_INTERVAL)
-            with self.lock:
+            if self.message_queue.wait_ready(max_batch, max_latency):
                 self.notify_repository()
+        if len(self.message_queue):
+            self.notify_repository()
@@ -0,0 +1,237 @@
+"""
+  Bounded ring buffer for the Network's message queue.
+  Many producers (the sensors) put messages and one consumer drains them in
+  batches. The critical section only moves indexes and slot references, and
+  a full buffer is handled by an explicit overflow policy so a burst never
+  raises into the producer.
+"""
+
+import os
+import pickle
+import threading
+import time
+from enum import Enum
+from typing import Any, List, Optional
+
+
+DEFAULT_BLOCK_TIMEOUT = 0.1     # 100 ms
+
+
+class OverflowPolicy(Enum):
+    BLOCK = 'block'                 # Wait up to block_timeout, then drop it
+    DROP_OLDEST = 'drop_oldest'     # Overwrite the oldest message
+    DROP_NEWEST = 'drop_newest'     # Discard the incoming message
+    SPILL = 'spill'                 # Append the overflow to a spill file
+
+
+class RingBuffer:
+    """
+    Preallocated MPSC ring buffer with batch drain
+    """
+
+    def __init__(self, capacity: int, *,
+                 policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+                 block_timeout: float = DEFAULT_BLOCK_TIMEOUT,
+                 spill_path: Optional[str] = None) -> None:
+        if capacity < 1:
+            raise ValueError('The ring buffer capacity must be positive')
+        if policy is OverflowPolicy.SPILL and spill_path is None:
+            raise ValueError('The SPILL policy requires a spill_path')
+        self.capacity = capacity
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.spill_path = spill_path
+        self._slots: List[Any] = [None] * capacity
+        self._times: List[float] = [0.0] * capacity     # Enqueue times
+        self._head = 0      # Next slot to read
+        self._tail = 0      # Next slot to write
+        self.lock = threading.Lock()
+        self._not_full = threading.Condition(self.lock)
+        self._ready = threading.Condition(self.lock)
+        self._ready_depth = None    # Depth the consumer is waiting for
+        self._interrupted = False
+        self._spill_file = None
+        self._spill_read = 0
+        self._spill_pending = 0
+        # Counters
+        self.enqueued = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.high_water = 0
+
+    def __len__(self) -> int:
+        return self._tail - self._head + self._spill_pending
+
+    def stats(self) -> dict:
+        return {'capacity': self.capacity,
+                'policy': self.policy.value,
+                'depth': len(self),
+                'enqueued': self.enqueued,
+                'dropped': self.dropped,
+                'spilled': self.spilled,
+                'high_water': self.high_water}
+
+    def put(self, item: Any) -> bool:
+        """
+        Add an item, applying the overflow policy when the buffer is full
+        :param item: Any
+        :return: False when the item was dropped
+        """
+        with self.lock:
+            return self._put(item, time.monotonic())
+
+    def put_locked(self, item: Any) -> bool:
+        """
+        put() for a caller already holding self.lock, e.g. to record the
+        message's metrics in the same critical section
+        :param item: Any
+        :return: False when the item was dropped
+        """
+        return self._put(item, time.monotonic())
+
+    def put_many(self, items: List[Any]) -> int:
+        """
+        Add several items taking the lock once, the overflow policy applies
+        to every item as in put()
+        :param items: List of items, oldest first
+        :return: Number of items accepted
+        """
+        with self.lock:
+            now = time.monotonic()
+            return sum(self._put(item, now) for item in items)
+
+    def _put(self, item: Any, now: float) -> bool:
+        """ Add an item. Caller holds the lock """
+        if self._spill_pending:
+            # Keep FIFO order while older items are still on disk
+            self._spill(item)
+            return True
+        if self._tail - self._head >= self.capacity:
+            if self.policy is OverflowPolicy.DROP_NEWEST:
+                self.dropped += 1
+                return False
+            if self.policy is OverflowPolicy.DROP_OLDEST:
+                self._head += 1
+                self.dropped += 1
+            elif self.policy is OverflowPolicy.SPILL:
+                self._spill(item)
+                return True
+            elif not self._not_full.wait_for(
+                    lambda: self._tail - self._head < self.capacity,
+                    self.block_timeout):
+                self.dropped += 1
+                return False
+        slot = self._tail % self.capacity
+        self._slots[slot] = item
+        self._times[slot] = now
+        self._tail += 1
+        self.enqueued += 1
+        depth = self._tail - self._head
+        if depth > self.high_water:
+            self.high_water = depth
+        if self._ready_depth is not None and \
+                (depth == 1 or depth >= self._ready_depth):
+            # First message starts the consumer's latency timer
+            self._ready.notify()
+        return True
+
+    def oldest_age(self) -> Optional[float]:
+        """
+        :return: Seconds since the oldest buffered item was added, or None
+        """
+        with self.lock:
+            if self._tail == self._head:
+                return None
+            return time.monotonic() - self._times[self._head % self.capacity]
+
+    def wait_ready(self, max_items: int, max_latency: float) -> bool:
+        """
+        Consumer side. Block until max_items are buffered or the oldest item
+        is max_latency seconds old, whichever happens first. An empty buffer
+        is waited for without any timeout.
+        :param max_items: Batch size that triggers a flush
+        :param max_latency: Age of the oldest item that triggers a flush
+        :return: False when interrupted by wake() before being ready
+        """
+        with self.lock:
+            self._ready_depth = max_items
+            try:
+                while not self._interrupted:
+                    depth = self._tail - self._head
+                    if depth >= max_items or self._spill_pending:
+                        return True
+                    if not depth:
+                        self._ready.wait()
+                        continue
+                    oldest = self._times[self._head % self.capacity]
+                    remaining = oldest + max_latency - time.monotonic()
+                    if remaining <= 0:
+                        return True
+                    self._ready.wait(remaining)
+                return False
+            finally:
+                self._interrupted = False
+                self._ready_depth = None
+
+    def wake(self) -> None:
+        """ Interrupt a consumer blocked in wait_ready() """
+        with self.lock:
+            self._interrupted = True
+            self._ready.notify_all()
+
+    def drain(self, max_items: Optional[int] = None) -> List[Any]:
+        """
+        Remove up to max_items items at once, oldest first
+        :param max_items: int, everything by default
+        :return: List of items
+        """
+        with self.lock:
+            count = self._tail - self._head
+            if max_items is not None:
+                count = min(count, max_items)
+            result = []
+            for index in range(self._head, self._head + count):
+                slot = index % self.capacity
+                result.append(self._slots[slot])
+                self._slots[slot] = None
+            self._head += count
+            if count:
+                self._not_full.notify_all()
+            if self._spill_pending and self._tail == self._head:
+                room = None if max_items is None else max_items - count
+                result.extend(self._unspill(room))
+            return result
+
+    def _spill(self, item: Any) -> None:
+        """ Append an item to the spill file. Caller holds the lock """
+        if self._spill_file is None:
+            self._spill_file = open(self.spill_path, 'w+b')
+        self._spill_file.seek(0, os.SEEK_END)
+        pickle.dump(item, self._spill_file)
+        self._spill_pending += 1
+        self.spilled += 1
+        self.enqueued += 1
+
+    def _unspill(self, max_items: Optional[int]) -> List[Any]:
+        """ Read back spilled items, oldest first. Caller holds the lock """
+        count = self._spill_pending
+        if max_items is not None:
+            count = min(count, max_items)
+        self._spill_file.flush()
+        self._spill_file.seek(self._spill_read)
+        result = [pickle.load(self._spill_file) for _ in range(count)]
+        self._spill_read = self._spill_file.tell()
+        self._spill_pending -= count
+        if not self._spill_pending:
+            self._spill_file.truncate(0)
+            self._spill_read = 0
+        return result
+
+    def close(self) -> None:
+        """ Close and remove the spill file """
+        with self.lock:
+            if self._spill_file is not None:
+                self._spill_file.close()
+                self._spill_file = None
+                os.remove(self.spill_path)
+                self._spill_pending = 0
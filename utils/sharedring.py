@@ -0,0 +1,107 @@
+"""
+  Single producer / single consumer ring buffer in shared memory.
+  A worker process writes length-prefixed records into fixed-size slots and
+  the parent process reads them back without pickling. Each side only
+  writes its own counter: the producer the tail, the consumer the head.
+"""
+
+import struct
+from multiprocessing import shared_memory
+from typing import List, Optional
+
+
+HEADER = struct.Struct('<QQQQQ')     # head, tail, capacity, slot_size, dropped
+HEAD_OFFSET = 0
+TAIL_OFFSET = 8
+DROPPED_OFFSET = 32
+COUNTER = struct.Struct('<Q')
+LENGTH = struct.Struct('<H')
+DEFAULT_CAPACITY = 4096
+DEFAULT_SLOT_SIZE = 256
+
+
+class SharedRingBuffer:
+    """
+    Fixed-slot ring buffer living in a multiprocessing.shared_memory block
+    """
+
+    def __init__(self, *, name: Optional[str] = None,
+                 capacity: int = DEFAULT_CAPACITY,
+                 slot_size: int = DEFAULT_SLOT_SIZE) -> None:
+        """
+        Create a new ring buffer, or attach to an existing one by name
+        :param name: Shared memory block name. None creates a new block.
+        :param capacity: Number of slots (new block only)
+        :param slot_size: Bytes per slot, length prefix included (new block only)
+        """
+        if name is None:
+            size = HEADER.size + capacity * slot_size
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            HEADER.pack_into(self.shm.buf, 0, 0, 0, capacity, slot_size, 0)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        _, _, self.capacity, self.slot_size, _ = HEADER.unpack_from(self.shm.buf)
+        self.max_record = self.slot_size - LENGTH.size
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def _counter(self, offset: int) -> int:
+        return COUNTER.unpack_from(self.shm.buf, offset)[0]
+
+    def __len__(self) -> int:
+        return self._counter(TAIL_OFFSET) - self._counter(HEAD_OFFSET)
+
+    @property
+    def dropped(self) -> int:
+        return self._counter(DROPPED_OFFSET)
+
+    def put(self, record: bytes) -> bool:
+        """
+        Producer side. Write a record into the next free slot.
+        :param record: bytes, at most slot_size - 2 long
+        :return: False when the ring is full and the record was dropped
+        """
+        if len(record) > self.max_record:
+            raise ValueError(f'Record of {len(record)} bytes exceeds the '
+                             f'{self.max_record} bytes slot')
+        tail = self._counter(TAIL_OFFSET)
+        if tail - self._counter(HEAD_OFFSET) >= self.capacity:
+            COUNTER.pack_into(self.shm.buf, DROPPED_OFFSET, self.dropped + 1)
+            return False
+        offset = HEADER.size + (tail % self.capacity) * self.slot_size
+        LENGTH.pack_into(self.shm.buf, offset, len(record))
+        start = offset + LENGTH.size
+        self.shm.buf[start:start + len(record)] = record
+        # Publish the slot only once its content is in place
+        COUNTER.pack_into(self.shm.buf, TAIL_OFFSET, tail + 1)
+        return True
+
+    def get_batch(self, max_records: Optional[int] = None) -> List[bytes]:
+        """
+        Consumer side. Read every available record, up to max_records.
+        :param max_records: int
+        :return: List of records, oldest first
+        """
+        head = self._counter(HEAD_OFFSET)
+        tail = self._counter(TAIL_OFFSET)
+        if max_records is not None:
+            tail = min(tail, head + max_records)
+        buf = self.shm.buf
+        result = []
+        for index in range(head, tail):
+            offset = HEADER.size + (index % self.capacity) * self.slot_size
+            length = LENGTH.unpack_from(buf, offset)[0]
+            start = offset + LENGTH.size
+            result.append(bytes(buf[start:start + length]))
+        COUNTER.pack_into(buf, HEAD_OFFSET, tail)
+        return result
+
+    def close(self) -> None:
+        """ Detach from the block, and destroy it when this side created it """
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()